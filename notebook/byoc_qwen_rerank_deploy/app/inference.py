@@ -89,8 +89,12 @@ def main() -> int:
         logger.info("Invoked with request...")
 
         body = await request.json()
-        inputs = body.get("inputs")
         docs = body.get("docs")
+        # 查询可以只传一次("query")，也可以按文档逐个传("inputs")
+        if "query" in body:
+            inputs = [body["query"]] * len(docs)
+        else:
+            inputs = body.get("inputs")
 
         try:
             scores = Rerank(queries=inputs, docs=docs, app=app)
@@ -0,0 +1,154 @@
+"""
+Cache of rerank scores.
+Scores are cached per (model, query, document) pair, keyed by hashes of the normalized query and of the document,
+so that reranking overlapping documents again (follow-up turns of a chat, agent loops) only scores the documents
+that weren't seen with that query yet. Entries are evicted least recently used first and expire after a TTL.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, can be overridden by environment variables of the plugin process.
+# This module is shared as is by the plugins of this repository, hence the settings without plugin prefix
+_CACHE_ENABLED = os.environ.get("RERANK_CACHE_ENABLED", "true").lower() == "true"
+_CACHE_MAX_ENTRIES = int(os.environ.get("RERANK_CACHE_MAX_ENTRIES", "65536"))
+_CACHE_TTL = float(os.environ.get("RERANK_CACHE_TTL_SECONDS", "3600"))
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so that queries differing only by Unicode form or whitespace share their scores
+    """
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class RerankScoreCache:
+    """LRU cache of rerank scores with expiry"""
+
+    def __init__(self, max_entries: int = _CACHE_MAX_ENTRIES, ttl: float = _CACHE_TTL):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (stored at, score)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _keys(namespace: tuple, query: str, docs: list[str]) -> list[bytes]:
+        query_digest = hashlib.blake2b(normalize_query(query).encode("utf-8", "surrogatepass"), digest_size=16)
+        prefix = hashlib.blake2b(repr(namespace).encode("utf-8"), digest_size=16)
+        prefix.update(query_digest.digest())
+        keys = []
+        for doc in docs:
+            key = prefix.copy()
+            key.update(hashlib.blake2b(doc.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+            keys.append(key.digest())
+        return keys
+
+    def _lookup(self, keys: list[bytes]) -> dict[bytes, float]:
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if now - entry[0] > self._ttl:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+            self._hits += len(found)
+            self._misses += len(keys) - len(found)
+        return found
+
+    def _store(self, items: dict[bytes, float]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key, score in items.items():
+                self._entries[key] = (now, score)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def score(
+        self,
+        namespace: tuple,
+        query: str,
+        docs: list[str],
+        score_docs: Callable[[list[str]], list[float]],
+        on_lookup: Optional[Callable[[int, int], None]] = None,
+    ) -> list[float]:
+        """
+        Score documents against a query, only sending the cache misses (deduplicated) to score_docs
+
+        :param namespace: model and settings the scores depend on
+        :param query: search query
+        :param docs: documents
+        :param score_docs: function scoring a list of documents against the query, in order
+        :param on_lookup: called with the numbers of hits and misses, e.g. to count them in metrics
+        :return: scores in the same order as docs
+        """
+        keys = self._keys(namespace, query, docs)
+        unique_keys = list(dict.fromkeys(keys))
+        found = self._lookup(unique_keys)
+
+        missing: dict[bytes, str] = {}
+        for key, doc in zip(keys, docs):
+            if key not in found and key not in missing:
+                missing[key] = doc
+        if on_lookup:
+            on_lookup(len(found), len(missing))
+
+        if missing:
+            scores = score_docs(list(missing.values()))
+            if len(scores) != len(missing):
+                raise ValueError(f"Got {len(scores)} rerank scores for {len(missing)} documents")
+            fresh = dict(zip(missing.keys(), scores))
+            self._store(fresh)
+            found.update(fresh)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Rerank cache: %d/%d hits, stats: %s", len(unique_keys) - len(missing), len(unique_keys), self.stats()
+            )
+        return [found[key] for key in keys]
+
+
+_rerank_cache: Optional[RerankScoreCache] = None
+_rerank_cache_lock = threading.Lock()
+
+
+def get_rerank_cache() -> Optional[RerankScoreCache]:
+    """
+    Get the process-wide rerank score cache, None if caching is disabled
+    """
+    global _rerank_cache
+    if not _CACHE_ENABLED:
+        return None
+    with _rerank_cache_lock:
+        if _rerank_cache is None:
+            _rerank_cache = RerankScoreCache()
+        return _rerank_cache
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import operator
 from typing import Any, Union
@@ -8,9 +9,12 @@ import boto3
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 
+from provider.rerank_cache import get_rerank_cache
+
 class SageMakerReRankTool(Tool):
     sagemaker_client: Any = None
     sagemaker_endpoint: str = None
+    credentials_digest: str = None
 
     def _sagemaker_rerank(self, query_input: str, docs: list[str], rerank_endpoint: str):
         inputs = [query_input] * len(docs)
@@ -22,7 +26,10 @@ class SageMakerReRankTool(Tool):
         json_str = response_model["Body"].read().decode("utf8")
         json_obj = json.loads(json_str)
         scores = json_obj["scores"]
-        return scores if isinstance(scores, list) else [scores]
+        scores = scores if isinstance(scores, list) else [scores]
+        if len(scores) != len(docs):
+            raise ValueError(f"Endpoint {rerank_endpoint} returned {len(scores)} scores for {len(docs)} docs")
+        return scores
 
     def _invoke(
         self,
@@ -39,6 +46,12 @@ class SageMakerReRankTool(Tool):
                     self.sagemaker_client = boto3.client("sagemaker-runtime", region_name=aws_region)
                 else:
                     self.sagemaker_client = boto3.client("sagemaker-runtime")
+                # Endpoint names are per account, the rerank cache is keyed by the client's access key too.
+                # The client was created by the default session, which holds the credentials it resolved
+                aws_credentials = boto3.DEFAULT_SESSION.get_credentials()
+                self.credentials_digest = hashlib.sha256(
+                    (aws_credentials.access_key if aws_credentials else "").encode()
+                ).hexdigest()
 
             line = 1
             if not self.sagemaker_endpoint:
@@ -62,7 +75,22 @@ class SageMakerReRankTool(Tool):
             docs = [item.get("content") for item in candidate_docs]
 
             line = 6
-            scores = self._sagemaker_rerank(query_input=query, docs=docs, rerank_endpoint=self.sagemaker_endpoint)
+            # Only the docs that were not scored against the query yet are sent to the endpoint
+            rerank_cache = get_rerank_cache()
+            if rerank_cache:
+                cache_namespace = (
+                    self.sagemaker_endpoint, self.sagemaker_client.meta.region_name, self.credentials_digest
+                )
+                scores = rerank_cache.score(
+                    cache_namespace,
+                    query,
+                    docs,
+                    lambda texts: self._sagemaker_rerank(
+                        query_input=query, docs=texts, rerank_endpoint=self.sagemaker_endpoint
+                    ),
+                )
+            else:
+                scores = self._sagemaker_rerank(query_input=query, docs=docs, rerank_endpoint=self.sagemaker_endpoint)
 
             line = 7
             for idx in range(len(candidate_docs)):
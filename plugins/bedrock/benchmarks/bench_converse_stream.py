@@ -0,0 +1,101 @@
+"""
+Replay benchmark of the converse stream decoder: recorded (or synthetic) converse_stream events are decoded
+into LLM result chunks, reporting events/s, chunks/s and the peak memory allocated while decoding.
+
+Run from the plugin directory: python benchmarks/bench_converse_stream.py [--events FILE] [--deltas N]
+FILE holds one converse_stream event per line (JSON), e.g. recorded by logging the events of a real stream.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dify_plugin.entities.model.llm import LLMUsage  # noqa: E402
+from dify_plugin.entities.model.message import UserPromptMessage  # noqa: E402
+
+from models.llm.converse_stream import ConverseStreamDecoder  # noqa: E402
+
+
+def synthetic_events(deltas: int) -> list[dict]:
+    """
+    A reasoning block, a long text block and a tool call, with deltas of a few characters like real streams
+    """
+    events = [{"messageStart": {"role": "assistant"}}]
+    events += [
+        {"contentBlockDelta": {"delta": {"reasoningContent": {"text": f"step {i} "}}, "contentBlockIndex": 0}}
+        for i in range(deltas // 4)
+    ]
+    events.append({"contentBlockStop": {"contentBlockIndex": 0}})
+    events += [
+        {"contentBlockDelta": {"delta": {"text": f"word{i} "}, "contentBlockIndex": 1}} for i in range(deltas)
+    ]
+    events.append({"contentBlockStop": {"contentBlockIndex": 1}})
+    events.append({"contentBlockStart": {"start": {"toolUse": {"toolUseId": "t1", "name": "search"}}, "contentBlockIndex": 2}})
+    events += [
+        {"contentBlockDelta": {"delta": {"toolUse": {"input": '{"q": "' if i == 0 else "x"}}, "contentBlockIndex": 2}}
+        for i in range(deltas // 4)
+    ]
+    events.append({"contentBlockDelta": {"delta": {"toolUse": {"input": '"}'}}, "contentBlockIndex": 2}})
+    events.append({"contentBlockStop": {"contentBlockIndex": 2}})
+    events.append({"messageStop": {"stopReason": "tool_use"}})
+    events.append({"metadata": {"usage": {"inputTokens": 100, "outputTokens": deltas}, "metrics": {"latencyMs": 1}}})
+    return events
+
+
+def replay(events: list[dict], coalesce_ms: int, coalesce_chars: int, trace: bool = False) -> tuple[int, float, int]:
+    """
+    :param trace: measure the peak memory, the timing is slowed down by tracemalloc
+    :return: number of chunks, seconds, peak bytes allocated (0 if not traced)
+    """
+    decoder = ConverseStreamDecoder(
+        "benchmark",
+        [UserPromptMessage(content="benchmark")],
+        lambda input_tokens, output_tokens: LLMUsage.empty_usage(),
+        coalesce_ms=coalesce_ms,
+        coalesce_chars=coalesce_chars,
+    )
+    if trace:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+    chunks = sum(1 for _ in decoder.decode(iter(events)))
+    seconds = time.perf_counter() - started_at
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return chunks, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", help="JSON lines file of recorded converse_stream events")
+    parser.add_argument("--deltas", type=int, default=20000, help="text deltas of the synthetic stream")
+    parser.add_argument("--repeat", type=int, default=3, help="replays per configuration, the best is reported")
+    args = parser.parse_args()
+
+    if args.events:
+        with open(args.events) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = synthetic_events(args.deltas)
+
+    for name, coalesce_ms, coalesce_chars in (
+        ("no coalescing", 0, 0),
+        ("coalesce 64 chars", 0, 64),
+        ("coalesce 50 ms", 50, 0),
+    ):
+        chunks, _, peak = replay(events, coalesce_ms, coalesce_chars, trace=True)
+        seconds = min(replay(events, coalesce_ms, coalesce_chars)[1] for _ in range(args.repeat))
+        print(
+            f"{name:>18}: {len(events)} events -> {chunks} chunks, "
+            f"{len(events) / seconds:10.0f} events/s, {chunks / seconds:10.0f} chunks/s, "
+            f"peak {peak / 1024:8.1f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
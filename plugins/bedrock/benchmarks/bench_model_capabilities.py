@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of the model capability lookups: the precompiled index of model_capabilities against the
+linear scans it replaced (_find_model_info, _model_id_matches_schema and _map_model_id_to_name).
+Both are first checked to give the same answers for every predefined model ID.
+
+Run from the plugin directory: python benchmarks/bench_model_capabilities.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.llm import model_ids  # noqa: E402
+from models.llm.model_capabilities import CONVERSE_API_ENABLED_MODEL_INFO, get_model_capabilities  # noqa: E402
+
+SCHEMA_MODELS = ("anthropic claude", "claude-3-5-sonnet", "amazon nova", "nova-pro", "cohere", "meta", "mistral",
+                 "deepseek", "ai21", "qwen")
+
+
+def legacy_find_model_info(model_id):
+    for model in CONVERSE_API_ENABLED_MODEL_INFO:
+        if model_id.startswith(model["prefix"]):
+            return model
+    return None
+
+
+def legacy_matches_schema(model_id, schema_model):
+    if "anthropic.claude" in model_id:
+        return schema_model == "anthropic claude" or schema_model.startswith("claude-")
+    elif "amazon.nova" in model_id:
+        return schema_model == "amazon nova" or schema_model.startswith("nova-")
+    elif "cohere.command" in model_id:
+        return schema_model == "cohere" or schema_model.startswith("cohere-")
+    elif "ai21" in model_id:
+        return schema_model == "ai21"
+    elif "meta.llama" in model_id:
+        return schema_model == "meta"
+    elif "mistral" in model_id:
+        return schema_model == "mistral"
+    elif "deepseek" in model_id:
+        return schema_model == "deepseek"
+    return False
+
+
+def legacy_map_model_id_to_name(model_id):
+    base_model_id = model_id.split(':')[0] if ':' in model_id else model_id
+    for models in model_ids.BEDROCK_MODEL_IDS.values():
+        for name, id_value in models.items():
+            base_id_value = id_value.split(':')[0] if ':' in id_value else id_value
+            if base_id_value == base_model_id or id_value == model_id:
+                return name
+    return None
+
+
+def legacy_lookup(model_id):
+    return (
+        legacy_find_model_info(model_id),
+        [legacy_matches_schema(model_id, schema_model) for schema_model in SCHEMA_MODELS],
+        legacy_map_model_id_to_name(model_id),
+    )
+
+
+def indexed_lookup(model_id):
+    capabilities = get_model_capabilities(model_id)
+    return (
+        capabilities.to_model_info() if capabilities.converse_supported else None,
+        [capabilities.matches_schema(schema_model) for schema_model in SCHEMA_MODELS],
+        capabilities.pricing_key,
+    )
+
+
+def sample_model_ids() -> list[str]:
+    ids = []
+    for models in model_ids.BEDROCK_MODEL_IDS.values():
+        for model_id in models.values():
+            ids.append(model_id)
+            if model_ids.is_support_cross_region(model_id):
+                ids.extend(f"{prefix}.{model_id}" for prefix in model_ids.CROSS_REGION_PREFIXES)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="passes over all model IDs")
+    args = parser.parse_args()
+
+    ids = sample_model_ids()
+    # The index normalizes cross-region prefixes, so prefixed IDs get the pricing key the scan only found
+    # for the in-region ID
+    mismatches = []
+    for model_id in ids:
+        model_info, schemas, _ = legacy_lookup(model_id)
+        expected = (model_info, schemas, legacy_map_model_id_to_name(model_ids.split_cross_region_prefix(model_id)[1]))
+        if indexed_lookup(model_id) != expected:
+            mismatches.append(model_id)
+    print(f"{len(ids)} model IDs, {len(mismatches)} mismatches {mismatches[:5]}")
+
+    for name, lookup in (("linear scan", legacy_lookup), ("compiled index", indexed_lookup)):
+        seconds = timeit.timeit(lambda: [lookup(model_id) for model_id in ids], number=args.number)
+        print(f"{name:>15}: {seconds / (args.number * len(ids)) * 1e6:8.2f} us per model ID")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark of the per-family token counter against the former gpt2 counting of the rendered conversation.
+Reports the time to count a conversation from scratch and after appending one turn, and, given reference counts,
+the error of both against them.
+
+Run from the plugin directory: python benchmarks/bench_token_counter.py [--reference FILE] [--turns N]
+FILE holds one request per line (JSON): {"model": model ID, "messages": [{"role": ..., "content": ...}],
+"input_tokens": inputTokens reported by the converse API}, e.g. recorded from real responses.
+The gpt2 and tiktoken encodings are downloaded on first use; offline, the counter falls back to its estimate.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dify_plugin.entities.model.message import (  # noqa: E402
+    AssistantPromptMessage,
+    SystemPromptMessage,
+    ToolPromptMessage,
+    UserPromptMessage,
+)
+
+from models.llm import token_counter  # noqa: E402
+from models.llm.llm import BedrockLargeLanguageModel  # noqa: E402
+from models.llm.token_counter import count_message_tokens  # noqa: E402
+
+MESSAGE_TYPES = {
+    "system": SystemPromptMessage,
+    "user": UserPromptMessage,
+    "assistant": AssistantPromptMessage,
+}
+
+SAMPLE_TEXTS = [
+    "Summarize the quarterly report and list the three largest cost increases with their causes.",
+    "def merge(left, right):\n    return sorted(left + right, key=lambda item: (item.priority, item.created_at))\n",
+    "Die Lieferung verzögert sich um zwei Tage, bitte informieren Sie den Kunden über den neuen Termin.",
+    "请根据以上内容生成一份简短的会议纪要，并列出需要跟进的事项。",
+    '{"order_id": 48213, "status": "shipped", "items": [{"sku": "A-113", "quantity": 2}]}',
+]
+
+
+def synthetic_conversation(turns: int) -> list:
+    messages = [SystemPromptMessage(content="You are a helpful assistant for an operations team.")]
+    for turn in range(turns):
+        text = SAMPLE_TEXTS[turn % len(SAMPLE_TEXTS)]
+        messages.append(UserPromptMessage(content=f"{turn}: {text}"))
+        messages.append(AssistantPromptMessage(content=f"{turn}: {text} " * 3))
+    return messages
+
+
+def load_references(path: str) -> list[tuple[str, list, int]]:
+    references = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = [
+                ToolPromptMessage(content=message["content"], tool_call_id=message.get("tool_call_id", ""))
+                if message["role"] == "tool"
+                else MESSAGE_TYPES[message["role"]](content=message["content"])
+                for message in record["messages"]
+            ]
+            references.append((record["model"], messages, record["input_tokens"]))
+    return references
+
+
+def gpt2_count(llm: BedrockLargeLanguageModel, model: str, messages: list) -> int:
+    """
+    Former get_num_tokens: the conversation rendered as a single prompt, counted with gpt2
+    """
+    parts = model.split(".")
+    prefix = parts[1] if model.startswith(("us.", "eu.")) and len(parts) >= 3 else parts[0]
+    return llm._get_num_tokens_by_gpt2(llm._convert_messages_to_prompt(messages, prefix))
+
+
+def best_of(repeat: int, count) -> tuple[int, float]:
+    seconds = float("inf")
+    tokens = 0
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        tokens = count()
+        seconds = min(seconds, time.perf_counter() - started_at)
+    return tokens, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reference", help="JSON lines file of requests with the input tokens reported by Bedrock")
+    parser.add_argument("--turns", type=int, default=200, help="turns of the synthetic conversation")
+    parser.add_argument("--model", default="anthropic.claude-3-5-haiku-20241022-v1:0", help="model ID to count for")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best is reported")
+    args = parser.parse_args()
+
+    llm = BedrockLargeLanguageModel.__new__(BedrockLargeLanguageModel)
+    try:
+        llm._get_num_tokens_by_gpt2("warm up")
+        gpt2_available = True
+    except Exception as e:
+        print(f"gpt2 path unavailable, only the family counter is measured: {type(e).__name__}")
+        gpt2_available = False
+
+    family = token_counter.get_model_family(args.model)
+    messages = synthetic_conversation(args.turns)
+    appended = messages + [UserPromptMessage(content="And what should we do next?")]
+    print(f"{len(messages)} messages, family {family}")
+
+    def family_cold():
+        token_counter._counts.clear()
+        return count_message_tokens(args.model, appended)
+
+    def family_append():
+        # Only the appended turn isn't cached yet
+        token_counter._counts.clear()
+        count_message_tokens(args.model, messages)
+        started_at = time.perf_counter()
+        count_message_tokens(args.model, appended)
+        return time.perf_counter() - started_at
+
+    tokens, cold = best_of(args.repeat, family_cold)
+    append = min(family_append() for _ in range(args.repeat))
+    print(f"{'family, from scratch':>22}: {tokens:8d} tokens, {cold * 1000:9.3f} ms")
+    print(f"{'family, one turn added':>22}: {tokens:8d} tokens, {append * 1000:9.3f} ms")
+    if gpt2_available:
+        tokens, seconds = best_of(args.repeat, lambda: gpt2_count(llm, args.model, appended))
+        print(f"{'gpt2, rendered prompt':>22}: {tokens:8d} tokens, {seconds * 1000:9.3f} ms")
+
+    if args.reference:
+        references = load_references(args.reference)
+        family_errors = []
+        gpt2_errors = []
+        for model, reference_messages, input_tokens in references:
+            family_errors.append(abs(count_message_tokens(model, reference_messages) - input_tokens) / input_tokens)
+            if gpt2_available:
+                gpt2_errors.append(abs(gpt2_count(llm, model, reference_messages) - input_tokens) / input_tokens)
+        print(f"{len(references)} reference requests, mean absolute error:")
+        print(f"{'family':>22}: {sum(family_errors) / len(family_errors):8.2%}")
+        if gpt2_errors:
+            print(f"{'gpt2':>22}: {sum(gpt2_errors) / len(gpt2_errors):8.2%}")
+
+
+if __name__ == "__main__":
+    main()
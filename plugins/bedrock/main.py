@@ -1,10 +1,13 @@
 from dify_plugin import Plugin, DifyPluginEnv
 import logging
 
+from utils.metrics import start_metrics_exporters
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=120))
 
 if __name__ == '__main__':
+    start_metrics_exporters()
     plugin.run()
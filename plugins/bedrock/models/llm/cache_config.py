@@ -3,6 +3,8 @@ Configuration for Bedrock prompt cache feature
 """
 import logging
 
+from .model_ids import split_cross_region_prefix
+
 logger = logging.getLogger(__name__)
 
 # Models that support prompt caching
@@ -20,6 +22,8 @@ CACHE_SUPPORTED_MODELS = [
     "amazon.nova-premier-v1:0"
 ]
 
+_CACHE_SUPPORTED_MODEL_SET = frozenset(CACHE_SUPPORTED_MODELS)
+
 # Cache configuration for each model
 CACHE_CONFIG = {
     "anthropic.claude-sonnet-4-5-20250929-v1:0": {
@@ -81,11 +85,8 @@ def is_cache_supported(model_id: str) -> bool:
     :param model_id: Model ID to check
     :return: True if the model supports caching, False otherwise
     """
-    model_id = model_id.replace("us.","").replace("eu.","").replace("apac.","")
-
-    result = model_id in CACHE_SUPPORTED_MODELS
-    # Removed redundant print statement
-    return result
+    _, model_id = split_cross_region_prefix(model_id)
+    return model_id in _CACHE_SUPPORTED_MODEL_SET
 
 def get_cache_config(model_id: str) -> dict:
     """
@@ -94,11 +95,11 @@ def get_cache_config(model_id: str) -> dict:
     :param model_id: Model ID
     :return: Cache configuration dictionary
     """
-    model_id = model_id.replace("us.","").replace("eu.","").replace("apac.","")
+    _, model_id = split_cross_region_prefix(model_id)
 
     if model_id in CACHE_CONFIG:
         config = CACHE_CONFIG[model_id]
-        logger.info(f"[CACHE CONFIG] Cache config for model {model_id}: {config}")
+        logger.debug("[CACHE CONFIG] Cache config for model %s: %s", model_id, config)
         return config
 
     # Return default configuration if model not found
@@ -107,5 +108,5 @@ def get_cache_config(model_id: str) -> dict:
         "max_checkpoints": 4,
         "supported_fields": ["system", "messages"]
     }
-    logger.info(f"[CACHE CONFIG] Using default cache config for model {model_id}: {default_config}")
+    logger.debug("[CACHE CONFIG] Using default cache config for model %s: %s", model_id, default_config)
     return default_config
@@ -0,0 +1,245 @@
+"""
+Automatic placement of prompt cache checkpoints.
+Every request is cut at its cacheable boundaries (tools, system, each message) and the prefix up to each boundary
+is fingerprinted. Prefixes that repeat across requests are where a checkpoint pays off, so checkpoints are placed
+there, up to the model's maximum and only where the prefix reaches the model's minimum cacheable size.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Planner settings, can be overridden by environment variables of the plugin process
+# Prefixes not seen again within this time are forgotten, Bedrock keeps cache entries for 5 minutes
+_PREFIX_TTL = float(os.environ.get("BEDROCK_AUTO_CACHE_PREFIX_TTL", "300"))
+_MAX_PREFIXES = int(os.environ.get("BEDROCK_AUTO_CACHE_MAX_PREFIXES", "10000"))
+# Rough token estimate of text, precise counts aren't needed to compare against the minimum cacheable size
+_CHARS_PER_TOKEN = 4
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+
+def _digest_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return hashlib.sha256(value).hexdigest()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _estimate_tokens(segment) -> int:
+    if isinstance(segment, str):
+        return len(segment) // _CHARS_PER_TOKEN
+    if isinstance(segment, dict):
+        return sum(_estimate_tokens(value) for value in segment.values())
+    if isinstance(segment, list):
+        return sum(_estimate_tokens(value) for value in segment)
+    return 0
+
+
+class Boundary:
+    """A point of the request where a checkpoint may be placed"""
+
+    __slots__ = ("field", "index", "fingerprint", "tokens")
+
+    def __init__(self, field: str, index: Optional[int], fingerprint: str, tokens: int):
+        """
+        :param field: 'tools', 'system' or 'messages'
+        :param index: message index for 'messages'
+        :param fingerprint: fingerprint of the whole prefix up to and including this boundary
+        :param tokens: estimated tokens of that prefix
+        """
+        self.field = field
+        self.index = index
+        self.fingerprint = fingerprint
+        self.tokens = tokens
+
+    def __repr__(self) -> str:
+        return f"{self.field}[{self.index}]" if self.index is not None else self.field
+
+
+def find_boundaries(parameters: dict) -> list[Boundary]:
+    """
+    Cut converse parameters at their cacheable boundaries, in the order the cache prefix is built
+
+    :param parameters: converse parameters
+    :return: boundaries with chained prefix fingerprints
+    """
+    segments = []
+    tools = (parameters.get("toolConfig") or {}).get("tools")
+    if tools:
+        segments.append(("tools", None, tools))
+    if parameters.get("system"):
+        segments.append(("system", None, parameters["system"]))
+    for index, message in enumerate(parameters.get("messages", [])):
+        segments.append(("messages", index, message))
+
+    boundaries = []
+    chain = hashlib.sha256(parameters.get("modelId", "").encode())
+    tokens = 0
+    for field, index, segment in segments:
+        chain.update(json.dumps(segment, sort_keys=True, ensure_ascii=False, default=_digest_bytes).encode())
+        tokens += _estimate_tokens(segment)
+        boundaries.append(Boundary(field, index, chain.copy().hexdigest(), tokens))
+    return boundaries
+
+
+class PrefixTracker:
+    """Recently seen prefix fingerprints and how often they were seen"""
+
+    def __init__(self, ttl: float = _PREFIX_TTL, max_size: int = _MAX_PREFIXES):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._prefixes: OrderedDict = OrderedDict()  # fingerprint -> (last seen, times seen)
+        self._lock = threading.Lock()
+
+    def seen(self, fingerprint: str) -> int:
+        """
+        :return: how many times the prefix was seen within the TTL, 0 if it wasn't
+        """
+        with self._lock:
+            entry = self._prefixes.get(fingerprint)
+            if entry is None:
+                return 0
+            if time.monotonic() - entry[0] > self._ttl:
+                del self._prefixes[fingerprint]
+                return 0
+            return entry[1]
+
+    def record(self, fingerprints: list[str]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for fingerprint in fingerprints:
+                entry = self._prefixes.pop(fingerprint, None)
+                count = entry[1] + 1 if entry is not None and now - entry[0] <= self._ttl else 1
+                self._prefixes[fingerprint] = (now, count)
+            while len(self._prefixes) > self._max_size:
+                self._prefixes.popitem(last=False)
+
+
+_tracker = PrefixTracker()
+
+
+def plan_cache_checkpoints(boundaries: list[Boundary], cache_config: dict,
+                           tracker: PrefixTracker = _tracker) -> list[Boundary]:
+    """
+    Choose where to place checkpoints, most profitable first:
+    the end of the request when it extends a prefix that was seen before (growing conversation or agent loop),
+    the deepest repeated prefix, then the other repeated prefixes weighted by reuse and size.
+
+    :param boundaries: boundaries of the request
+    :param cache_config: cache configuration of the model, see get_cache_config
+    :param tracker: seen prefixes
+    :return: chosen boundaries
+    """
+    eligible = [
+        boundary for boundary in boundaries
+        if boundary.field in cache_config["supported_fields"] and boundary.tokens >= cache_config["min_tokens"]
+    ]
+    repeated = [(boundary, tracker.seen(boundary.fingerprint)) for boundary in eligible]
+    repeated = [(boundary, count) for boundary, count in repeated if count > 0]
+
+    chosen = []
+    if repeated:
+        deepest = repeated[-1][0]
+        last = boundaries[-1]
+        if deepest.field == "messages" and last is not deepest and eligible and eligible[-1] is last:
+            # Write the whole prompt so the next turn reads it
+            chosen.append(last)
+        chosen.append(deepest)
+        for boundary, _ in sorted(repeated[:-1], key=lambda item: -item[1] * item[0].tokens):
+            chosen.append(boundary)
+
+    return chosen[:cache_config["max_checkpoints"]]
+
+
+def place_cache_checkpoints(parameters: dict, cache_config: dict, tracker: PrefixTracker = _tracker) -> list[Boundary]:
+    """
+    Add checkpoints to converse parameters at the repeated prefixes, and remember the prefixes of the request
+
+    :param parameters: converse parameters, updated in place
+    :param cache_config: cache configuration of the model, see get_cache_config
+    :param tracker: seen prefixes
+    :return: boundaries where checkpoints were added
+    """
+    boundaries = find_boundaries(parameters)
+    chosen = plan_cache_checkpoints(boundaries, cache_config, tracker)
+    tracker.record([boundary.fingerprint for boundary in boundaries])
+
+    for boundary in chosen:
+        if boundary.field == "tools":
+            parameters["toolConfig"]["tools"].append(dict(CACHE_POINT))
+        elif boundary.field == "system":
+            parameters["system"].append(dict(CACHE_POINT))
+        else:
+            parameters["messages"][boundary.index]["content"].append(dict(CACHE_POINT))
+    return chosen
+
+
+class CacheUsageStats:
+    """Prompt cache token counters per model"""
+
+    def __init__(self):
+        self._models: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_id: str, input_tokens: int, cache_read_tokens: int, cache_write_tokens: int) -> float:
+        """
+        :param input_tokens: uncached input tokens, as reported by Bedrock
+        :return: hit rate of the model so far
+        """
+        with self._lock:
+            stats = self._models.get(model_id)
+            if stats is None:
+                stats = self._models[model_id] = {
+                    "requests": 0, "input_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0
+                }
+            stats["requests"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["cache_read_tokens"] += cache_read_tokens
+            stats["cache_write_tokens"] += cache_write_tokens
+            return self._hit_rate(stats)
+
+    @staticmethod
+    def _hit_rate(stats: dict) -> float:
+        total = stats["input_tokens"] + stats["cache_read_tokens"] + stats["cache_write_tokens"]
+        return stats["cache_read_tokens"] / total if total else 0.0
+
+    def stats(self) -> dict:
+        """
+        :return: model -> requests, token counters and hit rate (share of prompt tokens read from the cache)
+        """
+        with self._lock:
+            return {
+                model_id: dict(stats, hit_rate=self._hit_rate(stats)) for model_id, stats in self._models.items()
+            }
+
+
+_cache_usage = CacheUsageStats()
+
+
+def record_cache_usage(model_id: str, usage: dict) -> float:
+    """
+    Account the cache usage of a converse response
+
+    :param model_id: model ID
+    :param usage: usage of the response
+    :return: hit rate of the model so far
+    """
+    return _cache_usage.record(
+        model_id,
+        usage.get("inputTokens", 0),
+        usage.get("cacheReadInputTokens", 0),
+        usage.get("cacheWriteInputTokens", 0),
+    )
+
+
+def get_cache_usage_stats() -> dict:
+    """
+    Get the prompt cache hit rate of every model
+    """
+    return _cache_usage.stats()
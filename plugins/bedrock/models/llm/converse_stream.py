@@ -0,0 +1,253 @@
+"""
+Decoder of Converse API stream events into LLM result chunks
+"""
+import logging
+import os
+import time
+from collections.abc import Callable, Generator, Iterable
+from typing import Optional
+
+from dify_plugin.entities.model.llm import LLMResultChunk, LLMResultChunkDelta, LLMUsage
+from dify_plugin.entities.model.message import AssistantPromptMessage, PromptMessage
+
+from utils.metrics import OUTPUT_TOKENS_PER_SECOND, REQUEST_DURATION, record_token_usage
+from utils.stream_timing import StreamTimer
+
+from .cache_planner import record_cache_usage
+
+logger = logging.getLogger(__name__)
+
+# Delta coalescing, disabled by default: text deltas are buffered and emitted as a single chunk
+# once the buffer is this old (milliseconds) or this long (characters), whichever comes first
+STREAM_COALESCE_MS = int(os.environ.get("BEDROCK_STREAM_COALESCE_MS", "0"))
+STREAM_COALESCE_CHARS = int(os.environ.get("BEDROCK_STREAM_COALESCE_CHARS", "0"))
+
+
+class ConverseStreamDecoder:
+    """
+    Turns the events of a converse_stream response into LLMResultChunk objects.
+    Events are dispatched by type through a handler table, text and tool input are accumulated in lists.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        prompt_messages: list[PromptMessage],
+        calc_usage: Callable[[int, int], LLMUsage],
+        coalesce_ms: int = STREAM_COALESCE_MS,
+        coalesce_chars: int = STREAM_COALESCE_CHARS,
+        timer: Optional[StreamTimer] = None,
+    ):
+        """
+        :param model: model name
+        :param prompt_messages: prompt messages
+        :param calc_usage: function computing the usage from (input tokens, output tokens)
+        :param coalesce_ms: emit buffered deltas once they are this old, 0 to disable
+        :param coalesce_chars: emit buffered deltas once they are this long, 0 to disable
+        :param timer: timer started when the request was sent, a new one if None
+        """
+        self._model = model
+        self._prompt_messages = prompt_messages
+        self._calc_usage = calc_usage
+        self._coalesce_seconds = coalesce_ms / 1000
+        self._coalesce_chars = coalesce_chars
+        self._coalesce = coalesce_ms > 0 or coalesce_chars > 0
+        self._timer = timer if timer is not None else StreamTimer(model)
+
+        self._return_model = None
+        self._finish_reason = None
+        self._index = 0
+        self._tool_calls: list[AssistantPromptMessage.ToolCall] = []
+        self._tool_use: dict = {}
+        self._tool_input_parts: list[str] = []
+        self._content_started = False
+        self._starts_with_reasoning = False
+        self._reasoning_header_added = False
+        self._reasoning_tailer_added = False
+
+        # Pending deltas when coalescing
+        self._pending_parts: list[str] = []
+        self._pending_chars = 0
+        self._pending_index = 0
+        self._pending_since = 0.0
+
+        # Chunks ready to be yielded
+        self._out: list[LLMResultChunk] = []
+
+        self._handlers = {
+            "messageStart": self._on_message_start,
+            "messageStop": self._on_message_stop,
+            "contentBlockStart": self._on_content_block_start,
+            "contentBlockDelta": self._on_content_block_delta,
+            "contentBlockStop": self._on_content_block_stop,
+            "metadata": self._on_metadata,
+        }
+
+    def decode(self, stream: Iterable[dict]) -> Generator[LLMResultChunk, None, None]:
+        """
+        Decode a stream of events
+
+        :param stream: converse_stream events
+        :return: result chunks
+        """
+        handlers = self._handlers
+        out = self._out
+        for event in stream:
+            for event_type, payload in event.items():
+                handler = handlers.get(event_type)
+                if handler is not None:
+                    handler(payload)
+            if out:
+                yield from out
+                out.clear()
+
+        self._flush()
+        if out:
+            yield from out
+            out.clear()
+
+    def _emit(self, index: int, content: str) -> None:
+        self._out.append(
+            LLMResultChunk(
+                model=self._model,
+                prompt_messages=self._prompt_messages,
+                delta=LLMResultChunkDelta(
+                    index=index,
+                    message=AssistantPromptMessage(content=content),
+                ),
+            )
+        )
+
+    def _add_content(self, index: int, content: str) -> None:
+        if content:
+            self._timer.mark_token()
+            if not self._content_started:
+                self._content_started = True
+                self._starts_with_reasoning = content.startswith("<think>")
+
+        if not self._coalesce:
+            self._emit(index, content)
+            return
+
+        if self._pending_parts and index != self._pending_index:
+            self._flush()
+        if not self._pending_parts:
+            self._pending_index = index
+            self._pending_since = time.monotonic()
+        self._pending_parts.append(content)
+        self._pending_chars += len(content)
+
+        if (self._coalesce_chars and self._pending_chars >= self._coalesce_chars) or (
+            self._coalesce_seconds and time.monotonic() - self._pending_since >= self._coalesce_seconds
+        ):
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending_parts:
+            self._emit(self._pending_index, "".join(self._pending_parts))
+            self._pending_parts.clear()
+            self._pending_chars = 0
+
+    def _on_message_start(self, payload: dict) -> None:
+        self._return_model = self._model
+
+    def _on_message_stop(self, payload: dict) -> None:
+        self._finish_reason = payload["stopReason"]
+
+    def _on_content_block_start(self, payload: dict) -> None:
+        tool = payload["start"].get("toolUse")
+        if tool:
+            self._tool_use["toolUseId"] = tool["toolUseId"]
+            self._tool_use["name"] = tool["name"]
+
+    def _on_content_block_delta(self, payload: dict) -> None:
+        delta = payload["delta"]
+        reasoning_content = delta.get("reasoningContent")
+        if reasoning_content is not None:
+            formatted_reasoning = ''
+            if "text" in reasoning_content:
+                reasoning_text = reasoning_content["text"] or ""
+
+                # start point of reasoningContent
+                if not self._reasoning_header_added:
+                    formatted_reasoning = "<think>\n" + reasoning_text
+                    self._reasoning_header_added = True
+                else:
+                    formatted_reasoning = reasoning_text
+
+            self._index = payload["contentBlockIndex"]
+            self._add_content(self._index + 1, formatted_reasoning)
+            return
+
+        text = delta.get("text")
+        if text:
+            self._index = payload["contentBlockIndex"]
+            self._add_content(self._index + 1, text)
+            return
+
+        tool_use = delta.get("toolUse")
+        if tool_use is not None:
+            self._tool_input_parts.append(tool_use["input"])
+
+    def _on_content_block_stop(self, payload: dict) -> None:
+        self._flush()
+
+        # If reasoning was started but never completed (no text content followed)
+        # we need to close the thinking tag
+        if not self._reasoning_tailer_added and self._starts_with_reasoning:
+            self._reasoning_tailer_added = True
+            self._index += 1
+            self._emit(self._index + 1, "\n</think>")
+
+        if self._tool_input_parts:
+            self._tool_calls.append(
+                AssistantPromptMessage.ToolCall(
+                    id=self._tool_use["toolUseId"],
+                    type="function",
+                    function=AssistantPromptMessage.ToolCall.ToolCallFunction(
+                        name=self._tool_use["name"], arguments="".join(self._tool_input_parts)
+                    ),
+                )
+            )
+            self._tool_use = {}
+            self._tool_input_parts = []
+
+    def _on_metadata(self, payload: dict) -> None:
+        self._flush()
+        timer = self._timer
+        REQUEST_DURATION.observe(time.perf_counter() - timer.sent_at, model=self._model, operation="converse_stream")
+
+        input_tokens = 0
+        output_tokens = 0
+        usage = payload.get("usage")
+        if usage is not None:
+            input_tokens = usage.get("inputTokens", 0)
+            output_tokens = usage.get("outputTokens", 0)
+
+            # Extract cache metrics if available
+            cache_read_tokens = usage.get("cacheReadInputTokens", 0)
+            cache_write_tokens = usage.get("cacheWriteInputTokens", 0)
+            hit_rate = record_cache_usage(self._model, usage)
+            record_token_usage(self._model, usage)
+            generation_time = timer.finish()["time_to_generate"]
+            if output_tokens and generation_time:
+                OUTPUT_TOKENS_PER_SECOND.observe(output_tokens / generation_time, model=self._model)
+            logger.info(f"[STREAM CACHE METRICS] Model: {self._model}, Read: {cache_read_tokens} tokens, Write: {cache_write_tokens} tokens, Hit rate: {hit_rate:.2%}")
+        else:
+            # Log if usage data is missing
+            logger.warning(f"[STREAM WARNING] No usage data found in metadata chunk")
+
+        self._out.append(
+            timer.attach(
+                LLMResultChunk(
+                    model=self._return_model,
+                    prompt_messages=self._prompt_messages,
+                    delta=LLMResultChunkDelta(
+                        index=self._index,
+                        message=AssistantPromptMessage(content="", tool_calls=self._tool_calls),
+                        finish_reason=self._finish_reason,
+                        usage=self._calc_usage(input_tokens, output_tokens),
+                    ),
+                )
+            )
+        )
@@ -2,6 +2,7 @@
 import base64
 import json
 import logging
+import time
 from collections.abc import Generator
 from typing import Optional, Union, cast
 
@@ -29,6 +30,7 @@ from dify_plugin.entities.model.llm import (
     LLMResult,
     LLMResultChunk,
     LLMResultChunkDelta,
+    LLMUsage,
 )
 from dify_plugin.entities.model.message import (
     AssistantPromptMessage,
@@ -52,14 +54,24 @@ from dify_plugin.errors.model import (
     InvokeServerUnavailableError,
 )
 
-from provider.get_bedrock_client import get_bedrock_client
+from provider.get_bedrock_client import credentials_fingerprint, get_bedrock_client
 from .cache_config import is_cache_supported, get_cache_config
+from .cache_planner import place_cache_checkpoints, record_cache_usage
 from . import model_ids
+from .converse_stream import ConverseStreamDecoder
+from .model_capabilities import CONVERSE_API_ENABLED_MODEL_INFO, get_model_capabilities
+from .token_counter import count_message_tokens, count_text_tokens
 from utils.inference_profile import (
     get_inference_profile_info,
     validate_inference_profile,
     extract_model_info_from_profile
 )
+from utils.pricing import get_pricing_index
+from utils.rate_limiter import CLIENT_MAX_ATTEMPTS, call_with_rate_limit
+from utils.hedging import get_hedger, is_hedging_enabled
+from utils.region_router import CLOSED, FAILOVER_QUEUE_SECONDS, get_region_router, parse_regions
+from utils.metrics import ERRORS, OUTPUT_TOKENS_PER_SECOND, REQUEST_DURATION, REQUESTS, record_token_usage
+from utils.stream_timing import StreamTimer
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 logger = logging.getLogger(__name__)
@@ -73,40 +85,14 @@ if you are not sure about the structure.
 """  # noqa: E501
 
 class BedrockLargeLanguageModel(LargeLanguageModel):
-    # please refer to the documentation: https://docs.aws.amazon.com/bedrock/latest/userguide/conversation-inference.html
-    # TODO There is invoke issue: context limit on Cohere Model, will add them after fixed.
-    CONVERSE_API_ENABLED_MODEL_INFO = [
-        {"prefix": "qwen.qwen3", "support_system_prompts": True, "support_tool_use": False},
-        {"prefix": "openai.gpt", "support_system_prompts": True, "support_tool_use": False},
-        {"prefix": "deepseek.v3-v1:0", "support_system_prompts": True, "support_tool_use": False},
-        {"prefix": "us.deepseek", "support_system_prompts": True, "support_tool_use": False},
-        {"prefix": "global.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "us.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "eu.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "apac.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "amazon.nova", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "us.amazon.nova", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "eu.amazon.nova", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "apac.amazon.nova", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "us.meta.llama", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "eu.meta.llama", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "apac.meta.llama", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "meta.llama", "support_system_prompts": True, "support_tool_use": False},
-        {"prefix": "mistral.mistral-7b-instruct", "support_system_prompts": False, "support_tool_use": False},
-        {"prefix": "mistral.mixtral-8x7b-instruct", "support_system_prompts": False, "support_tool_use": False},
-        {"prefix": "mistral.mistral-large", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "mistral.mistral-small", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "cohere.command-r", "support_system_prompts": True, "support_tool_use": True},
-        {"prefix": "amazon.titan", "support_system_prompts": False, "support_tool_use": False},
-        {"prefix": "ai21.jamba-1-5", "support_system_prompts": True, "support_tool_use": False},
-    ]
+    # Converse API capability table, lookups go through the precompiled index of model_capabilities
+    CONVERSE_API_ENABLED_MODEL_INFO = CONVERSE_API_ENABLED_MODEL_INFO
 
     @staticmethod
     def _find_model_info(model_id):
-        for model in BedrockLargeLanguageModel.CONVERSE_API_ENABLED_MODEL_INFO:
-            if model_id.startswith(model["prefix"]):
-                return model
+        capabilities = get_model_capabilities(model_id)
+        if capabilities.converse_supported:
+            return capabilities.to_model_info()
         logger.info(f"current model id: {model_id} did not support by Converse API")
         return None
 
@@ -218,11 +204,19 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                 raise InvokeError(f"Failed to invoke inference profile {inference_profile_id}: {str(e)}")
         else:
             # Traditional model - try converse API first, then fall back if needed
-            model_info = self._get_model_info(model, credentials, model_parameters)
-            if model_info:
-                return self._generate_with_converse(
-                    model_info, credentials, prompt_messages, model_parameters, stop, stream, user, tools, model
+            # A custom endpoint URL pins a single region
+            if credentials.get("aws_failover_regions") and not credentials.get("bedrock_endpoint_url"):
+                result = self._generate_with_region_failover(
+                    model, credentials, prompt_messages, model_parameters, stop, stream, user, tools
                 )
+                if result is not None:
+                    return result
+            else:
+                model_info = self._get_model_info(model, credentials, model_parameters)
+                if model_info:
+                    return self._generate_with_converse(
+                        model_info, credentials, prompt_messages, model_parameters, stop, stream, user, tools, model
+                    )
             
             # Fallback to traditional model ID for non-converse API models
             model_name = model_parameters.get('model_name')
@@ -235,6 +229,83 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         credentials_with_model['model_parameters'] = {'model_name': model_name}
         return self._generate(model_id, credentials_with_model, prompt_messages, model_parameters, stop, stream, user)
 
+    def _generate_with_region_failover(
+        self,
+        model: str,
+        credentials: dict,
+        prompt_messages: list[PromptMessage],
+        model_parameters: dict,
+        stop: Optional[list[str]] = None,
+        stream: bool = True,
+        user: Optional[str] = None,
+        tools: Optional[list[PromptMessageTool]] = None,
+    ) -> Optional[Union[LLMResult, Generator]]:
+        """
+        Invoke the converse API in the healthiest of the configured regions, failing over to the next region
+        on throttling, unavailability or connection errors. Streams only fail over until the response starts.
+
+        :param model: model name
+        :param credentials: model credentials, with aws_failover_regions
+        :return: full response or stream response chunk generator result, None if the model doesn't support the converse API
+        """
+        router = get_region_router()
+        routes = parse_regions(credentials["aws_region"], credentials.get("aws_failover_regions"))
+        route_name = f"{model}/{model_parameters.get('model_name')}"
+        # Throttling and quotas are per account, the health of one tenant's routes doesn't say anything about another's
+        route_key = f"{credentials_fingerprint(credentials)[:16]}/{route_name}"
+
+        plan = router.plan(route_key, routes)
+        if not plan:
+            raise InvokeBadRequestError(f"No region to invoke {route_name} in")
+
+        last_error = None
+        for position, region in enumerate(plan):
+            is_last_region = position == len(plan) - 1
+            # The probe of a half-open circuit is only claimed here, when the call goes to that region.
+            # Rather than failing without any call, the last region is tried even if its circuit is open
+            if not router.allow_request(route_key, region) and (last_error is not None or not is_last_region):
+                continue
+
+            # Every attempt gets its own copies, _get_model_info and _generate_with_converse consume parameters
+            region_credentials = {**credentials, "aws_region": region}
+            region_parameters = dict(model_parameters)
+            model_info = self._get_model_info(model, region_credentials, region_parameters)
+            if not model_info:
+                model_parameters.pop('cross-region', None)
+                return None
+
+            # Throttling fails over right away, only the last region retries it
+            rate_limit_options = None if is_last_region else {
+                "deadline_seconds": FAILOVER_QUEUE_SECONDS, "max_retries": 0
+            }
+            # A slow call is hedged in the next healthy region of the plan rather than repeated in the same one
+            hedge_route = None
+            if not stream and is_hedging_enabled():
+                hedge_region = next(
+                    (r for r in plan[position + 1:] if router.health(route_key, r).state == CLOSED), None
+                )
+                if hedge_region:
+                    hedge_credentials = {**credentials, "aws_region": hedge_region}
+                    hedge_model_info = self._get_model_info(model, hedge_credentials, dict(model_parameters))
+                    if hedge_model_info:
+                        hedge_route = (hedge_model_info, hedge_credentials)
+            started_at = time.perf_counter()
+            try:
+                result = self._generate_with_converse(
+                    model_info, region_credentials, prompt_messages, region_parameters, stop, stream, user, tools, model,
+                    rate_limit_options=rate_limit_options, hedge_route=hedge_route,
+                )
+            except (InvokeRateLimitError, InvokeServerUnavailableError, InvokeConnectionError) as ex:
+                router.record_failure(route_key, region)
+                logger.warning(f"Invocation of {route_name} failed in {region}, trying next region: {str(ex)}")
+                last_error = ex
+                continue
+
+            router.record_success(route_key, region, time.perf_counter() - started_at)
+            return result
+
+        raise last_error
+
     def _get_model_info(self, model: str, credentials: dict, model_parameters: dict) -> dict:
         """
         Get model information for converse API
@@ -325,6 +396,8 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         user: Optional[str] = None,
         tools: Optional[list[PromptMessageTool]] = None,
         model: Optional[str] = None,
+        rate_limit_options: Optional[dict] = None,
+        hedge_route: Optional[tuple[dict, dict]] = None,
     ) -> Union[LLMResult, Generator]:
         """
         Invoke large language model with converse API
@@ -335,9 +408,12 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         :param model_parameters: model parameters
         :param stop: stop words
         :param stream: is stream response
+        :param rate_limit_options: call_with_rate_limit options overriding its queueing deadline and retries
+        :param hedge_route: model information and credentials of the region hedging a slow non-stream call
         :return: full response or stream response chunk generator result
         """
-        bedrock_client = get_bedrock_client("bedrock-runtime", credentials)
+        bedrock_client = get_bedrock_client("bedrock-runtime", credentials, max_attempts=CLIENT_MAX_ATTEMPTS)
+        rate_limit_options = rate_limit_options or {}
 
         # Get cache checkpoint settings from model parameters
         # Log the incoming parameters for debugging
@@ -346,8 +422,10 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         # This prevents unintended caching behavior and aligns with updated UI settings where the default is unchecked.
         system_cache_checkpoint = model_parameters.pop("system_cache_checkpoint", False)
         latest_two_messages_cache_checkpoint = model_parameters.pop("latest_two_messages_cache_checkpoint", False)
-        logger.info(f"---cache_checkpoints--- system: {system_cache_checkpoint}, penultimate: {latest_two_messages_cache_checkpoint}")
+        auto_cache_checkpoint = model_parameters.pop("auto_cache_checkpoint", False)
+        logger.debug("---cache_checkpoints--- system: %s, penultimate: %s", system_cache_checkpoint, latest_two_messages_cache_checkpoint)
         model_id = model_info["model"]
+        operation = "converse_stream" if stream else "converse"
         logger.debug(f"Model: {model_id}, Cache checkpoints - System: {system_cache_checkpoint}, Penultimate: {latest_two_messages_cache_checkpoint}")
 
         # Enable cache if either checkpoint is enabled
@@ -358,6 +436,10 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         if cache_supported == False:
             system_cache_checkpoint = False
             latest_two_messages_cache_checkpoint = False
+            auto_cache_checkpoint = False
+        elif system_cache_checkpoint or latest_two_messages_cache_checkpoint:
+            # Manual checkpoints take precedence
+            auto_cache_checkpoint = False
 
         # Convert messages with cache points if enabled
         # For inference profiles, use underlying model ID for cache configuration
@@ -425,14 +507,60 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                 if conversations_list[i]["role"] == conversations_list[i + 1]["role"]:
                     conversations_list[i]["content"].extend(conversations_list.pop(i + 1)["content"])
 
+            if auto_cache_checkpoint:
+                # Placed once the messages are final, so that the fingerprints match across requests
+                checkpoints = place_cache_checkpoints(parameters, get_cache_config(cache_config_model_id))
+                logger.debug(f"Model: {model_id}, automatic cache checkpoints: {checkpoints}")
+
+            REQUESTS.inc(model=model_id, operation=operation)
+            started_at = time.perf_counter()
             if stream:
-                response = bedrock_client.converse_stream(**parameters)
+                timer = StreamTimer(model_id, sent_at=started_at)
+                # Throttling is retried until the response starts, never in the middle of a stream
+                response = call_with_rate_limit(
+                    bedrock_client, model_id, lambda: bedrock_client.converse_stream(**parameters), **rate_limit_options
+                )
+                timer.mark_first_byte()
                 return self._handle_converse_stream_response(
-                    model_info["model"], credentials, response, prompt_messages
+                    model_info["model"], credentials, response, prompt_messages, timer=timer
                 )
             else:
-                logger.info(f"converse: {parameters}")
-                response = bedrock_client.converse(**parameters)
+                # Lazily formatted, the parameters can be large
+                logger.debug("converse: %s", parameters)
+                def converse():
+                    return call_with_rate_limit(
+                        bedrock_client, model_id, lambda: bedrock_client.converse(**parameters), **rate_limit_options
+                    )
+
+                hedge_converse = None
+                if hedge_route:
+                    hedge_model_info, hedge_credentials = hedge_route
+                    hedge_model_id = hedge_model_info["model"]
+                    hedge_client = get_bedrock_client(
+                        "bedrock-runtime", hedge_credentials, max_attempts=CLIENT_MAX_ATTEMPTS
+                    )
+                    hedge_parameters = {**parameters, "modelId": hedge_model_id}
+
+                    def hedge_converse():
+                        return call_with_rate_limit(
+                            hedge_client, hedge_model_id, lambda: hedge_client.converse(**hedge_parameters),
+                            deadline_seconds=FAILOVER_QUEUE_SECONDS, max_retries=0,
+                        )
+
+                if is_hedging_enabled():
+                    # Only the winning response is handled below, the discarded one is logged with its usage
+                    response = get_hedger().call(
+                        model_id,
+                        converse,
+                        hedge_call=hedge_converse,
+                        on_discarded=lambda discarded: logger.debug(
+                            f"Discarded hedged response of {model_id}, usage: {discarded.get('usage')}"
+                        ),
+                    )
+                else:
+                    response = converse()
+                duration = time.perf_counter() - started_at
+                REQUEST_DURATION.observe(duration, model=model_id, operation=operation)
 
                 # Log cache usage metrics if available
                 if "usage" in response:
@@ -444,8 +572,13 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                     cache_read_tokens = response["usage"].get("cacheReadInputTokens", 0)
                     cache_write_tokens = response["usage"].get("cacheWriteInputTokens", 0)
 
+                    hit_rate = record_cache_usage(model_id, response["usage"])
+                    record_token_usage(model_id, response["usage"])
+                    if output_tokens and duration > 0:
+                        OUTPUT_TOKENS_PER_SECOND.observe(output_tokens / duration, model=model_id)
+
                     # Always log the metrics for debugging
-                    logger.info(f"[CACHE METRICS] Model: {model_id}, Read: {cache_read_tokens} tokens, Write: {cache_write_tokens} tokens")
+                    logger.info(f"[CACHE METRICS] Model: {model_id}, Read: {cache_read_tokens} tokens, Write: {cache_write_tokens} tokens, Hit rate: {hit_rate:.2%}")
 
                     # Print the full response usage for debugging
 
@@ -465,15 +598,19 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                 return self._handle_converse_response(model_info["model"], credentials, response, prompt_messages)
         except ClientError as ex:
             error_code = ex.response["Error"]["Code"]
+            ERRORS.inc(model=model_id, operation=operation, code=error_code)
             full_error_msg = f"{error_code}: {ex.response['Error']['Message']}"
             raise self._map_client_to_invoke_error(error_code, full_error_msg)
         except (EndpointConnectionError, NoRegionError, ServiceNotInRegionError) as ex:
+            ERRORS.inc(model=model_id, operation=operation, code=type(ex).__name__)
             raise InvokeConnectionError(str(ex))
 
         except UnknownServiceError as ex:
+            ERRORS.inc(model=model_id, operation=operation, code=type(ex).__name__)
             raise InvokeServerUnavailableError(str(ex))
 
         except Exception as ex:
+            ERRORS.inc(model=model_id, operation=operation, code=type(ex).__name__)
             raise InvokeError(str(ex))
 
     def _handle_converse_response(
@@ -556,6 +693,7 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         credentials: dict,
         response: dict,
         prompt_messages: list[PromptMessage],
+        timer: Optional[StreamTimer] = None,
     ) -> Generator:
         """
         Handle llm chat stream response
@@ -564,150 +702,21 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         :param credentials: credentials
         :param response: response
         :param prompt_messages: prompt messages
+        :param timer: timer started when the request was sent
         :return: full response or stream response chunk generator result
         """
 
+        decoder = ConverseStreamDecoder(
+            model,
+            prompt_messages,
+            lambda input_tokens, output_tokens: self._calc_response_usage(model, credentials, input_tokens, output_tokens),
+            timer=timer,
+        )
         try:
-            full_assistant_content = ""
-            return_model = None
-            input_tokens = 0
-            output_tokens = 0
-            finish_reason = None
-            index = 0
-            tool_calls: list[AssistantPromptMessage.ToolCall] = []
-            tool_use = {}
-            reasoning_header_added = False
-            reasoning_tailer_added = False
-
-            for chunk in response["stream"]:
-                if "messageStart" in chunk:
-                    return_model = model
-                elif "messageStop" in chunk:
-                    finish_reason = chunk["messageStop"]["stopReason"]
-                elif "contentBlockStart" in chunk:
-                    tool = chunk["contentBlockStart"]["start"]["toolUse"]
-                    tool_use["toolUseId"] = tool["toolUseId"]
-                    tool_use["name"] = tool["name"]
-                elif "metadata" in chunk:
-                    # Safely extract usage data with proper error handling
-                    if "usage" in chunk["metadata"]:
-                        input_tokens = chunk["metadata"]["usage"].get("inputTokens", 0)
-                        output_tokens = chunk["metadata"]["usage"].get("outputTokens", 0)
-
-                        # Extract cache metrics if available
-                        cache_read_tokens = chunk["metadata"]["usage"].get("cacheReadInputTokens", 0)
-                        cache_write_tokens = chunk["metadata"]["usage"].get("cacheWriteInputTokens", 0)
-
-                        # Always log the metrics for debugging
-                        logger.info(f"[STREAM CACHE METRICS] Model: {model}, Read: {cache_read_tokens} tokens, Write: {cache_write_tokens} tokens")
-
-                        # Print the full usage data for debugging
-
-                        # Log cache usage if any tokens were read or written
-                        if cache_read_tokens > 0 or cache_write_tokens > 0:
-                            logger.info(f"Cache metrics - Model: {model}, Read: {cache_read_tokens} tokens, Write: {cache_write_tokens} tokens")
-                            # If tokens were read from cache, log the savings
-                            if cache_read_tokens > 0:
-                                logger.debug(f"[STREAM CACHE HIT] {cache_read_tokens} tokens read from cache")
-                            elif cache_write_tokens > 0:
-                                logger.debug(f"[STREAM CACHE WRITE] {cache_write_tokens} tokens written to cache")
-                    else:
-                        # Log if usage data is missing
-                        logger.warning(f"[STREAM WARNING] No usage data found in metadata chunk")
-
-                    usage = self._calc_response_usage(model, credentials, input_tokens, output_tokens)
-                    yield LLMResultChunk(
-                        model=return_model,
-                        prompt_messages=prompt_messages,
-                        delta=LLMResultChunkDelta(
-                            index=index,
-                            message=AssistantPromptMessage(content="", tool_calls=tool_calls),
-                            finish_reason=finish_reason,
-                            usage=usage,
-                        ),
-                    )
-                elif "contentBlockDelta" in chunk:
-                    delta = chunk["contentBlockDelta"]["delta"]
-                    if "reasoningContent" in delta:
-                        formatted_reasoning = ''
-                        if "text" in delta["reasoningContent"]:
-                            # Get reasoning content text
-                            reasoning_text = delta["reasoningContent"]["text"] or ""
-
-                            # start point of reasoningContent
-                            if not reasoning_header_added:
-                                formatted_reasoning = "<think>\n" + reasoning_text
-                                reasoning_header_added = True
-                            else:
-                                formatted_reasoning = reasoning_text
-
-                        # Update complete content, although it may not be needed here, but maintains code consistency
-                        full_assistant_content += formatted_reasoning
-
-                        assistant_prompt_message = AssistantPromptMessage(
-                            content=formatted_reasoning
-                        )
-                        index = chunk["contentBlockDelta"]["contentBlockIndex"]
-                        yield LLMResultChunk(
-                            model=model,
-                            prompt_messages=prompt_messages,
-                            delta=LLMResultChunkDelta(
-                                index=index + 1,
-                                message=assistant_prompt_message,
-                            ),
-                        )
-                    elif "text" in delta and delta["text"]:
-                        text = delta["text"]
-
-                        full_assistant_content += text
-
-                        assistant_prompt_message = AssistantPromptMessage(
-                            content=text or "",
-                        )
-                        index = chunk["contentBlockDelta"]["contentBlockIndex"]
-                        yield LLMResultChunk(
-                            model=model,
-                            prompt_messages=prompt_messages,
-                            delta=LLMResultChunkDelta(
-                                index=index + 1,
-                                message=assistant_prompt_message,
-                            ),
-                        )
-                    elif "toolUse" in delta:
-                        if "input" not in tool_use:
-                            tool_use["input"] = ""
-                        tool_use["input"] += delta["toolUse"]["input"]
-                elif "contentBlockStop" in chunk:
-                    # If reasoning was started but never completed (no text content followed)
-                    # we need to close the thinking tag
-                    if reasoning_tailer_added is False and full_assistant_content.startswith("<think>"):
-                        assistant_prompt_message = AssistantPromptMessage(
-                            content="\n</think>"
-                        )
-                        full_assistant_content += "\n</think>"
-                        reasoning_tailer_added = True
-                        index += 1
-                        yield LLMResultChunk(
-                            model=model,
-                            prompt_messages=prompt_messages,
-                            delta=LLMResultChunkDelta(
-                                index=index + 1,
-                                message=assistant_prompt_message,
-                            ),
-                        )
-
-                    if "input" in tool_use:
-                        tool_call = AssistantPromptMessage.ToolCall(
-                            id=tool_use["toolUseId"],
-                            type="function",
-                            function=AssistantPromptMessage.ToolCall.ToolCallFunction(
-                                name=tool_use["name"], arguments=tool_use["input"]
-                            ),
-                        )
-                        tool_calls.append(tool_call)
-                        tool_use = {}
-
+            yield from decoder.decode(response["stream"])
         except Exception as ex:
+            error_code = ex.response["Error"]["Code"] if isinstance(ex, ClientError) else type(ex).__name__
+            ERRORS.inc(model=model, operation="converse_stream", code=error_code)
             raise InvokeError(str(ex))
 
     def _convert_converse_api_model_parameters(
@@ -945,25 +954,36 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         :param tools: tools for tool calling
         :return:md = genai.GenerativeModel(model)
         """
-        model_parts = model.split(".")
-        
-        prefix = ""
-        model_name = ""
-        if model.startswith('us.') or model.startswith('eu.'):
-            if len(model_parts) >= 3:
-                prefix = model_parts[1]
-                model_name = model_parts[2]
-        else:
-            if len(model_parts) >= 2:
-                prefix = model_parts[0]
-                model_name = model_parts[1]
-
+        model_id = self._get_token_counting_model_id(model, credentials)
         if isinstance(prompt_messages, str):
-            prompt = prompt_messages
-        else:
-            prompt = self._convert_messages_to_prompt(prompt_messages, prefix, model_name)
+            return count_text_tokens(model_id, prompt_messages)
+
+        return count_message_tokens(model_id, prompt_messages, tools)
+
+    def _get_token_counting_model_id(self, model: str, credentials: dict) -> str:
+        """
+        Resolve the model whose tokenizer counts the tokens: get_num_tokens is called with predefined model names
+        (e.g. 'anthropic claude') as well as model IDs and inference profile ARNs
+
+        :param model: model name or ID
+        :param credentials: model credentials
+        :return: model ID, the given model if it can't be resolved
+        """
+        inference_profile_id = credentials.get("inference_profile_id")
+        if inference_profile_id:
+            try:
+                profile_info = get_inference_profile_info(inference_profile_id, credentials)
+            except Exception as e:
+                logger.debug(f"Counting tokens of {model} without its inference profile: {e}")
+                return model
+            for underlying_model in profile_info.get("models", []):
+                model_arn = underlying_model.get("modelArn", "")
+                if "foundation-model/" in model_arn:
+                    return model_arn.split("foundation-model/")[1]
+            return model
 
-        return self._get_num_tokens_by_gpt2(prompt)
+        model_name = (credentials.get("model_parameters") or {}).get("model_name")
+        return (model_name and model_ids.get_model_id(model, model_name)) or model
 
     def get_customizable_model_schema(self, model: str, credentials: dict) -> Optional[AIModelEntity]:
         """
@@ -1005,7 +1025,7 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                         
                         # First try to find individual model schema for pricing
                         if model_name_for_pricing:
-                            individual_pricing = self._get_model_specific_pricing("", model_name_for_pricing, model_schemas)
+                            individual_pricing = self._get_model_specific_pricing("", model_name_for_pricing)
                             if individual_pricing:
                                 default_pricing = individual_pricing
                         
@@ -1266,7 +1286,9 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
 
         try:
             body_jsonstr = json.dumps(payload)
+            timer = StreamTimer(model)
             response = invoke(modelId=model, contentType="application/json", accept="*/*", body=body_jsonstr)
+            timer.mark_first_byte()
         except ClientError as ex:
             error_code = ex.response["Error"]["Code"]
             full_error_msg = f"{error_code}: {ex.response['Error']['Message']}"
@@ -1282,7 +1304,7 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
             raise InvokeError(str(ex))
 
         if stream:
-            return self._handle_generate_stream_response(model, credentials, response, prompt_messages)
+            return self._handle_generate_stream_response(model, credentials, response, prompt_messages, timer=timer)
 
         return self._handle_generate_response(model, credentials, response, prompt_messages)
 
@@ -1338,7 +1360,12 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         return result
 
     def _handle_generate_stream_response(
-        self, model: str, credentials: dict, response: dict, prompt_messages: list[PromptMessage]
+        self,
+        model: str,
+        credentials: dict,
+        response: dict,
+        prompt_messages: list[PromptMessage],
+        timer: Optional[StreamTimer] = None,
     ) -> Generator:
         """
         Handle llm stream response
@@ -1347,8 +1374,10 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         :param credentials: credentials
         :param response: response
         :param prompt_messages: prompt messages
+        :param timer: timer started when the request was sent
         :return: llm response chunk generator result
         """
+        timer = timer or StreamTimer(model)
         model_prefix = model.split(".")[0]
         if model_prefix == "ai21":
             response_body = json.loads(response.get("body").read().decode("utf-8"))
@@ -1359,12 +1388,15 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
             prompt_tokens = len(response_body.get("prompt").get("tokens"))
             completion_tokens = len(response_body.get("completions")[0].get("data").get("tokens"))
             usage = self._calc_response_usage(model, credentials, prompt_tokens, completion_tokens)
-            yield LLMResultChunk(
-                model=model,
-                prompt_messages=prompt_messages,
-                delta=LLMResultChunkDelta(
-                    index=0, message=AssistantPromptMessage(content=content), finish_reason=finish_reason, usage=usage
-                ),
+            timer.mark_token()
+            yield timer.attach(
+                LLMResultChunk(
+                    model=model,
+                    prompt_messages=prompt_messages,
+                    delta=LLMResultChunkDelta(
+                        index=0, message=AssistantPromptMessage(content=content), finish_reason=finish_reason, usage=usage
+                    ),
+                )
             )
             return
 
@@ -1391,6 +1423,9 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
             else:
                 raise ValueError(f"Got unknown model prefix {model_prefix} when handling stream response")
 
+            if content_delta:
+                timer.mark_token()
+
             # transform assistant message to prompt message
             assistant_prompt_message = AssistantPromptMessage(
                 content=content_delta or "",
@@ -1412,12 +1447,14 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                 # transform usage
                 usage = self._calc_response_usage(model, credentials, prompt_tokens, completion_tokens)
 
-                yield LLMResultChunk(
-                    model=model,
-                    prompt_messages=prompt_messages,
-                    delta=LLMResultChunkDelta(
-                        index=index, message=assistant_prompt_message, finish_reason=finish_reason, usage=usage
-                    ),
+                yield timer.attach(
+                    LLMResultChunk(
+                        model=model,
+                        prompt_messages=prompt_messages,
+                        delta=LLMResultChunkDelta(
+                            index=index, message=assistant_prompt_message, finish_reason=finish_reason, usage=usage
+                        ),
+                    )
                 )
 
     @property
@@ -1506,26 +1543,7 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         :param model_schema: The predefined model schema
         :return: True if the model ID matches the schema
         """
-        # Extract the model family from the model ID and check individual models first
-        if "anthropic.claude" in model_id:
-            return (model_schema.model == "anthropic claude" or 
-                   model_schema.model.startswith("claude-"))
-        elif "amazon.nova" in model_id:
-            return (model_schema.model == "amazon nova" or 
-                   model_schema.model.startswith("nova-"))
-        elif "cohere.command" in model_id:
-            return (model_schema.model == "cohere" or 
-                   model_schema.model.startswith("cohere-"))
-        elif "ai21" in model_id:
-            return model_schema.model == "ai21"
-        elif "meta.llama" in model_id:
-            return model_schema.model == "meta"
-        elif "mistral" in model_id:
-            return model_schema.model == "mistral"
-        elif "deepseek" in model_id:
-            return model_schema.model == "deepseek"
-        
-        return False
+        return get_model_capabilities(model_id).matches_schema(model_schema.model)
     
     def _map_model_id_to_name(self, model_id: str) -> Optional[str]:
         """
@@ -1534,106 +1552,19 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         :param model_id: The Bedrock model ID (e.g., 'anthropic.claude-3-5-sonnet-20241022-v2:0')
         :return: The model name or None
         """
-        # Reverse lookup from model_ids
-        from . import model_ids
-        
-        # Remove version suffix if present
-        base_model_id = model_id.split(':')[0] if ':' in model_id else model_id
-        
-        # Search through all model families
-        for family, models in model_ids.BEDROCK_MODEL_IDS.items():
-            for name, id_value in models.items():
-                # Compare base IDs without version
-                base_id_value = id_value.split(':')[0] if ':' in id_value else id_value
-                if base_id_value == base_model_id or id_value == model_id:
-                    return name
-        
-        return None
+        return get_model_capabilities(model_id).pricing_key
     
-    def _get_model_specific_pricing(self, model: str, model_name: str, model_schemas: list):
+    def _get_model_specific_pricing(self, model: str, model_name: str):
         """
         Get model-specific pricing based on model name.
-        First tries to find exact model match from model_configurations directory, then falls back to family pricing.
+        First tries the individual model configuration (model_configurations directory), then falls back to family pricing.
+        Lookups go to a pricing index built once per model instance, so this never reads the configuration files.
         
         :param model: The model family (e.g., 'anthropic-claude')
         :param model_name: The specific model name (e.g., 'Claude 3.5 Sonnet')
-        :param model_schemas: List of predefined model schemas
         :return: Pricing configuration or None
         """
-        # Create model name mapping for individual model files
-        model_name_mapping = {
-            # Claude models
-            'Claude 4.0 Sonnet': 'claude-4-sonnet',
-            'Claude 4.0 Opus': 'claude-4-opus',
-            'Claude 3.7 Sonnet': 'claude-3-7-sonnet',
-            'Claude 3.5 Haiku': 'claude-3-5-haiku',
-            'Claude 3.5 Sonnet': 'claude-3-5-sonnet', 
-            'Claude 3.5 Sonnet V2': 'claude-3-5-sonnet',
-            'Claude 3 Haiku': 'claude-3-haiku',
-            'Claude 3 Sonnet': 'claude-3-sonnet',
-            'Claude 3 Opus': 'claude-3-opus',
-            # Nova models
-            'Nova Micro': 'nova-micro',
-            'Nova Lite': 'nova-lite',
-            'Nova Pro': 'nova-pro',
-            # Cohere models
-            'Command': 'cohere-command',
-            'Command Light': 'cohere-command-light',
-            'Command R': 'cohere-command-r',
-            'Command R+': 'cohere-command-rplus'
-        }
-        
-        # First, try to load individual model pricing from model_configurations subdirectory
-        individual_model_name = model_name_mapping.get(model_name)
-        if individual_model_name:
-            try:
-                import os
-                import yaml
-                # Get the directory of this file
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-                individual_model_path = os.path.join(current_dir, 'model_configurations', f'{individual_model_name}.yaml')
-                
-                if os.path.exists(individual_model_path):
-                    with open(individual_model_path, 'r', encoding='utf-8') as f:
-                        model_config = yaml.safe_load(f)
-                        if 'pricing' in model_config:
-                            return model_config['pricing']
-            except Exception as e:
-                # If individual model file loading fails, continue to fallback
-                pass
-        
-        # Fallback: try to find individual model in existing schemas (for backward compatibility)
-        if individual_model_name:
-            for schema in model_schemas:
-                if schema.model == individual_model_name:
-                    return schema.pricing
-        
-        # If no model family provided, skip family pricing lookup
-        if not model:
-            return None
-        
-        # If no individual model found, try family pricing
-        # Look for exact model match first
-        for schema in model_schemas:
-            if schema.model == model:
-                return schema.pricing
-        
-        # If exact match not found, try with different formats
-        # Sometimes model might be passed as 'anthropic claude' vs 'anthropic-claude'
-        model_variants = [
-            model.replace('-', ' '),  # 'anthropic-claude' -> 'anthropic claude'
-            model.replace(' ', '-'),  # 'anthropic claude' -> 'anthropic-claude'
-            model.lower(),
-            model.lower().replace('-', ' '),
-            model.lower().replace(' ', '-')
-        ]
-        
-        for schema in model_schemas:
-            for variant in model_variants:
-                if schema.model == variant:
-                    return schema.pricing
-                    
-        return None
+        return get_pricing_index(self, with_configurations=True).get_pricing(model, model_name)
     
     def _calc_response_usage(self, model: str, credentials: dict, prompt_tokens: int, completion_tokens: int):
         """
@@ -1651,25 +1582,14 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
         
         if model_name:
             # Try to get model-specific pricing
-            model_schemas = self.predefined_models()
-            model_pricing = self._get_model_specific_pricing(model, model_name, model_schemas)
+            model_pricing = self._get_model_specific_pricing(model, model_name)
             
             if model_pricing:
                 # Use model-specific pricing
-                from dify_plugin.entities.model.llm import LLMUsage
-                
-                # Handle both dict and object pricing formats
-                if isinstance(model_pricing, dict):
-                    input_price = float(model_pricing['input'])
-                    output_price = float(model_pricing['output'])
-                    unit_price = float(model_pricing['unit'])
-                    currency = model_pricing.get('currency', 'USD')
-                else:
-                    # Object with attributes
-                    input_price = float(model_pricing.input)
-                    output_price = float(model_pricing.output)
-                    unit_price = float(model_pricing.unit)
-                    currency = model_pricing.currency
+                input_price = float(model_pricing.input)
+                output_price = float(model_pricing.output)
+                unit_price = float(model_pricing.unit)
+                currency = model_pricing.currency
                 
                 # Calculate costs correctly: (tokens × price) ÷ unit_tokens
                 input_cost = (prompt_tokens * input_price) / (1.0 / unit_price)
@@ -1680,9 +1600,6 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                 output_cost = round(output_cost, 8)
                 total_cost = round(input_cost + output_cost, 8)
                 
-                # Get latency from parent class by calling it first
-                parent_usage = super()._calc_response_usage(model, credentials, prompt_tokens, completion_tokens)
-                
                 return LLMUsage(
                     prompt_tokens=prompt_tokens,
                     prompt_unit_price=input_price,
@@ -1695,9 +1612,8 @@ class BedrockLargeLanguageModel(LargeLanguageModel):
                     total_tokens=prompt_tokens + completion_tokens,
                     total_price=total_cost,
                     currency=currency,
-                    latency=parent_usage.latency,  # Use parent's latency calculation
+                    latency=time.perf_counter() - self.started_at,
                 )
         
         # Fallback to parent class implementation
         return super()._calc_response_usage(model, credentials, prompt_tokens, completion_tokens)
-    
@@ -0,0 +1,215 @@
+"""
+Precompiled index of Bedrock model capabilities.
+The index is built once at import from the Converse API capability table, the model IDs and the prompt cache
+configuration, so resolving what a model ID supports is a dictionary lookup (known IDs) or a single trie walk.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from . import model_ids
+from .cache_config import is_cache_supported
+
+logger = logging.getLogger(__name__)
+
+# please refer to the documentation: https://docs.aws.amazon.com/bedrock/latest/userguide/conversation-inference.html
+# Cross-region entries are listed explicitly since their capabilities may differ from the in-region model.
+# TODO There is invoke issue: context limit on Cohere Model, will add them after fixed.
+CONVERSE_API_ENABLED_MODEL_INFO = [
+    {"prefix": "qwen.qwen3", "support_system_prompts": True, "support_tool_use": False},
+    {"prefix": "openai.gpt", "support_system_prompts": True, "support_tool_use": False},
+    {"prefix": "deepseek.v3-v1:0", "support_system_prompts": True, "support_tool_use": False},
+    {"prefix": "us.deepseek", "support_system_prompts": True, "support_tool_use": False},
+    {"prefix": "global.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "us.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "eu.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "apac.anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "anthropic.claude", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "amazon.nova", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "us.amazon.nova", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "eu.amazon.nova", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "apac.amazon.nova", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "us.meta.llama", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "eu.meta.llama", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "apac.meta.llama", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "meta.llama", "support_system_prompts": True, "support_tool_use": False},
+    {"prefix": "mistral.mistral-7b-instruct", "support_system_prompts": False, "support_tool_use": False},
+    {"prefix": "mistral.mixtral-8x7b-instruct", "support_system_prompts": False, "support_tool_use": False},
+    {"prefix": "mistral.mistral-large", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "mistral.mistral-small", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "cohere.command-r", "support_system_prompts": True, "support_tool_use": True},
+    {"prefix": "amazon.titan", "support_system_prompts": False, "support_tool_use": False},
+    {"prefix": "ai21.jamba-1-5", "support_system_prompts": True, "support_tool_use": False},
+]
+
+# Model ID fragment -> (predefined schema family, prefix of the individual model schemas), checked in order
+SCHEMA_FAMILY_RULES = (
+    ("anthropic.claude", "anthropic claude", "claude-"),
+    ("amazon.nova", "amazon nova", "nova-"),
+    ("cohere.command", "cohere", "cohere-"),
+    ("ai21", "ai21", None),
+    ("meta.llama", "meta", None),
+    ("mistral", "mistral", None),
+    ("deepseek", "deepseek", None),
+)
+
+# Upper bound of the records memoized for model IDs unknown at import (e.g. new inference profile models)
+_MAX_DYNAMIC_RECORDS = 1024
+
+
+@dataclass(frozen=True)
+class ModelCapabilities:
+    """
+    Capabilities of a single Bedrock model ID
+    """
+
+    model_id: str
+    # Model ID without its cross-region prefix
+    base_model_id: str
+    # Cross-region prefix ('us', 'eu', 'apac', 'global'), None for in-region model IDs
+    region_prefix: Optional[str]
+    # Matched prefix of CONVERSE_API_ENABLED_MODEL_INFO, None if the model is not supported by the Converse API
+    converse_prefix: Optional[str]
+    support_system_prompts: bool
+    support_tool_use: bool
+    support_cache: bool
+    # Model name used for pricing lookups, e.g. 'Claude 3.5 Sonnet'
+    pricing_key: Optional[str]
+    # Predefined schema family, e.g. 'anthropic claude'
+    schema_family: Optional[str]
+    schema_prefix: Optional[str]
+
+    @property
+    def converse_supported(self) -> bool:
+        return self.converse_prefix is not None
+
+    def to_model_info(self) -> dict:
+        """
+        Build a fresh model info dict, as used by the Converse API code path
+        """
+        return {
+            "prefix": self.converse_prefix,
+            "support_system_prompts": self.support_system_prompts,
+            "support_tool_use": self.support_tool_use,
+        }
+
+    def matches_schema(self, schema_model: str) -> bool:
+        """
+        Check if a predefined model schema belongs to this model
+
+        :param schema_model: model of the schema, e.g. 'anthropic claude' or 'claude-3-5-sonnet'
+        """
+        if self.schema_family is None:
+            return False
+        return schema_model == self.schema_family or (
+            self.schema_prefix is not None and schema_model.startswith(self.schema_prefix)
+        )
+
+
+class _PrefixTrie:
+    """Character trie returning the value of the longest inserted prefix of a key"""
+
+    _VALUE = None  # never a character, marks the end of an inserted prefix
+
+    def __init__(self):
+        self._root: dict = {}
+
+    def insert(self, prefix: str, value) -> None:
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(self._VALUE, value)
+
+    def longest_prefix(self, key: str):
+        node = self._root
+        found = None
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            if self._VALUE in node:
+                found = node[self._VALUE]
+        return found
+
+
+def _strip_version(model_id: str) -> str:
+    return model_id.split(':')[0]
+
+
+def _build_pricing_keys() -> dict[str, str]:
+    # First model name of each versionless model ID, in declaration order
+    pricing_keys: dict[str, str] = {}
+    for models in model_ids.BEDROCK_MODEL_IDS.values():
+        for name, id_value in models.items():
+            pricing_keys.setdefault(_strip_version(id_value), name)
+    return pricing_keys
+
+
+_converse_trie = _PrefixTrie()
+for _model_info in CONVERSE_API_ENABLED_MODEL_INFO:
+    _converse_trie.insert(_model_info["prefix"], _model_info)
+
+_pricing_keys = _build_pricing_keys()
+
+
+def _compile(model_id: str) -> ModelCapabilities:
+    region_prefix, base_model_id = model_ids.split_cross_region_prefix(model_id)
+    model_info = _converse_trie.longest_prefix(model_id)
+
+    schema_family = schema_prefix = None
+    for fragment, family, prefix in SCHEMA_FAMILY_RULES:
+        if fragment in base_model_id:
+            schema_family, schema_prefix = family, prefix
+            break
+
+    return ModelCapabilities(
+        model_id=model_id,
+        base_model_id=base_model_id,
+        region_prefix=region_prefix,
+        converse_prefix=model_info["prefix"] if model_info else None,
+        support_system_prompts=model_info["support_system_prompts"] if model_info else False,
+        support_tool_use=model_info["support_tool_use"] if model_info else False,
+        support_cache=is_cache_supported(base_model_id),
+        pricing_key=_pricing_keys.get(_strip_version(base_model_id)),
+        schema_family=schema_family,
+        schema_prefix=schema_prefix,
+    )
+
+
+def _compile_known_model_ids() -> dict[str, ModelCapabilities]:
+    records = {}
+    for models in model_ids.BEDROCK_MODEL_IDS.values():
+        for model_id in models.values():
+            records[model_id] = _compile(model_id)
+            if model_ids.is_support_cross_region(model_id):
+                for region_prefix in model_ids.CROSS_REGION_PREFIXES:
+                    prefixed_model_id = f"{region_prefix}.{model_id}"
+                    records[prefixed_model_id] = _compile(prefixed_model_id)
+    return records
+
+
+# Exact index of every predefined model ID, with and without cross-region prefixes
+_known_records = _compile_known_model_ids()
+
+# Records of model IDs resolved after import
+_dynamic_records: dict[str, ModelCapabilities] = {}
+_dynamic_records_lock = threading.Lock()
+
+
+def get_model_capabilities(model_id: str) -> ModelCapabilities:
+    """
+    Get the capabilities of a model ID
+
+    :param model_id: model ID, with or without cross-region prefix, e.g. 'us.amazon.nova-pro-v1:0'
+    :return: capability record, converse_supported is False if the Converse API doesn't support the model
+    """
+    record = _known_records.get(model_id) or _dynamic_records.get(model_id)
+    if record is not None:
+        return record
+
+    record = _compile(model_id)
+    with _dynamic_records_lock:
+        if len(_dynamic_records) < _MAX_DYNAMIC_RECORDS:
+            _dynamic_records[model_id] = record
+    return record
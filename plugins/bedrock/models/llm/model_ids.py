@@ -70,17 +70,19 @@ BEDROCK_MODEL_IDS = {
     }
 }
 
+# Models only available in-region
+CROSS_REGION_UNSUPPORTED_MODELS = frozenset({
+    "deepseek.v3-v1:0",
+    "qwen.qwen3-235b-a22b-2507-v1:0",
+    "qwen.qwen3-32b-v1:0",
+    "qwen.qwen3-coder-480b-a35b-v1:0",
+    "qwen.qwen3-coder-30b-a3b-v1:0",
+    "openai.gpt-oss-120b-1:0",
+    "openai.gpt-oss-20b-1:0"
+})
+
 def is_support_cross_region(model_id):
-    unsupport_model_list = [
-        "deepseek.v3-v1:0",
-        "qwen.qwen3-235b-a22b-2507-v1:0",
-        "qwen.qwen3-32b-v1:0",
-        "qwen.qwen3-coder-480b-a35b-v1:0",
-        "qwen.qwen3-coder-30b-a3b-v1:0",
-        "openai.gpt-oss-120b-1:0",
-        "openai.gpt-oss-20b-1:0"
-    ]
-    return model_id not in unsupport_model_list
+    return model_id not in CROSS_REGION_UNSUPPORTED_MODELS
 
 def get_model_id(model_type, model_name):
     """
@@ -95,6 +97,33 @@ def get_model_id(model_type, model_name):
     """
     return BEDROCK_MODEL_IDS.get(model_type, {}).get(model_name)
 
+# Prefixes of cross-region inference profile ids, e.g. 'us.anthropic.claude-3-5-haiku-20241022-v1:0'
+CROSS_REGION_PREFIXES = ('us', 'eu', 'apac', 'global')
+
+# Regions supporting the global cross-region prefix
+GLOBAL_SUPPORTED_REGIONS = frozenset({
+    'us-west-2', 'us-east-1', 'us-east-2',
+    'eu-west-1', 'ap-northeast-1'
+})
+
+# Region name prefix -> geographic area
+REGION_AREA_MAPPING = {
+    'us': 'us',
+    'eu': 'eu',
+    'ap': 'apac'
+}
+
+def split_cross_region_prefix(model_id):
+    """
+    Split the cross-region prefix off a model ID
+    :param model_id: model ID, e.g., 'us.anthropic.claude-3-5-haiku-20241022-v1:0'
+    :return: (cross-region prefix or None, model ID without the prefix)
+    """
+    head, separator, tail = model_id.partition('.')
+    if separator and head in CROSS_REGION_PREFIXES:
+        return head, tail
+    return None, model_id
+
 def get_region_area(region_name, prefer_global=False):
     """
     Identify the geographic area based on AWS region name
@@ -102,21 +131,9 @@ def get_region_area(region_name, prefer_global=False):
     :param prefer_global: Whether to prefer global prefix (for models supporting global routing)
     :return: Geographic area, e.g., 'us', 'eu', 'apac', 'global'
     """
-    if prefer_global:
-        # For regions that support global prefix, prioritize returning global
-        global_supported_regions = {
-            'us-west-2', 'us-east-1', 'us-east-2', 
-            'eu-west-1', 'ap-northeast-1'
-        }
-        if region_name in global_supported_regions:
-            return 'global'
-    
-    prefix = region_name.split('-')[0].lower()
+    # For regions that support global prefix, prioritize returning global
+    if prefer_global and region_name in GLOBAL_SUPPORTED_REGIONS:
+        return 'global'
 
-    area_mapping = {
-        'us': 'us',
-        'eu': 'eu',
-        'ap': 'apac'
-    }
-
-    return area_mapping.get(prefix, None)
+    prefix = region_name.split('-')[0].lower()
+    return REGION_AREA_MAPPING.get(prefix, None)
@@ -0,0 +1,203 @@
+"""
+Local token counting of prompt messages.
+Every model family gets its own tokenizer, loaded lazily: a Hugging Face tokenizer file when one is provided
+(requires the optional tokenizers package), otherwise the closest tiktoken encoding scaled to the family,
+otherwise an estimate from the character counts. Counts are cached per message, keyed by a hash of its text,
+so a growing conversation only tokenizes its new turns.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Optional
+
+from dify_plugin.entities.model.message import (
+    AssistantPromptMessage,
+    PromptMessage,
+    PromptMessageContentType,
+    PromptMessageTool,
+    SystemPromptMessage,
+    ToolPromptMessage,
+    UserPromptMessage,
+)
+
+from .model_ids import split_cross_region_prefix
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+# Directory of Hugging Face tokenizer files, as {dir}/{family}/tokenizer.json, e.g. {dir}/meta/tokenizer.json
+_TOKENIZER_DIR = os.environ.get("BEDROCK_TOKENIZER_DIR", "")
+_TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("BEDROCK_TOKEN_COUNT_CACHE_SIZE", "16384"))
+# Texts this long are estimated rather than tokenized, like the gpt2 counting of the SDK
+_MAX_TOKENIZED_CHARS = 100000
+# Tokens added per message for the role and separators
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+# Approximate tokenizer characteristics per model family (prefix of the model ID):
+# tiktoken encoding closest to the family's tokenizer and the ratio of their counts,
+# then characters per token of latin text and tokens per character of other scripts for the estimate
+FAMILY_TOKENIZERS = {
+    "anthropic": ("cl100k_base", 1.1, 3.5, 1.0),
+    "amazon": ("cl100k_base", 1.05, 3.8, 1.0),
+    "meta": ("cl100k_base", 1.0, 4.0, 0.8),
+    "mistral": ("cl100k_base", 1.1, 3.6, 1.0),
+    "cohere": ("cl100k_base", 1.0, 4.0, 0.8),
+    "ai21": ("cl100k_base", 1.0, 4.0, 1.0),
+    "deepseek": ("cl100k_base", 1.0, 3.8, 0.7),
+    "qwen": ("cl100k_base", 1.0, 3.8, 0.7),
+    "openai": ("o200k_base", 1.0, 4.0, 0.7),
+}
+_DEFAULT_TOKENIZER = ("cl100k_base", 1.0, 4.0, 1.0)
+
+
+def get_model_family(model: str) -> str:
+    """
+    :param model: model ID, optionally with a cross-region prefix, model ARN or predefined model name
+        (e.g. 'anthropic claude', 'amazon nova')
+    :return: provider prefix of the model ID, 'default' if it isn't a known family
+    """
+    # Foundation model and inference profile ARNs end with the model ID
+    _, model_id = split_cross_region_prefix(model.rsplit("/", 1)[-1])
+    family = model_id.split(".", 1)[0].split(" ", 1)[0].lower()
+    return family if family in FAMILY_TOKENIZERS else "default"
+
+
+class FamilyTokenizer:
+    """Token counter of a model family, loading its tokenizer on first use"""
+
+    def __init__(self, family: str):
+        self.family = family
+        self._encoding_name, self._scale, self._chars_per_token, self._non_latin_tokens_per_char = (
+            FAMILY_TOKENIZERS.get(family, _DEFAULT_TOKENIZER)
+        )
+        self._count: Optional[Callable[[str], int]] = None
+        self._lock = threading.Lock()
+
+    def estimate(self, text: str) -> int:
+        latin_chars = len(text.encode("ascii", "ignore"))
+        return round(
+            latin_chars / self._chars_per_token + (len(text) - latin_chars) * self._non_latin_tokens_per_char
+        )
+
+    def _load(self) -> Callable[[str], int]:
+        tokenizer_path = os.path.join(_TOKENIZER_DIR, self.family, "tokenizer.json") if _TOKENIZER_DIR else ""
+        if Tokenizer is not None and tokenizer_path and os.path.exists(tokenizer_path):
+            try:
+                tokenizer = Tokenizer.from_file(tokenizer_path)
+                logger.info(f"Loaded {self.family} tokenizer from {tokenizer_path}")
+                return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+            except Exception as e:
+                logger.warning(f"Failed to load tokenizer {tokenizer_path}: {e}")
+
+        try:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(self._encoding_name)
+            scale = self._scale
+            return lambda text: round(len(encoding.encode_ordinary(text)) * scale)
+        except Exception as e:
+            # e.g. the encoding can't be downloaded
+            logger.warning(f"Failed to load {self._encoding_name} encoding, estimating {self.family} tokens: {e}")
+            return self.estimate
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if len(text) >= _MAX_TOKENIZED_CHARS:
+            return self.estimate(text)
+        if self._count is None:
+            with self._lock:
+                if self._count is None:
+                    self._count = self._load()
+        return self._count(text)
+
+
+_tokenizers: dict[str, FamilyTokenizer] = {}
+_tokenizers_lock = threading.Lock()
+_counts: OrderedDict = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+def get_tokenizer(model: str) -> FamilyTokenizer:
+    """
+    Get the tokenizer of a model's family
+    """
+    family = get_model_family(model)
+    tokenizer = _tokenizers.get(family)
+    if tokenizer is None:
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.setdefault(family, FamilyTokenizer(family))
+    return tokenizer
+
+
+def _message_text(message: PromptMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = "".join(item.data for item in content if item.type == PromptMessageContentType.TEXT)
+    text = content or ""
+    if isinstance(message, AssistantPromptMessage) and message.tool_calls:
+        text += "".join(
+            tool_call.function.name + tool_call.function.arguments for tool_call in message.tool_calls
+        )
+    if isinstance(message, ToolPromptMessage):
+        text += message.tool_call_id or ""
+    return text
+
+
+def _cached_count(tokenizer: FamilyTokenizer, text: str) -> int:
+    key = (tokenizer.family, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+            return count
+
+    count = tokenizer.count(text)
+    with _counts_lock:
+        _counts[key] = count
+        while len(_counts) > _TOKEN_COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return count
+
+
+def count_text_tokens(model: str, text: str) -> int:
+    """
+    Count the tokens of a text
+
+    :param model: model ID
+    :param text: text
+    :return: number of tokens
+    """
+    return get_tokenizer(model).count(text)
+
+
+def count_message_tokens(
+    model: str, messages: list[PromptMessage], tools: Optional[list[PromptMessageTool]] = None
+) -> int:
+    """
+    Count the tokens of prompt messages and tool definitions, with cached per-message counts
+
+    :param model: model ID
+    :param messages: prompt messages
+    :param tools: tools for tool calling
+    :return: number of tokens
+    """
+    tokenizer = get_tokenizer(model)
+    num_tokens = 0
+    for message in messages:
+        if not isinstance(message, (UserPromptMessage, AssistantPromptMessage, SystemPromptMessage, ToolPromptMessage)):
+            raise ValueError(f"Got unknown type {message}")
+        num_tokens += _cached_count(tokenizer, _message_text(message)) + _MESSAGE_OVERHEAD_TOKENS
+    for tool in tools or []:
+        num_tokens += _cached_count(
+            tokenizer, tool.name + (tool.description or "") + json.dumps(tool.parameters, sort_keys=True)
+        )
+    return num_tokens
@@ -1,6 +1,8 @@
 from typing import Optional
+import heapq
 import logging
 import json
+import os
 
 from botocore.exceptions import ClientError
 
@@ -21,6 +23,10 @@ from dify_plugin.errors.model import (
 
 from provider.get_bedrock_client import get_bedrock_client
 from . import model_ids
+from utils.concurrency import run_ordered
+from utils.rate_limiter import CLIENT_MAX_ATTEMPTS, call_with_rate_limit
+from utils.metrics import record_rerank_cache_lookups
+from utils.rerank_cache import get_rerank_cache
 from utils.inference_profile import (
     get_inference_profile_info,
     validate_inference_profile,
@@ -29,6 +35,50 @@ from utils.inference_profile import (
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of documents Bedrock rerank models accept in a single call
+RERANK_MAX_DOCUMENTS = 1000
+
+# Rerank settings, can be overridden by environment variables of the plugin process
+# Documents are scored in shards of this size, sent concurrently
+RERANK_SHARD_SIZE = int(os.environ.get("BEDROCK_RERANK_SHARD_SIZE", "100"))
+RERANK_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_RERANK_MAX_CONCURRENCY", "4"))
+# Documents longer than this many tokens (estimated) are truncated before scoring, disabled when 0
+RERANK_MAX_DOCUMENT_TOKENS = int(os.environ.get("BEDROCK_RERANK_MAX_DOCUMENT_TOKENS", "0"))
+_CHARS_PER_TOKEN = 4
+
+
+def truncate_document(text: str, max_tokens: int = RERANK_MAX_DOCUMENT_TOKENS) -> str:
+    """
+    Cut a document to a token budget, estimated from its length
+
+    :param text: document
+    :param max_tokens: token budget, no truncation when 0
+    :return: the document, truncated if it was longer than the budget
+    """
+    if max_tokens <= 0:
+        return text
+    return text[:max_tokens * _CHARS_PER_TOKEN]
+
+
+def select_top(
+    scores: list[float], top_n: Optional[int] = None, score_threshold: Optional[float] = None
+) -> list[tuple[int, float]]:
+    """
+    Select the most relevant documents
+
+    :param scores: relevance score of every document
+    :param top_n: number of documents to keep, all if None
+    :param score_threshold: minimum score of the kept documents
+    :return: (document index, score) of the kept documents, best first
+    """
+    candidates = (
+        (index, score) for index, score in enumerate(scores)
+        if score_threshold is None or score >= score_threshold
+    )
+    if top_n is not None:
+        return heapq.nlargest(top_n, candidates, key=lambda candidate: candidate[1])
+    return sorted(candidates, key=lambda candidate: candidate[1], reverse=True)
+
 
 class BedrockRerankModel(RerankModel):
     """
@@ -62,21 +112,8 @@ class BedrockRerankModel(RerankModel):
             return RerankResult(model=model, docs=docs)
 
         # initialize client
-        bedrock_runtime = get_bedrock_client("bedrock-runtime", credentials)
-        text_sources = []
-        for text in docs:
-            text_sources.append(
-                {
-                    "type": "INLINE",
-                    "inlineDocumentSource": {
-                        "type": "TEXT",
-                        "textDocument": {
-                            "text": text,
-                        },
-                    },
-                }
-            )
-        
+        bedrock_runtime = get_bedrock_client("bedrock-runtime", credentials, max_attempts=CLIENT_MAX_ATTEMPTS)
+
         # Check if using inference profile
         model_id = model
         inference_profile_id = credentials.get("inference_profile_id")
@@ -108,44 +145,56 @@ class BedrockRerankModel(RerankModel):
                 raise InvokeBadRequestError("aws_region is required in credentials")
             model_package_arn = f"arn:aws:bedrock:{region}::foundation-model/{model_id}"
 
-        numberOfResults = min(len(text_sources) if top_n is None else top_n, len(text_sources))
+        shard_size = max(1, min(RERANK_SHARD_SIZE, RERANK_MAX_DOCUMENTS))
 
-        body_dict = {
-            "query": query,
-            "documents": docs
-        }
+        def rerank_shard(shard: list[str]) -> list[float]:
+            body_dict = {
+                "query": query,
+                "documents": [truncate_document(text) for text in shard]
+            }
 
-        # Only add api_version for Cohere models
-        if "cohere" in model_id.lower():
-            body_dict["api_version"] = 2
-        
-        body = json.dumps(body_dict)
-    
-        response = bedrock_runtime.invoke_model(
-            modelId=model_package_arn,
-            body=body
-        )
-
-        body_content = json.loads(response['body'].read())
-
-        results_to_process = body_content['results'][:numberOfResults]
-
-        rerank_documents = []
-        for idx, result in enumerate(results_to_process):
-            # format document
-            index = result["index"]
-            rerank_document = RerankDocument(
-                index=index,
-                text=docs[index],
-                score=result["relevance_score"],
+            # Only add api_version for Cohere models
+            if "cohere" in model_id.lower():
+                body_dict["api_version"] = 2
+
+            body = json.dumps(body_dict)
+
+            response = call_with_rate_limit(
+                bedrock_runtime,
+                model_package_arn,
+                lambda: bedrock_runtime.invoke_model(modelId=model_package_arn, body=body),
             )
+            scores = [0.0] * len(shard)
+            for result in json.loads(response['body'].read())['results']:
+                scores[result["index"]] = result["relevance_score"]
+            return scores
 
-            # score threshold check
-            if score_threshold is not None:
-                if rerank_document.score >= score_threshold:
-                    rerank_documents.append(rerank_document)
-            else:
-                rerank_documents.append(rerank_document)
+        def score_documents(texts: list[str]) -> list[float]:
+            shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+            scores = []
+            # Throttled calls are already retried by the rate limiter
+            for shard_scores in run_ordered(rerank_shard, shards, RERANK_MAX_CONCURRENCY, max_retries=0):
+                scores.extend(shard_scores)
+            return scores
+
+        # Only the documents that were not scored against the query yet are sent to Bedrock
+        rerank_cache = get_rerank_cache()
+        if rerank_cache:
+            cache_namespace = (model_package_arn, RERANK_MAX_DOCUMENT_TOKENS)
+            scores = rerank_cache.score(
+                cache_namespace,
+                query,
+                docs,
+                score_documents,
+                on_lookup=lambda hits, misses: record_rerank_cache_lookups(model_package_arn, hits, misses),
+            )
+        else:
+            scores = score_documents(docs)
+
+        rerank_documents = [
+            RerankDocument(index=index, text=docs[index], score=score)
+            for index, score in select_top(scores, top_n, score_threshold)
+        ]
 
         return RerankResult(model=model, docs=rerank_documents)
     
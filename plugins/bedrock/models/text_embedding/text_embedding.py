@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 import time
 import tiktoken
 from typing import Optional
@@ -31,9 +32,22 @@ from utils.inference_profile import (
     validate_inference_profile,
     extract_model_info_from_profile
 )
+from utils.concurrency import run_ordered
+from utils.embedding_cache import get_embedding_cache
+from utils.rate_limiter import CLIENT_MAX_ATTEMPTS, call_with_rate_limit
+from utils.pricing import calc_price, get_pricing_index
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of texts Cohere embed models accept in a single call
+COHERE_MAX_BATCH_SIZE = 96
+
+# Embedding throughput settings, can be overridden by environment variables of the plugin process
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_EMBEDDING_MAX_CONCURRENCY", "8"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("BEDROCK_EMBEDDING_BATCH_SIZE", str(COHERE_MAX_BATCH_SIZE)))
+# Upper bound of the total base64 payload size of concurrent multimodal calls
+MULTIMODAL_MAX_IN_FLIGHT_BYTES = int(os.environ.get("BEDROCK_MULTIMODAL_MAX_IN_FLIGHT_BYTES", str(64 * 1024 * 1024)))
+
 
 class BedrockTextEmbeddingModel(TextEmbeddingModel):
     def _invoke(
@@ -83,15 +97,13 @@ class BedrockTextEmbeddingModel(TextEmbeddingModel):
             model_package_arn = model
             model_prefix = model.split(".")[0]
             
-        bedrock_runtime = get_bedrock_client("bedrock-runtime", credentials)
-
-        embeddings = []
-        token_usage = 0
+        bedrock_runtime = get_bedrock_client("bedrock-runtime", credentials, max_attempts=CLIENT_MAX_ATTEMPTS)
 
         # Nova MME model
         if model_prefix == "amazon" and "nova" in model_id.lower():
-            embedding_purpose = "GENERIC_INDEX" 
-            for text in texts:
+            embedding_purpose = "GENERIC_INDEX"
+
+            def embed_nova(text: str) -> tuple[list[float], int]:
                 body = {
                     "taskType": "SINGLE_EMBEDDING",
                     "singleEmbeddingParams": {
@@ -105,52 +117,73 @@ class BedrockTextEmbeddingModel(TextEmbeddingModel):
                 }
                 response_body = self._invoke_bedrock_embedding(model_package_arn, bedrock_runtime, body)
                 embedding_data = response_body.get("embeddings", [{}])[0]
-                embeddings.extend([embedding_data.get("embedding")])
-                token_usage += len(text.split())
-            logger.warning(f"Total Tokens: {token_usage}")
-            result = TextEmbeddingResult(
-                model=model,
-                embeddings=embeddings,
-                usage=self._calc_response_usage(model=model, credentials=credentials, tokens=token_usage),
-            )
-            return result
+                return embedding_data.get("embedding"), len(text.split())
+
+            def embed_texts(batch: list[str]) -> tuple[list[list[float]], int]:
+                # Nova embeds a single text per call, fan out over the pool
+                # Throttled calls are already retried by the rate limiter
+                results = run_ordered(embed_nova, batch, EMBEDDING_MAX_CONCURRENCY, max_retries=0)
+                return [embedding for embedding, _ in results], sum(tokens for _, tokens in results)
+
+            cache_namespace = (model_package_arn, 1024, embedding_purpose)
 
         # Titan embedding models
-        if model_prefix == "amazon" and "titan" in model_id.lower():
-            for text in texts:
+        elif model_prefix == "amazon" and "titan" in model_id.lower():
+            def embed_titan(text: str) -> tuple[list[float], int]:
                 body = {
                     "inputText": text,
                 }
                 response_body = self._invoke_bedrock_embedding(model_package_arn, bedrock_runtime, body)
-                embeddings.extend([response_body.get("embedding")])
-                token_usage += response_body.get("inputTextTokenCount")
-            logger.warning(f"Total Tokens: {token_usage}")
-            result = TextEmbeddingResult(
-                model=model,
-                embeddings=embeddings,
-                usage=self._calc_response_usage(model=model, credentials=credentials, tokens=token_usage),
-            )
-            return result
+                return response_body.get("embedding"), response_body.get("inputTextTokenCount")
+
+            def embed_texts(batch: list[str]) -> tuple[list[list[float]], int]:
+                # Titan embeds a single text per call, fan out over the pool
+                # Throttled calls are already retried by the rate limiter
+                results = run_ordered(embed_titan, batch, EMBEDDING_MAX_CONCURRENCY, max_retries=0)
+                return [embedding for embedding, _ in results], sum(tokens for _, tokens in results)
+
+            cache_namespace = (model_package_arn, None, None)
 
-        if model_prefix == "cohere":
+        elif model_prefix == "cohere":
             input_type = "search_document" if len(texts) > 1 else "search_query"
-            for text in texts:
+
+            def embed_cohere(batch: list[str]) -> list[list[float]]:
                 body = {
-                    "texts": [text],
+                    "texts": batch,
                     "input_type": input_type,
                 }
                 response_body = self._invoke_bedrock_embedding(model_package_arn, bedrock_runtime, body)
-                embeddings.extend(response_body.get("embeddings"))
-                token_usage += len(text)
-            result = TextEmbeddingResult(
-                model=model,
-                embeddings=embeddings,
-                usage=self._calc_response_usage(model=model, credentials=credentials, tokens=token_usage),
-            )
-            return result
+                return response_body.get("embeddings")
+
+            def embed_texts(batch: list[str]) -> tuple[list[list[float]], int]:
+                # Cohere accepts a list of texts, pack them into native batches
+                batch_size = min(EMBEDDING_BATCH_SIZE, COHERE_MAX_BATCH_SIZE)
+                batches = [batch[i:i + batch_size] for i in range(0, len(batch), batch_size)]
+                embeddings = []
+                # Throttled calls are already retried by the rate limiter
+                for batch_embeddings in run_ordered(embed_cohere, batches, EMBEDDING_MAX_CONCURRENCY, max_retries=0):
+                    embeddings.extend(batch_embeddings)
+                return embeddings, sum(len(text) for text in batch)
+
+            cache_namespace = (model_package_arn, None, input_type)
 
         # others
-        raise ValueError(f"Got unknown model prefix {model_prefix} when handling block response")
+        else:
+            raise ValueError(f"Got unknown model prefix {model_prefix} when handling block response")
+
+        # Only the texts that are not cached yet are sent to Bedrock
+        embedding_cache = get_embedding_cache()
+        if embedding_cache:
+            embeddings, token_usage = embedding_cache.embed(cache_namespace, texts, embed_texts)
+        else:
+            embeddings, token_usage = embed_texts(texts)
+        logger.warning(f"Total Tokens: {token_usage}")
+        result = TextEmbeddingResult(
+            model=model,
+            embeddings=embeddings,
+            usage=self._calc_response_usage(model=model, credentials=credentials, tokens=token_usage),
+        )
+        return result
 
     def get_num_tokens(self, model: str, credentials: dict, texts: list[str]) -> list[int]:
         """
@@ -229,10 +262,14 @@ class BedrockTextEmbeddingModel(TextEmbeddingModel):
         :param tokens: input tokens
         :return: usage
         """
-        # get input price info
-        input_price_info = self.get_price(
-            model=model, credentials=credentials, price_type=PriceType.INPUT, tokens=tokens
-        )
+        # get input price info, predefined models are priced from the pricing index
+        price_config = get_pricing_index(self).get_schema_pricing(model)
+        if price_config:
+            input_price_info = calc_price(price_config, PriceType.INPUT, tokens)
+        else:
+            input_price_info = self.get_price(
+                model=model, credentials=credentials, price_type=PriceType.INPUT, tokens=tokens
+            )
 
         # transform usage
         usage = EmbeddingUsage(
@@ -283,8 +320,12 @@ class BedrockTextEmbeddingModel(TextEmbeddingModel):
         accept = "application/json"
         content_type = "application/json"
         try:
-            response = bedrock_runtime.invoke_model(
-                body=json.dumps(body), modelId=model, accept=accept, contentType=content_type
+            response = call_with_rate_limit(
+                bedrock_runtime,
+                model,
+                lambda: bedrock_runtime.invoke_model(
+                    body=json.dumps(body), modelId=model, accept=accept, contentType=content_type
+                ),
             )
             response_body = json.loads(response.get("body").read().decode("utf-8"))
             return response_body
@@ -442,12 +483,13 @@ class BedrockTextEmbeddingModel(TextEmbeddingModel):
             # Traditional model - use model directly
             model_prefix = model.split(".")[0]
             
-        bedrock_runtime = get_bedrock_client("bedrock-runtime", credentials)
-
-        embeddings = []
-        token_usage = 0
+        bedrock_runtime = get_bedrock_client("bedrock-runtime", credentials, max_attempts=CLIENT_MAX_ATTEMPTS)
 
         if model_prefix == "amazon":
+            embedding_purpose = "GENERIC_INDEX" if input_type == EmbeddingInputType.DOCUMENT else "GENERIC_RETRIEVAL"
+
+            # Build and validate every request up front, so a bad document fails before any call is made
+            request_bodies = []
             for document in documents:
                 if document.content_type == MultiModalContentType.TEXT:
                     text = document.content
@@ -469,20 +511,39 @@ class BedrockTextEmbeddingModel(TextEmbeddingModel):
                     }
                 else:
                     raise ValueError(f"Unsupported content type: {document.content_type}")
-                
-                request_body = {
+
+                request_bodies.append({
                     "schemaVersion": "nova-multimodal-embed-v1",
                     "taskType": "SINGLE_EMBEDDING",
                     "singleEmbeddingParams":{
                         "embeddingDimension": 1024,
-                        "embeddingPurpose": "GENERIC_INDEX" if input_type == EmbeddingInputType.DOCUMENT else "GENERIC_RETRIEVAL",
+                        "embeddingPurpose": embedding_purpose,
                         **body,
                     }
-                }
+                })
 
+            def embed_document(request_body: dict) -> tuple[list[float], int]:
                 response_body = self._invoke_bedrock_embedding(model_id, bedrock_runtime, request_body)
-                embeddings.extend([response_body.get("embeddings")[0].get("embedding")])
-                token_usage += response_body.get("inputTextTokenCount") if response_body.get("inputTextTokenCount") else 0
+                tokens = response_body.get("inputTextTokenCount") if response_body.get("inputTextTokenCount") else 0
+                return response_body.get("embeddings")[0].get("embedding"), tokens
+
+            def payload_size(request_body: dict) -> int:
+                params = request_body["singleEmbeddingParams"]
+                if "image" in params:
+                    return len(params["image"]["source"]["bytes"])
+                return len(params.get("inputText") or "")
+
+            results = run_ordered(
+                embed_document,
+                request_bodies,
+                EMBEDDING_MAX_CONCURRENCY,
+                # Throttled calls are already retried by the rate limiter
+                max_retries=0,
+                size_of=payload_size,
+                max_in_flight_bytes=MULTIMODAL_MAX_IN_FLIGHT_BYTES,
+            )
+            embeddings = [embedding for embedding, _ in results]
+            token_usage = sum(tokens for _, tokens in results)
             logger.warning(f"Total Tokens: {token_usage}")
             result = MultiModalEmbeddingResult(
                 model=model,
@@ -6,7 +6,7 @@ from botocore.exceptions import ClientError
 from dify_plugin import ModelProvider
 from dify_plugin.entities.model import ModelType
 from dify_plugin.errors.model import CredentialsValidateFailedError
-from .get_bedrock_client import get_bedrock_client
+from .get_bedrock_client import get_bedrock_client, invalidate_bedrock_client_cache
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +20,8 @@ class AmazonBedrockModelProvider(ModelProvider):
         :param credentials: provider credentials, credentials form defined in `provider_credential_schema`.
         """
         try:
+            # Credentials are being (re)configured, drop clients built from a previous environment
+            invalidate_bedrock_client_cache(credentials)
             model_instance = self.get_model_instance(ModelType.LLM)
             # Use `amazon.nova-pro-v1:0` model by default for validating credentials
             model_for_validation = credentials.get("model_for_validation", "amazon.nova-pro-v1:0")
@@ -1,13 +1,151 @@
+from collections import OrderedDict
 from collections.abc import Mapping
 
+import hashlib
+import logging
 import os
+import threading
+import time
+from typing import Optional
+
 import boto3
+import botocore.session
 from botocore.config import Config
+from botocore.tokens import FrozenAuthToken
 
 from dify_plugin.errors.model import InvokeBadRequestError
 
+logger = logging.getLogger(__name__)
+
+# Client cache settings, can be overridden by environment variables of the plugin process
+_CLIENT_CACHE_MAX_SIZE = int(os.environ.get("BEDROCK_CLIENT_CACHE_MAX_SIZE", "64"))
+_CLIENT_CACHE_TTL = int(os.environ.get("BEDROCK_CLIENT_CACHE_TTL", "3600"))  # 1 hour
+
+# Connection pool settings used when the caller does not specify them
+DEFAULT_MAX_POOL_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+DEFAULT_TCP_KEEPALIVE = os.environ.get("BEDROCK_TCP_KEEPALIVE", "true").lower() == "true"
+
+# LRU cache of boto3 clients: cache_key -> (client, created_at)
+_client_cache: OrderedDict = OrderedDict()
+_client_cache_lock = threading.Lock()
+
+
+class _StaticTokenProvider:
+    """
+    Token provider bound to a single botocore session.
+    It replaces the default provider chain, which reads AWS_BEARER_TOKEN_BEDROCK from the process
+    environment, so that every client carries its own Bedrock API key (or none at all).
+    """
+
+    def __init__(self, token: Optional[str] = None):
+        self._token = FrozenAuthToken(token) if token else None
+
+    def load_token(self, **kwargs):
+        return self._token
+
+
+def _register_signer_hook(client, use_bearer_token: bool) -> None:
+    """
+    Pin the signer of a client according to its own authentication method.
+    botocore switches to bearer auth whenever AWS_BEARER_TOKEN_BEDROCK is present in the process
+    environment; this hook runs first and makes the decision per client instead.
+
+    :param client: boto3 client
+    :param use_bearer_token: whether the client signs requests with its Bedrock API key
+    """
+    def _choose_signer(signature_version, context, **kwargs):
+        if use_bearer_token:
+            if "smithy.api#httpBearerAuth" in (context.get("auth_options") or []):
+                return "bearer"
+            return None
+        return signature_version
+
+    client.meta.events.register_first("choose-signer", _choose_signer)
+
 
-def get_bedrock_client(service_name: str, credentials: Mapping[str, str]):
+def credentials_fingerprint(credentials: Mapping[str, str]) -> str:
+    """
+    Hash the secret parts of the credentials so that they never appear in a cache key in clear text.
+    Rotating any secret produces a new fingerprint and therefore a new client.
+
+    :param credentials: provider credentials
+    :return: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    for field in ("aws_access_key_id", "aws_secret_access_key", "bedrock_api_key"):
+        digest.update((credentials.get(field) or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _build_cache_key(
+    service_name: str,
+    credentials: Mapping[str, str],
+    max_pool_connections: int,
+    tcp_keepalive: bool,
+    max_attempts: Optional[int] = None,
+) -> tuple:
+    return (
+        service_name,
+        credentials.get("aws_region"),
+        credentials.get("auth_method", "Access_Secret_Key"),
+        credentials_fingerprint(credentials),
+        credentials.get("bedrock_endpoint_url") or "",
+        credentials.get("bedrock_proxy_url") or "",
+        max_pool_connections,
+        tcp_keepalive,
+        max_attempts,
+    )
+
+
+def invalidate_bedrock_client_cache(
+    credentials: Optional[Mapping[str, str]] = None, service_name: Optional[str] = None
+) -> int:
+    """
+    Drop cached clients so that the next call builds a fresh one.
+
+    :param credentials: only drop clients built from these credentials, all clients if None
+    :param service_name: only drop clients of this service, all services if None
+    :return: number of dropped clients
+    """
+    with _client_cache_lock:
+        if credentials is None and service_name is None:
+            dropped = len(_client_cache)
+            _client_cache.clear()
+            return dropped
+
+        fingerprint = credentials_fingerprint(credentials) if credentials is not None else None
+        region = credentials.get("aws_region") if credentials is not None else None
+        stale_keys = [
+            key
+            for key in _client_cache
+            if (service_name is None or key[0] == service_name)
+            and (fingerprint is None or (key[1] == region and key[3] == fingerprint))
+        ]
+        for key in stale_keys:
+            del _client_cache[key]
+        return len(stale_keys)
+
+
+def get_bedrock_client(
+    service_name: str,
+    credentials: Mapping[str, str],
+    max_pool_connections: Optional[int] = None,
+    tcp_keepalive: Optional[bool] = None,
+    max_attempts: Optional[int] = None,
+):
+    """
+    Get a boto3 client for the given service, reusing a cached client (and its warm connection pool)
+    when one was already built for the same service, region, authentication and endpoint settings.
+
+    :param service_name: boto3 service name, e.g. 'bedrock-runtime'
+    :param credentials: provider or model credentials
+    :param max_pool_connections: size of the client's HTTP connection pool
+    :param tcp_keepalive: whether to enable TCP keep-alive on pooled connections
+    :param max_attempts: total attempts per call made by botocore, botocore's retry policy if None.
+        1 for calls retried by the rate limiter, see utils.rate_limiter.CLIENT_MAX_ATTEMPTS
+    :return: boto3 client
+    """
     region_name = credentials.get("aws_region")
     if not region_name:
         raise InvokeBadRequestError("aws_region is required")
@@ -20,8 +158,41 @@ def get_bedrock_client(service_name: str, credentials: Mapping[str, str]):
     if bedrock_endpoint_url and bedrock_proxy_url:
         raise InvokeBadRequestError("Cannot use both bedrock_endpoint_url and bedrock_proxy_url at the same time. Please choose one or none.")
 
-    # Initialize client config with region
-    client_config = Config(region_name=region_name)
+    if max_pool_connections is None:
+        max_pool_connections = DEFAULT_MAX_POOL_CONNECTIONS
+    if tcp_keepalive is None:
+        tcp_keepalive = DEFAULT_TCP_KEEPALIVE
+
+    cache_key = _build_cache_key(service_name, credentials, max_pool_connections, tcp_keepalive, max_attempts)
+
+    # Check authentication method
+    auth_method = credentials.get("auth_method", "Access_Secret_Key")
+
+    bedrock_api_key = None
+    if auth_method == "API_Key":
+        # Use API Key authentication
+        bedrock_api_key = credentials.get("bedrock_api_key")
+        if not bedrock_api_key:
+            raise InvokeBadRequestError("bedrock_api_key is required when using API Key authentication")
+
+    current_time = time.time()
+    with _client_cache_lock:
+        if cache_key in _client_cache:
+            client, created_at = _client_cache[cache_key]
+            if current_time - created_at < _CLIENT_CACHE_TTL:
+                _client_cache.move_to_end(cache_key)
+                return client
+            # Expired, rebuild below
+            del _client_cache[cache_key]
+
+    # Initialize client config with region and connection pool settings
+    client_config = Config(
+        region_name=region_name,
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=tcp_keepalive,
+    )
+    if max_attempts is not None:
+        client_config = client_config.merge(Config(retries={"total_max_attempts": max_attempts}))
 
     # Configure proxy if provided
     if bedrock_proxy_url:
@@ -40,32 +211,35 @@ def get_bedrock_client(service_name: str, credentials: Mapping[str, str]):
     if bedrock_endpoint_url and service_name == 'bedrock-runtime':
         client_kwargs['endpoint_url'] = bedrock_endpoint_url
 
-    # Check authentication method
-    auth_method = credentials.get("auth_method", "Access_Secret_Key")
-
-    if auth_method == "API_Key":
-        # Use API Key authentication
-        bedrock_api_key = credentials.get("bedrock_api_key")
-        if not bedrock_api_key:
-            raise InvokeBadRequestError("bedrock_api_key is required when using API Key authentication")
-        
-        # Add API Key to client config
-        os.environ['AWS_BEARER_TOKEN_BEDROCK'] = bedrock_api_key
-
-    elif auth_method == "Access_Secret_Key":
+    if auth_method == "Access_Secret_Key":
         # Use IAM authentication (default)
-        if 'AWS_BEARER_TOKEN_BEDROCK' in os.environ:
-            os.environ.pop('AWS_BEARER_TOKEN_BEDROCK')
         aws_access_key_id = credentials.get("aws_access_key_id")
         aws_secret_access_key = credentials.get("aws_secret_access_key")
-        
+
         # Add credentials if provided
         if aws_access_key_id and aws_secret_access_key:
             client_kwargs['aws_access_key_id'] = aws_access_key_id
             client_kwargs['aws_secret_access_key'] = aws_secret_access_key
-    else: # auth_method == "IAM_Role"
-        if 'AWS_BEARER_TOKEN_BEDROCK' in os.environ:
-            os.environ.pop('AWS_BEARER_TOKEN_BEDROCK')
 
-    client = boto3.client(**client_kwargs)
+    # The default boto3 session is not thread safe, build the client from a dedicated session.
+    # The API key is injected through the session's token provider instead of the process environment,
+    # so clients of tenants with different auth methods can be used concurrently.
+    botocore_session = botocore.session.Session()
+    botocore_session.register_component("token_provider", _StaticTokenProvider(bedrock_api_key))
+    client = boto3.session.Session(botocore_session=botocore_session).client(**client_kwargs)
+    _register_signer_hook(client, use_bearer_token=bedrock_api_key is not None)
+
+    with _client_cache_lock:
+        if cache_key in _client_cache:
+            # Another thread built the same client in the meantime, keep the first one
+            _client_cache.move_to_end(cache_key)
+            return _client_cache[cache_key][0]
+
+        # Evict least recently used clients if at capacity
+        while len(_client_cache) >= _CLIENT_CACHE_MAX_SIZE:
+            _client_cache.popitem(last=False)
+
+        _client_cache[cache_key] = (client, time.time())
+        logger.debug(f"Created {service_name} client in {region_name} (cache size: {len(_client_cache)})")
+
     return client
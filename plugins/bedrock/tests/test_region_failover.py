@@ -0,0 +1,254 @@
+"""
+Region failover against local stub endpoints.
+Every region is served by a local HTTP server answering the converse API. Clients are built by get_bedrock_client
+with the region's server as endpoint URL, so that the plugin's client configuration, the rate limiter, the region
+router and the error mapping of the model are exercised without AWS credentials.
+Run from the plugin directory: python -m pytest tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# dify_plugin monkey patches the standard library with gevent, it must come before boto3
+from dify_plugin.entities.model.llm import LLMUsage
+from dify_plugin.entities.model.message import UserPromptMessage
+from dify_plugin.errors.model import InvokeRateLimitError, InvokeServerUnavailableError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.llm.llm as llm_module  # noqa: E402
+import utils.hedging as hedging  # noqa: E402
+import utils.rate_limiter as rate_limiter  # noqa: E402
+import utils.region_router as region_router  # noqa: E402
+from models.llm.llm import BedrockLargeLanguageModel  # noqa: E402
+from provider.get_bedrock_client import credentials_fingerprint, get_bedrock_client  # noqa: E402
+
+MODEL = "anthropic claude"
+MODEL_NAME = "Claude 4.5 Haiku"
+CREDENTIALS = {"aws_region": "us-east-1", "aws_access_key_id": "tenant-a", "aws_secret_access_key": "secret"}
+SLOW_SECONDS = 1.5
+
+ERRORS = {
+    "throttle": (429, "ThrottlingException"),
+    "unavailable": (500, "InternalServerException"),
+}
+
+
+class StubRegion:
+    """Local converse endpoint of a region, answering with the configured behavior"""
+
+    def __init__(self, region: str):
+        self.region = region
+        self.behavior = "ok"
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.calls += 1
+                if stub.behavior == "slow":
+                    time.sleep(SLOW_SECONDS)
+                if stub.behavior in ERRORS:
+                    status, error_type = ERRORS[stub.behavior]
+                    body = {"message": f"{error_type} in {stub.region}"}
+                    headers = {"x-amzn-ErrorType": f"{error_type}:"}
+                else:
+                    status = 200
+                    body = {
+                        "output": {"message": {"role": "assistant", "content": [{"text": f"hello from {stub.region}"}]}},
+                        "stopReason": "end_turn",
+                        "usage": {"inputTokens": 3, "outputTokens": 4, "totalTokens": 7},
+                        "metrics": {"latencyMs": 1},
+                    }
+                    headers = {}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def regions(monkeypatch):
+    stubs = {region: StubRegion(region) for region in ("us-east-1", "us-west-2", "eu-west-1")}
+
+    def get_stub_client(service_name, credentials, *args, **kwargs):
+        # The plugin's client, only pointed at the stub of the region
+        endpoint_url = stubs[credentials["aws_region"]].url
+        return get_bedrock_client(service_name, {**credentials, "bedrock_endpoint_url": endpoint_url}, *args, **kwargs)
+
+    monkeypatch.setattr(llm_module, "get_bedrock_client", get_stub_client)
+    monkeypatch.setattr(llm_module, "is_hedging_enabled", lambda: False)
+    monkeypatch.setattr(llm_module, "get_region_router", lambda router=region_router.RegionRouter(): router)
+    monkeypatch.setattr(rate_limiter, "_buckets", rate_limiter._buckets.__class__())
+    yield stubs
+    for stub in stubs.values():
+        stub.close()
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = BedrockLargeLanguageModel.__new__(BedrockLargeLanguageModel)
+    model.started_at = time.perf_counter()
+    monkeypatch.setattr(model, "_calc_response_usage", lambda *args, **kwargs: LLMUsage.empty_usage(), raising=False)
+    return model
+
+
+def invoke(model, failover_regions="us-west-2, eu-west-1", credentials=CREDENTIALS):
+    credentials = {**credentials, "aws_failover_regions": failover_regions}
+    result = model._generate_with_region_failover(
+        MODEL,
+        credentials,
+        [UserPromptMessage(content="hello")],
+        {"model_name": MODEL_NAME},
+        stream=False,
+    )
+    return result.message.content
+
+
+def health(region, credentials=CREDENTIALS):
+    route_key = f"{credentials_fingerprint(credentials)[:16]}/{MODEL}/{MODEL_NAME}"
+    return llm_module.get_region_router().health(route_key, region)
+
+
+def test_primary_region_serves_when_healthy(regions, model):
+    assert invoke(model) == "hello from us-east-1"
+    assert regions["us-west-2"].calls == 0
+
+
+@pytest.mark.parametrize("behavior", ["throttle", "unavailable"])
+def test_fails_over_without_retrying_in_the_failed_region(regions, model, behavior):
+    regions["us-east-1"].behavior = behavior
+
+    started_at = time.perf_counter()
+    assert invoke(model) == "hello from us-west-2"
+
+    # Neither botocore nor the rate limiter retry in a region that can fail over
+    assert time.perf_counter() - started_at < 1
+    assert regions["us-east-1"].calls == 1
+
+
+def test_last_region_retries_throttling(regions, model):
+    regions["us-east-1"].behavior = "throttle"
+
+    # Retried by the rate limiter only, botocore makes a single attempt per retry
+    with pytest.raises(InvokeRateLimitError):
+        invoke(model, failover_regions="")
+    assert regions["us-east-1"].calls == rate_limiter._MAX_RETRIES + 1
+
+
+def test_circuit_opens_and_skips_region(regions, model, monkeypatch):
+    monkeypatch.setattr(region_router, "_CONSECUTIVE_FAILURES", 1)
+    regions["us-east-1"].behavior = "unavailable"
+
+    assert invoke(model) == "hello from us-west-2"
+    assert health("us-east-1").state == region_router.OPEN
+
+    regions["us-east-1"].behavior = "ok"
+    assert invoke(model) == "hello from us-west-2"
+    assert regions["us-east-1"].calls == 1
+
+
+def test_circuits_are_per_tenant(regions, model, monkeypatch):
+    monkeypatch.setattr(region_router, "_CONSECUTIVE_FAILURES", 1)
+    other_tenant = {**CREDENTIALS, "aws_access_key_id": "tenant-b"}
+    regions["us-east-1"].behavior = "unavailable"
+    invoke(model)
+    assert health("us-east-1").state == region_router.OPEN
+
+    regions["us-east-1"].behavior = "ok"
+    assert invoke(model, credentials=other_tenant) == "hello from us-east-1"
+    assert health("us-east-1", other_tenant).state == region_router.CLOSED
+
+
+def test_half_open_probe_closes_circuit_on_recovery(regions, model, monkeypatch):
+    monkeypatch.setattr(region_router, "_CONSECUTIVE_FAILURES", 1)
+    monkeypatch.setattr(region_router, "_OPEN_SECONDS", 0.2)
+    regions["us-east-1"].behavior = "unavailable"
+    invoke(model)
+    assert health("us-east-1").state == region_router.OPEN
+
+    regions["us-east-1"].behavior = "ok"
+    time.sleep(0.3)
+    assert health("us-east-1").state == region_router.HALF_OPEN
+
+    assert invoke(model) == "hello from us-east-1"
+    assert health("us-east-1").state == region_router.CLOSED
+
+
+def test_failed_probe_reopens_circuit(regions, model, monkeypatch):
+    monkeypatch.setattr(region_router, "_CONSECUTIVE_FAILURES", 1)
+    monkeypatch.setattr(region_router, "_OPEN_SECONDS", 0.2)
+    regions["us-east-1"].behavior = "unavailable"
+    invoke(model)
+    time.sleep(0.3)
+
+    assert invoke(model) == "hello from us-west-2"
+    assert regions["us-east-1"].calls == 2
+    assert health("us-east-1").state == region_router.OPEN
+
+
+def test_untried_regions_keep_their_probe(regions, model, monkeypatch):
+    monkeypatch.setattr(region_router, "_CONSECUTIVE_FAILURES", 1)
+    monkeypatch.setattr(region_router, "_OPEN_SECONDS", 0.2)
+    regions["eu-west-1"].behavior = "unavailable"
+    regions["us-east-1"].behavior = "unavailable"
+    regions["us-west-2"].behavior = "unavailable"
+    with pytest.raises(InvokeServerUnavailableError):
+        invoke(model)
+    for stub in regions.values():
+        stub.behavior = "ok"
+    time.sleep(0.3)
+
+    # The request is served by the first region, the other half-open circuits were planned but not called
+    assert invoke(model) == "hello from us-east-1"
+    for region in ("us-west-2", "eu-west-1"):
+        assert health(region).state == region_router.HALF_OPEN
+        assert health(region).allow_request()
+
+
+def test_slow_call_is_hedged_in_next_region(regions, model, monkeypatch):
+    monkeypatch.setattr(hedging, "_HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(hedging, "_HEDGE_DEFAULT_DELAY", 0.05)
+    hedger = hedging.Hedger(budget_ratio=1.0)
+    monkeypatch.setattr(llm_module, "is_hedging_enabled", lambda: True)
+    monkeypatch.setattr(llm_module, "get_hedger", lambda: hedger)
+    regions["us-east-1"].behavior = "slow"
+
+    started_at = time.perf_counter()
+    assert invoke(model) == "hello from us-west-2"
+    assert time.perf_counter() - started_at < SLOW_SECONDS
+    assert hedger.stats()["hedge_wins"] == 1
+    assert regions["eu-west-1"].calls == 0
+
+
+def test_last_error_is_raised_when_every_region_fails(regions, model):
+    for stub in regions.values():
+        stub.behavior = "unavailable"
+    with pytest.raises(InvokeServerUnavailableError):
+        invoke(model)
+    assert [stub.calls for stub in regions.values()] == [1, 1, 1]
+
+
+def test_zero_weights_still_route_to_primary(regions, model):
+    assert invoke(model, failover_regions="us-east-1:0, us-west-2:0") == "hello from us-east-1"
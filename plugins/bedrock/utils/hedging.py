@@ -0,0 +1,232 @@
+"""
+Hedged requests for latency-critical, non-streaming Bedrock calls.
+When a call hasn't answered within a high percentile of its recent latencies, a second call (e.g. to the next
+region of the route) is fired in a bounded pool, and the first successful response of the two is used.
+A budget caps the share of calls that may be hedged, and no hedge is fired while the pool is busy.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Hedging is opt-in, can be enabled by environment variables of the plugin process
+_HEDGING_ENABLED = os.environ.get("BEDROCK_HEDGING_ENABLED", "false").lower() == "true"
+# Latency percentile after which the hedge is fired
+_HEDGE_PERCENTILE = float(os.environ.get("BEDROCK_HEDGE_PERCENTILE", "95"))
+# Delay used until enough latencies were observed, and lower bound of the delay
+_HEDGE_MIN_DELAY = float(os.environ.get("BEDROCK_HEDGE_MIN_DELAY_MS", "200")) / 1000
+_HEDGE_DEFAULT_DELAY = float(os.environ.get("BEDROCK_HEDGE_DEFAULT_DELAY_MS", "2000")) / 1000
+# Maximum share of calls that may be hedged, e.g. 0.05 for 5%
+_HEDGE_BUDGET_RATIO = float(os.environ.get("BEDROCK_HEDGE_BUDGET_RATIO", "0.05"))
+_HEDGE_MAX_WORKERS = int(os.environ.get("BEDROCK_HEDGE_MAX_WORKERS", "32"))
+_LATENCY_WINDOW_SIZE = 200
+_MIN_LATENCY_SAMPLES = 20
+
+
+def is_hedging_enabled() -> bool:
+    return _HEDGING_ENABLED
+
+
+class LatencyTracker:
+    """Rolling window of call latencies"""
+
+    def __init__(self, window_size: int = _LATENCY_WINDOW_SIZE):
+        self._latencies: deque = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < _MIN_LATENCY_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+class HedgingBudget:
+    """
+    Every call earns `ratio` credits and every hedge spends one, so at most `ratio` of the calls are hedged
+    """
+
+    def __init__(self, ratio: float, max_credits: float = 10.0):
+        self._ratio = ratio
+        self._max_credits = max_credits
+        self._credits = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self._credits = min(self._max_credits, self._credits + self._ratio)
+
+    def refund(self) -> None:
+        with self._lock:
+            self._credits = min(self._max_credits, self._credits + 1)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credits >= 1:
+                self._credits -= 1
+                return True
+            return False
+
+
+class Hedger:
+    """Runs hedged calls, tracking latencies per key (e.g. per model)"""
+
+    def __init__(self, percentile: float = _HEDGE_PERCENTILE, budget_ratio: float = _HEDGE_BUDGET_RATIO):
+        self._percentile = percentile
+        self._budget = HedgingBudget(budget_ratio)
+        self._trackers: dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=_HEDGE_MAX_WORKERS, thread_name_prefix="bedrock-hedge")
+        self._in_flight = 0
+        self._stats = {"calls": 0, "hedges": 0, "hedge_wins": 0, "budget_exhausted": 0, "pool_saturated": 0}
+
+    def _tracker(self, key: str) -> LatencyTracker:
+        with self._lock:
+            tracker = self._trackers.get(key)
+            if tracker is None:
+                tracker = self._trackers[key] = LatencyTracker()
+            return tracker
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> dict:
+        """
+        :return: calls, hedges fired, hedges whose response was used, and hedges skipped for lack of budget
+            or of a free worker
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def hedge_delay(self, key: str) -> float:
+        """
+        :return: seconds to wait for the first call before firing the hedge
+        """
+        latency = self._tracker(key).percentile(self._percentile)
+        return max(_HEDGE_MIN_DELAY, latency if latency is not None else _HEDGE_DEFAULT_DELAY)
+
+    def _submit(self, key: str, call: Callable[[], Any]) -> Optional[Future]:
+        """
+        Run a hedge in the pool, None if every worker is busy: queued behind other hedges it would come too late
+        """
+        with self._lock:
+            if self._in_flight >= _HEDGE_MAX_WORKERS:
+                return None
+            self._in_flight += 1
+
+        tracker = self._tracker(key)
+        started_at = time.perf_counter()
+        future = self._executor.submit(call)
+
+        def on_done(done: Future) -> None:
+            with self._lock:
+                self._in_flight -= 1
+            if done.exception() is None:
+                tracker.record(time.perf_counter() - started_at)
+
+        future.add_done_callback(on_done)
+        return future
+
+    def _start(self, key: str, call: Callable[[], Any]) -> Future:
+        """
+        Run a first call on its own thread, so that it isn't queued behind hedges in the pool
+        """
+        tracker = self._tracker(key)
+        future: Future = Future()
+
+        def run() -> None:
+            started_at = time.perf_counter()
+            try:
+                response = call()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            tracker.record(time.perf_counter() - started_at)
+            future.set_result(response)
+
+        threading.Thread(target=run, name="bedrock-hedged-call", daemon=True).start()
+        return future
+
+    def _fire_hedge(self, key: str, call: Callable[[], Any]) -> Optional[Future]:
+        if not self._budget.try_spend():
+            self._count("budget_exhausted")
+            return None
+        hedge = self._submit(key, call)
+        if hedge is None:
+            self._budget.refund()
+            self._count("pool_saturated")
+            return None
+        self._count("hedges")
+        logger.debug(f"Hedging {key} after {self.hedge_delay(key):.3f}s")
+        return hedge
+
+    def call(
+        self,
+        key: str,
+        call: Callable[[], Any],
+        hedge_call: Optional[Callable[[], Any]] = None,
+        on_discarded: Optional[Callable[[Any], None]] = None,
+    ) -> Any:
+        """
+        Run a call, hedging it if it is slower than usual and the budget allows it.
+        The call and its hedge race, the first successful response is returned.
+
+        :param key: latency tracking key, e.g. the model ID
+        :param call: function making the call
+        :param hedge_call: function making the hedge, e.g. the call in another region; the same call if None
+        :param on_discarded: called with the response that isn't returned, once it arrives
+        :return: the first successful response; if both fail, the call's error is raised
+        """
+        self._count("calls")
+        self._budget.earn()
+
+        primary = self._start(key, call)
+        done, _ = wait([primary], timeout=self.hedge_delay(key))
+        if done:
+            return primary.result()
+
+        hedge = self._fire_hedge(key, hedge_call or call)
+        if hedge is None:
+            return primary.result()
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in (primary, hedge) if future in done and future.exception() is None), None)
+            if winner is None:
+                continue
+            if winner is hedge:
+                self._count("hedge_wins")
+            loser = primary if winner is hedge else hedge
+            if on_discarded:
+                loser.add_done_callback(lambda lost: on_discarded(lost.result()) if lost.exception() is None else None)
+            return winner.result()
+        return primary.result()
+
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger:
+    """
+    Get the process-wide hedger
+    """
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger()
+    return _hedger
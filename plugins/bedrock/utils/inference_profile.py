@@ -1,27 +1,50 @@
 """
 Shared utility functions for Bedrock inference profiles
 """
+import json
 import logging
+import os
+import tempfile
 import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from collections import OrderedDict
 from botocore.exceptions import ClientError
 from dify_plugin.errors.model import CredentialsValidateFailedError
 from provider.get_bedrock_client import get_bedrock_client
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows, concurrent writers then simply race
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
-# Cache for inference profile info with 5 minutes TTL
+# Cache for inference profile info with 5 minutes TTL, can be overridden by environment variables of the plugin process
 _inference_profile_cache: dict = {}
-_CACHE_TTL = 300  # 5 minutes
+_CACHE_TTL = int(os.environ.get("BEDROCK_INFERENCE_PROFILE_CACHE_TTL", "300"))  # 5 minutes
+# Entries are refreshed in the background this many seconds before they expire, the old entry is served meanwhile
+_CACHE_REFRESH_AHEAD = int(os.environ.get("BEDROCK_INFERENCE_PROFILE_CACHE_REFRESH_AHEAD", "60"))
+# Expired entries are still served (while refreshing) for this long, e.g. when GetInferenceProfile is throttled
+_CACHE_MAX_STALE = int(os.environ.get("BEDROCK_INFERENCE_PROFILE_CACHE_MAX_STALE", "3600"))
+# JSON file persisting the cache across restarts, shared by the worker processes, disabled if empty
+_CACHE_PATH = os.environ.get("BEDROCK_INFERENCE_PROFILE_CACHE_PATH", "")
 _cache_lock = threading.Lock()
 
+# Cache keys being refreshed in the background
+_refreshing: set = set()
+
+# Cache metrics
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "disk_hits": 0, "refreshes": 0, "refresh_failures": 0}
+
 # Per-key locks to prevent thundering herd (multiple threads fetching same profile)
 _fetch_locks: OrderedDict = OrderedDict()
 _fetch_locks_lock = threading.Lock()
 _MAX_FETCH_LOCKS = 1000 
 
+# Serializes reads and writes of the cache file within this process
+_file_lock = threading.Lock()
+
 def _get_fetch_lock(cache_key: str) -> threading.Lock:
     """Get or create a lock for a specific cache key to prevent thundering herd"""
     with _fetch_locks_lock:
@@ -39,9 +62,166 @@ def _get_fetch_lock(cache_key: str) -> threading.Lock:
         return lock
 
 
+def _count(stat: str) -> None:
+    with _cache_lock:
+        _stats[stat] += 1
+
+
+def get_inference_profile_cache_stats() -> dict:
+    """
+    Get the inference profile cache metrics
+
+    :return: hit, stale hit, miss, disk hit, refresh and refresh failure counters, and the cache size
+    """
+    with _cache_lock:
+        stats = dict(_stats)
+        stats["size"] = len(_inference_profile_cache)
+    return stats
+
+
+def _serializable(response: dict) -> dict:
+    # Drop the request metadata and turn datetimes (createdAt, updatedAt) into strings
+    profile_info = {key: value for key, value in response.items() if key != "ResponseMetadata"}
+    return json.loads(json.dumps(profile_info, default=str))
+
+
+def _read_cache_file() -> dict:
+    if not _CACHE_PATH or not os.path.exists(_CACHE_PATH):
+        return {}
+    try:
+        with open(_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to read inference profile cache file {_CACHE_PATH}: {str(e)}")
+        return {}
+
+
+def _load_from_file(cache_key: str) -> Optional[tuple]:
+    """
+    Load an entry persisted by this or another worker process
+
+    :param cache_key: cache key
+    :return: (profile info, fetched at) or None
+    """
+    if not _CACHE_PATH:
+        return None
+    with _file_lock:
+        entry = _read_cache_file().get(cache_key)
+    if not entry:
+        return None
+    return entry["data"], entry["fetched_at"]
+
+
+def _save_to_file(cache_key: str, profile_info: dict, fetched_at: float) -> None:
+    """
+    Merge an entry into the cache file, replacing the file atomically
+    """
+    if not _CACHE_PATH:
+        return
+    try:
+        with _file_lock, open(f"{_CACHE_PATH}.lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = _read_cache_file()
+            # Drop entries no longer servable so the file doesn't grow forever
+            now = time.time()
+            entries = {
+                key: entry for key, entry in entries.items()
+                if now - entry.get("fetched_at", 0) < _CACHE_TTL + _CACHE_MAX_STALE
+            }
+            entries[cache_key] = {"data": _serializable(profile_info), "fetched_at": fetched_at}
+
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(_CACHE_PATH)), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, _CACHE_PATH)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Failed to write inference profile cache file {_CACHE_PATH}: {str(e)}")
+
+
+def _fetch(inference_profile_id: str, credentials: dict, cache_key: str) -> dict:
+    bedrock_client = get_bedrock_client("bedrock", credentials)
+    response = bedrock_client.get_inference_profile(
+        inferenceProfileIdentifier=inference_profile_id
+    )
+
+    fetched_at = time.time()
+    with _cache_lock:
+        _inference_profile_cache[cache_key] = (response, fetched_at)
+        logger.debug(f"Cached inference profile info for {inference_profile_id} (cache size: {len(_inference_profile_cache)})")
+    _save_to_file(cache_key, response, fetched_at)
+    return response
+
+
+def _refresh_in_background(inference_profile_id: str, credentials: dict, cache_key: str) -> None:
+    """
+    Refresh an entry on a background thread, at most one refresh per cache key at a time
+    """
+    with _cache_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def refresh():
+        try:
+            with _get_fetch_lock(cache_key):
+                # Another worker process may already have refreshed the entry
+                persisted = _load_from_file(cache_key)
+                if persisted and time.time() - persisted[1] < _CACHE_TTL - _CACHE_REFRESH_AHEAD:
+                    with _cache_lock:
+                        _inference_profile_cache[cache_key] = persisted
+                    return
+                _fetch(inference_profile_id, credentials, cache_key)
+            _count("refreshes")
+        except Exception as e:
+            # Keep serving the old entry, the next request past the refresh point retries
+            _count("refresh_failures")
+            logger.warning(f"Background refresh of inference profile {inference_profile_id} failed: {str(e)}")
+        finally:
+            with _cache_lock:
+                _refreshing.discard(cache_key)
+
+    threading.Thread(target=refresh, name=f"inference-profile-refresh-{cache_key}", daemon=True).start()
+
+
+def _lookup(cache_key: str) -> Optional[tuple]:
+    """
+    Look up an entry in memory, then in the cache file
+
+    :return: (profile info, age in seconds) or None if missing or too stale to serve
+    """
+    with _cache_lock:
+        entry = _inference_profile_cache.get(cache_key)
+    from_file = False
+    if entry is None:
+        entry = _load_from_file(cache_key)
+        from_file = entry is not None
+    if entry is None:
+        return None
+
+    cached_data, fetched_at = entry
+    age = time.time() - fetched_at
+    if age >= _CACHE_TTL + _CACHE_MAX_STALE:
+        with _cache_lock:
+            _inference_profile_cache.pop(cache_key, None)
+        return None
+
+    if from_file:
+        with _cache_lock:
+            _inference_profile_cache.setdefault(cache_key, entry)
+        _count("disk_hits")
+    return cached_data, age
+
+
 def get_inference_profile_info(inference_profile_id: str, credentials: dict) -> dict:
     """
     Get inference profile information from Bedrock API with 5-minute caching.
+    Entries close to expiry are refreshed in the background while the cached one is served
+    (stale-while-revalidate), so only a cold or long-expired entry is fetched on the request path.
     Uses per-key locking to prevent thundering herd problem where high-frequency
     calls will cause GetInferenceProfile throttling.
 
@@ -49,25 +229,22 @@ def get_inference_profile_info(inference_profile_id: str, credentials: dict) ->
     :param credentials: credentials containing AWS access info
     :return: inference profile information
     """
-    current_time = time.time()
-
     # Create cache key based on profile ID and AWS region
     aws_region = credentials.get("aws_region", "default")
     cache_key = f"{inference_profile_id}:{aws_region}"
 
     # Quick check without fetch lock (fast path for cache hits)
-    with _cache_lock:
-        if cache_key in _inference_profile_cache:
-            cached_data, timestamp = _inference_profile_cache[cache_key]
-            if current_time - timestamp < _CACHE_TTL:
-                # Refresh timestamp on hit to keep active profiles cached
-                _inference_profile_cache[cache_key] = (cached_data, current_time)
-                logger.debug(f"Using cached inference profile info for {inference_profile_id}")
-                return cached_data
-            else:
-                # Remove expired cache entry
-                logger.debug(f"Cache expired for inference profile {inference_profile_id}, fetching fresh data")
-                del _inference_profile_cache[cache_key]
+    cached = _lookup(cache_key)
+    if cached is not None:
+        cached_data, age = cached
+        if age < _CACHE_TTL - _CACHE_REFRESH_AHEAD:
+            _count("hits")
+            logger.debug(f"Using cached inference profile info for {inference_profile_id}")
+        else:
+            _count("hits" if age < _CACHE_TTL else "stale_hits")
+            logger.debug(f"Refreshing inference profile {inference_profile_id} in the background (age: {age:.0f}s)")
+            _refresh_in_background(inference_profile_id, dict(credentials), cache_key)
+        return cached_data
 
     # Get per-key lock to prevent thundering herd
     # Only one thread will fetch for a given cache_key at a time
@@ -76,30 +253,16 @@ def get_inference_profile_info(inference_profile_id: str, credentials: dict) ->
     with fetch_lock:
         # Double-check cache after acquiring fetch lock
         # Another thread may have populated the cache while we were waiting
-        current_time = time.time()  # Refresh time after potentially waiting on lock
-        with _cache_lock:
-            if cache_key in _inference_profile_cache:
-                cached_data, timestamp = _inference_profile_cache[cache_key]
-                if current_time - timestamp < _CACHE_TTL:
-                    # Refresh timestamp on hit
-                    _inference_profile_cache[cache_key] = (cached_data, current_time)
-                    logger.debug(f"Using cached inference profile info for {inference_profile_id} (after wait)")
-                    return cached_data
+        cached = _lookup(cache_key)
+        if cached is not None:
+            _count("hits")
+            logger.debug(f"Using cached inference profile info for {inference_profile_id} (after wait)")
+            return cached[0]
 
         # Only one thread reaches here per cache_key
+        _count("misses")
         try:
-            bedrock_client = get_bedrock_client("bedrock", credentials)
-
-            response = bedrock_client.get_inference_profile(
-                inferenceProfileIdentifier=inference_profile_id
-            )
-
-            with _cache_lock:
-                _inference_profile_cache[cache_key] = (response, time.time())
-                logger.debug(f"Cached inference profile info for {inference_profile_id} (cache size: {len(_inference_profile_cache)})")
-
-            return response
-
+            return _fetch(inference_profile_id, credentials, cache_key)
         except Exception as e:
             logger.error(f"Failed to get inference profile info: {str(e)}")
             raise
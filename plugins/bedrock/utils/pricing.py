@@ -0,0 +1,197 @@
+"""
+Precomputed pricing lookups for Bedrock models.
+The index is built once from the predefined model schemas and the individual model configuration files,
+so computing the usage of a response never touches the disk nor parses YAML.
+"""
+import decimal
+import logging
+import os
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Optional
+
+import yaml
+
+from dify_plugin.entities.model import AIModelEntity, PriceConfig, PriceInfo, PriceType
+
+logger = logging.getLogger(__name__)
+
+# Directory of the individual LLM configuration files, e.g. models/llm/model_configurations/nova-pro.yaml
+MODEL_CONFIGURATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "llm", "model_configurations"
+)
+
+# Model names (the model_name parameter of a model family) mapped to their individual configuration file
+MODEL_NAME_TO_CONFIGURATION = MappingProxyType({
+    # Claude models
+    'Claude 4.0 Sonnet': 'claude-4-sonnet',
+    'Claude 4.0 Opus': 'claude-4-opus',
+    'Claude 3.7 Sonnet': 'claude-3-7-sonnet',
+    'Claude 3.5 Haiku': 'claude-3-5-haiku',
+    'Claude 3.5 Sonnet': 'claude-3-5-sonnet',
+    'Claude 3.5 Sonnet V2': 'claude-3-5-sonnet',
+    'Claude 3 Haiku': 'claude-3-haiku',
+    'Claude 3 Sonnet': 'claude-3-sonnet',
+    'Claude 3 Opus': 'claude-3-opus',
+    # Nova models
+    'Nova Micro': 'nova-micro',
+    'Nova Lite': 'nova-lite',
+    'Nova Pro': 'nova-pro',
+    # Cohere models
+    'Command': 'cohere-command',
+    'Command Light': 'cohere-command-light',
+    'Command R': 'cohere-command-r',
+    'Command R+': 'cohere-command-rplus',
+})
+
+_ZERO = decimal.Decimal("0.0")
+
+
+@lru_cache(maxsize=None)
+def load_configuration_pricing(configuration_dir: str = MODEL_CONFIGURATIONS_DIR) -> MappingProxyType:
+    """
+    Read the pricing of every individual model configuration file, once per process
+
+    :param configuration_dir: directory of the configuration files
+    :return: read-only mapping of configuration name to pricing
+    """
+    pricing = {}
+    if not os.path.isdir(configuration_dir):
+        return MappingProxyType(pricing)
+
+    for file_name in sorted(os.listdir(configuration_dir)):
+        name, extension = os.path.splitext(file_name)
+        if extension not in (".yaml", ".yml"):
+            continue
+        try:
+            with open(os.path.join(configuration_dir, file_name), "r", encoding="utf-8") as f:
+                model_config = yaml.safe_load(f) or {}
+            if model_config.get("pricing"):
+                pricing[name] = PriceConfig(**model_config["pricing"])
+        except Exception as e:
+            # A broken file only loses its own pricing, lookups fall back to the family pricing
+            logger.warning(f"Failed to load pricing from {file_name}: {str(e)}")
+    return MappingProxyType(pricing)
+
+
+def calc_price(price_config: Optional[PriceConfig], price_type: PriceType, tokens: int) -> PriceInfo:
+    """
+    Compute the price of tokens, with the same rounding as AIModel.get_price
+
+    :param price_config: pricing of the model, None if unknown
+    :param price_type: input or output
+    :param tokens: number of tokens
+    :return: price info, zero if the model has no price for price_type
+    """
+    unit_price = None
+    if price_config:
+        if price_type == PriceType.INPUT:
+            unit_price = price_config.input
+        elif price_type == PriceType.OUTPUT and price_config.output is not None:
+            unit_price = price_config.output
+
+    if unit_price is None:
+        return PriceInfo(unit_price=_ZERO, unit=_ZERO, total_amount=_ZERO, currency="USD")
+
+    total_amount = tokens * unit_price * price_config.unit
+    total_amount = total_amount.quantize(decimal.Decimal("0.0000001"), rounding=decimal.ROUND_HALF_UP)
+    return PriceInfo(
+        unit_price=unit_price,
+        unit=price_config.unit,
+        total_amount=total_amount,
+        currency=price_config.currency,
+    )
+
+
+class PricingIndex:
+    """
+    Immutable pricing lookups of a model type: model family -> pricing, and model name -> pricing
+    """
+
+    def __init__(self, model_schemas: list[AIModelEntity], configuration_pricing: Optional[MappingProxyType] = None):
+        """
+        :param model_schemas: predefined model schemas
+        :param configuration_pricing: pricing of the individual configuration files, none for model types without them
+        """
+        schema_pricing = {}
+        for schema in model_schemas:
+            # Keep the first schema of a name, as a linear scan would
+            if schema.pricing and schema.model not in schema_pricing:
+                schema_pricing[schema.model] = schema.pricing
+        self._schema_pricing = MappingProxyType(schema_pricing)
+
+        model_name_pricing = {}
+        if configuration_pricing is not None:
+            for model_name, configuration_name in MODEL_NAME_TO_CONFIGURATION.items():
+                # Individual configuration file first, then a predefined schema of the same name
+                pricing = configuration_pricing.get(configuration_name) or schema_pricing.get(configuration_name)
+                if pricing:
+                    model_name_pricing[model_name] = pricing
+        self._model_name_pricing = MappingProxyType(model_name_pricing)
+
+    def get_schema_pricing(self, model: str) -> Optional[PriceConfig]:
+        """
+        Get the pricing of a predefined model
+
+        :param model: model as in the schema, e.g. 'amazon.titan-embed-text-v2:0'
+        :return: pricing or None
+        """
+        return self._schema_pricing.get(model)
+
+    def get_pricing(self, model: str, model_name: Optional[str] = None) -> Optional[PriceConfig]:
+        """
+        Get the pricing of a specific model name, falling back to the pricing of its family
+
+        :param model: the model family (e.g., 'anthropic-claude'), may be empty
+        :param model_name: the specific model name (e.g., 'Claude 3.5 Sonnet')
+        :return: pricing or None
+        """
+        if model_name:
+            pricing = self._model_name_pricing.get(model_name)
+            if pricing:
+                return pricing
+
+        if not model:
+            return None
+
+        pricing = self._schema_pricing.get(model)
+        if pricing:
+            return pricing
+
+        # Sometimes model might be passed as 'anthropic claude' vs 'anthropic-claude'
+        for variant in (
+            model.replace('-', ' '),
+            model.replace(' ', '-'),
+            model.lower(),
+            model.lower().replace('-', ' '),
+            model.lower().replace(' ', '-'),
+        ):
+            pricing = self._schema_pricing.get(variant)
+            if pricing:
+                return pricing
+        return None
+
+
+_index_lock = threading.Lock()
+
+
+def get_pricing_index(model_instance, with_configurations: bool = False) -> PricingIndex:
+    """
+    Get the pricing index of a model instance, built on first use from its predefined models
+
+    :param model_instance: LLM or text embedding model instance
+    :param with_configurations: whether to include the individual LLM configuration files
+    :return: pricing index
+    """
+    # The indexes with and without the configuration pricing are cached separately
+    attribute = "_pricing_index_with_configurations" if with_configurations else "_pricing_index"
+    index = getattr(model_instance, attribute, None)
+    if index is None:
+        with _index_lock:
+            index = getattr(model_instance, attribute, None)
+            if index is None:
+                configuration_pricing = load_configuration_pricing() if with_configurations else None
+                index = PricingIndex(model_instance.predefined_models(), configuration_pricing)
+                setattr(model_instance, attribute, index)
+    return index
@@ -0,0 +1,191 @@
+"""
+Adaptive client-side rate limiting and throttling retries for Bedrock runtime calls.
+Each (region, model or inference profile) gets a token bucket whose rate is halved whenever Bedrock throttles
+a call and recovers additively over time, so bursts are smoothed out instead of failing back to Dify.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+from botocore.exceptions import ClientError
+
+from utils.concurrency import backoff_delay
+from utils.metrics import RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Rate limiter settings, can be overridden by environment variables of the plugin process
+_RATE_LIMIT_ENABLED = os.environ.get("BEDROCK_RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Initial and maximum rate (requests per second), the bucket only slows down once Bedrock throttles
+_MAX_RATE = float(os.environ.get("BEDROCK_RATE_LIMIT_MAX_RPS", "50"))
+_MIN_RATE = float(os.environ.get("BEDROCK_RATE_LIMIT_MIN_RPS", "0.5"))
+# Rate regained per second of successful calls after a throttle
+_RATE_RECOVERY = float(os.environ.get("BEDROCK_RATE_LIMIT_RECOVERY_RPS", "1"))
+# Total time a call may spend queued and retrying before the throttling error is raised
+_RETRY_DEADLINE = float(os.environ.get("BEDROCK_RETRY_DEADLINE_SECONDS", "30"))
+_MAX_RETRIES = int(os.environ.get("BEDROCK_MAX_THROTTLE_RETRIES", "4"))
+_MAX_BUCKETS = 1000
+
+# Attempts per call of the clients whose calls go through call_with_rate_limit: retries belong to the rate limiter,
+# botocore retrying underneath would multiply the attempts and hide throttling from the buckets
+CLIENT_MAX_ATTEMPTS = 1 if _RATE_LIMIT_ENABLED else None
+
+# Error codes of throttled calls
+THROTTLING_ERROR_CODES = frozenset({"ThrottlingException", "ServiceQuotaExceededException", "TooManyRequestsException"})
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call can't be admitted before its deadline"""
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket with additive-increase / multiplicative-decrease rate adaptation
+    """
+
+    def __init__(self, max_rate: float, min_rate: float, recovery: float):
+        self._max_rate = max_rate
+        self._min_rate = min(min_rate, max_rate)
+        self._recovery = recovery
+        self._rate = max_rate
+        self._tokens = max(1.0, max_rate)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        # Burst capacity follows the current rate, at least one call
+        self._tokens = min(max(1.0, self._rate), self._tokens + elapsed * self._rate)
+        if self._rate < self._max_rate:
+            self._rate = min(self._max_rate, self._rate + elapsed * self._recovery)
+
+    def acquire(self, deadline: float) -> float:
+        """
+        Take a token, waiting for one if needed
+
+        :param deadline: time.monotonic() deadline
+        :return: seconds spent waiting
+        """
+        started_at = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - started_at
+                wait = (1 - self._tokens) / self._rate
+            if now + wait > deadline:
+                raise DeadlineExceededError()
+            time.sleep(wait)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._rate = max(self._min_rate, self._rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            logger.debug(f"Throttled, rate lowered to {self._rate:.2f} rps")
+
+
+_buckets: OrderedDict = OrderedDict()
+_buckets_lock = threading.Lock()
+_stats = {"calls": 0, "throttles": 0, "retries": 0, "gave_up": 0, "queued_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _get_bucket(region: str, model_id: str) -> AdaptiveTokenBucket:
+    key = (region, model_id)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            while len(_buckets) >= _MAX_BUCKETS:
+                _buckets.popitem(last=False)
+            bucket = AdaptiveTokenBucket(_MAX_RATE, _MIN_RATE, _RATE_RECOVERY)
+            _buckets[key] = bucket
+        else:
+            _buckets.move_to_end(key)
+        return bucket
+
+
+def _count(**increments) -> None:
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def get_rate_limiter_stats() -> dict:
+    """
+    Get the rate limiter counters
+
+    :return: calls, throttles, retries, calls given up (deadline or retries exhausted), total seconds spent queued,
+        and the current rate of every bucket
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    with _buckets_lock:
+        stats["rates"] = {f"{region}/{model_id}": bucket.rate for (region, model_id), bucket in _buckets.items()}
+    return stats
+
+
+def call_with_rate_limit(
+    client,
+    model_id: str,
+    call: Callable[[], Any],
+    deadline_seconds: float = _RETRY_DEADLINE,
+    max_retries: int = _MAX_RETRIES,
+) -> Any:
+    """
+    Run a Bedrock runtime call through the rate limiter of its (region, model), retrying throttled calls
+    with jittered exponential backoff until the deadline. The last throttling ClientError is re-raised
+    once the deadline or the maximum number of retries is reached, other errors are raised immediately.
+
+    :param client: bedrock-runtime client the call is made with
+    :param model_id: model ID or inference profile ARN
+    :param call: function making the call
+    :param deadline_seconds: total time budget for queueing and retries
+    :param max_retries: maximum number of retries of throttled calls
+    :return: result of call
+    """
+    if not _RATE_LIMIT_ENABLED:
+        return call()
+
+    bucket = _get_bucket(client.meta.region_name, model_id)
+    deadline = time.monotonic() + deadline_seconds
+    attempt = 0
+    while True:
+        try:
+            queued = bucket.acquire(deadline)
+        except DeadlineExceededError:
+            _count(gave_up=1)
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": f"Client-side rate limit for {model_id} exceeded"}},
+                "RateLimit",
+            ) from None
+        _count(calls=1, queued_seconds=queued)
+
+        try:
+            return call()
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") not in THROTTLING_ERROR_CODES:
+                raise
+            bucket.on_throttle()
+            _count(throttles=1)
+
+            delay = backoff_delay(attempt)
+            if attempt >= max_retries or time.monotonic() + delay > deadline:
+                _count(gave_up=1)
+                raise
+
+        attempt += 1
+        _count(retries=1)
+        RETRIES.inc(model=model_id)
+        logger.info(f"Bedrock throttled {model_id}, retrying in {delay:.2f}s (attempt {attempt}/{max_retries})")
+        time.sleep(delay)
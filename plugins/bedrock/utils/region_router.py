@@ -0,0 +1,256 @@
+"""
+Health-aware routing of Bedrock invocations across regions.
+Every region keeps a rolling window of outcomes (error rate, p95 latency) and a circuit breaker;
+requests go to the healthiest region first and fail over to the next ones.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Router settings, can be overridden by environment variables of the plugin process
+_WINDOW_SIZE = int(os.environ.get("BEDROCK_ROUTER_WINDOW_SIZE", "100"))
+# The circuit opens after this many consecutive failures...
+_CONSECUTIVE_FAILURES = int(os.environ.get("BEDROCK_ROUTER_CONSECUTIVE_FAILURES", "5"))
+# ...or when the error rate of the window reaches this threshold, once the window holds enough samples
+_ERROR_RATE_THRESHOLD = float(os.environ.get("BEDROCK_ROUTER_ERROR_RATE_THRESHOLD", "0.5"))
+_MIN_SAMPLES = int(os.environ.get("BEDROCK_ROUTER_MIN_SAMPLES", "10"))
+# How long an open circuit rejects requests before letting a probe through
+_OPEN_SECONDS = float(os.environ.get("BEDROCK_ROUTER_OPEN_SECONDS", "30"))
+# Client-side queueing budget of a region that can still fail over, throttled calls aren't retried there
+FAILOVER_QUEUE_SECONDS = float(os.environ.get("BEDROCK_ROUTER_FAILOVER_QUEUE_SECONDS", "1"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def parse_regions(primary_region: str, failover_regions: Optional[str]) -> list[tuple[str, float]]:
+    """
+    Parse the failover regions of the provider credentials
+
+    :param primary_region: region of the credentials, always the first route
+    :param failover_regions: comma separated regions, optionally weighted, e.g. 'us-west-2:2, eu-west-1'
+    :return: (region, weight) routes without duplicates, in configured order, never empty
+    """
+    weights: dict[str, float] = {}
+    for item in (failover_regions or "").split(","):
+        region, _, weight = item.strip().partition(":")
+        region = region.strip()
+        if not region or region in weights:
+            continue
+        try:
+            weights[region] = float(weight) if weight.strip() else 1.0
+        except ValueError:
+            logger.warning(f"Ignoring invalid weight of failover region {region}: {weight}")
+            weights[region] = 1.0
+
+    # The primary region may be listed to give it a weight
+    routes = [(primary_region, weights.pop(primary_region, 1.0))] + list(weights.items())
+    routes = [(region, weight) for region, weight in routes if weight > 0]
+    # Weights of 0 everywhere leave nothing to route to, keep the primary region then
+    return routes or [(primary_region, 1.0)]
+
+
+class RegionHealth:
+    """Rolling outcome window and circuit breaker of a region"""
+
+    def __init__(self, window_size: int = _WINDOW_SIZE):
+        self._outcomes: deque = deque(maxlen=window_size)  # (succeeded, latency seconds)
+        self._consecutive_failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= _OPEN_SECONDS:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return sum(1 for succeeded, _ in self._outcomes if not succeeded) / len(self._outcomes)
+
+    def p95_latency(self) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(latency for succeeded, latency in self._outcomes if succeeded)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def is_available(self) -> bool:
+        """
+        Check if a request could be sent, without claiming the probe of a half-open circuit
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return state == CLOSED or (
+                state == HALF_OPEN and (not self._probing or now - self._probe_started_at >= _OPEN_SECONDS)
+            )
+
+    def allow_request(self) -> bool:
+        """
+        Check if a request may be sent, a half-open circuit lets a single probe through.
+        Only called right before the request is sent, so that the probe isn't claimed by a request going elsewhere.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            # A probe that never reported back (e.g. the region wasn't reached) expires like an open circuit
+            if state == HALF_OPEN and (not self._probing or now - self._probe_started_at >= _OPEN_SECONDS):
+                self._probing = True
+                self._probe_started_at = now
+                return True
+            return False
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info("Region recovered, closing circuit")
+                # The failures that opened the circuit would keep the region behind the others, start afresh
+                self._outcomes.clear()
+            self._outcomes.append((True, latency))
+            self._state = CLOSED
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._outcomes.append((False, 0.0))
+            self._consecutive_failures += 1
+            error_rate = sum(1 for succeeded, _ in self._outcomes if not succeeded) / len(self._outcomes)
+            if self._state == HALF_OPEN or self._consecutive_failures >= _CONSECUTIVE_FAILURES or (
+                len(self._outcomes) >= _MIN_SAMPLES and error_rate >= _ERROR_RATE_THRESHOLD
+            ):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class RegionRouter:
+    """
+    Orders the regions of a request by health. Half-open regions are tried first to probe them,
+    regions with an open circuit only last.
+    With equal weights the configured order is kept among healthy regions (ordered failover);
+    otherwise the first region is drawn at random, weighted by configured weight, success rate and latency.
+    """
+
+    def __init__(self):
+        self._health: dict[tuple, RegionHealth] = {}
+        self._lock = threading.Lock()
+
+    def health(self, key: str, region: str) -> RegionHealth:
+        """
+        :param key: what is routed, e.g. the model, so that one model's outage doesn't affect the others
+        :param region: AWS region
+        """
+        with self._lock:
+            health = self._health.get((key, region))
+            if health is None:
+                health = self._health[(key, region)] = RegionHealth()
+            return health
+
+    def plan(self, key: str, routes: list[tuple[str, float]]) -> list[str]:
+        """
+        Order the regions to try for a request
+
+        :param key: what is routed, e.g. the model
+        :param routes: (region, weight) in configured order
+        :return: regions, the preferred one first; a region must be claimed with allow_request before calling it
+        """
+        probes = []
+        available = []
+        unavailable = []
+        for region, weight in routes:
+            health = self.health(key, region)
+            if not health.is_available():
+                unavailable.append(region)
+            elif health.state == HALF_OPEN:
+                # Half-open regions are tried first, otherwise their probe would never be sent while others are healthy
+                probes.append(region)
+            else:
+                available.append((region, weight, health))
+
+        if not available:
+            # Every circuit is open, still try them rather than failing without a call
+            return probes + unavailable
+
+        if len({weight for _, weight, _ in available}) == 1:
+            # Ordered failover: unhealthy regions move behind the healthy ones, order is kept otherwise
+            ordered = sorted(available, key=lambda route: route[2].error_rate() >= _ERROR_RATE_THRESHOLD)
+            return probes + [region for region, _, _ in ordered] + unavailable
+
+        # Weighted spreading, adjusted by success rate and relative p95 latency
+        latencies = [health.p95_latency() for _, _, health in available]
+        fastest = min((latency for latency in latencies if latency), default=None)
+        effective_weights = []
+        for (region, weight, health), latency in zip(available, latencies):
+            effective_weight = weight * (1 - health.error_rate())
+            if fastest and latency:
+                effective_weight *= fastest / latency
+            effective_weights.append(max(effective_weight, 1e-6))
+
+        first = random.choices(range(len(available)), weights=effective_weights)[0]
+        rest = sorted(
+            (index for index in range(len(available)) if index != first),
+            key=lambda index: -effective_weights[index],
+        )
+        return probes + [available[first][0]] + [available[index][0] for index in rest] + unavailable
+
+    def allow_request(self, key: str, region: str) -> bool:
+        """
+        Claim a call to a region, see RegionHealth.allow_request
+        """
+        return self.health(key, region).allow_request()
+
+    def record_success(self, key: str, region: str, latency: float) -> None:
+        self.health(key, region).record_success(latency)
+
+    def record_failure(self, key: str, region: str) -> None:
+        health = self.health(key, region)
+        health.record_failure()
+        if health.state == OPEN:
+            logger.warning(f"Circuit open for {key} in {region}")
+
+    def stats(self) -> dict:
+        """
+        Get the health of every routed region
+
+        :return: '{key}/{region}' -> state, error rate and p95 latency
+        """
+        with self._lock:
+            items = list(self._health.items())
+        return {
+            f"{key}/{region}": {
+                "state": health.state,
+                "error_rate": health.error_rate(),
+                "p95_latency": health.p95_latency(),
+            }
+            for (key, region), health in items
+        }
+
+
+_router = RegionRouter()
+
+
+def get_region_router() -> RegionRouter:
+    """
+    Get the process-wide region router
+    """
+    return _router
@@ -0,0 +1,83 @@
+"""
+Offline benchmark of embedding response decoding: the same vectors encoded as JSON, .npy, raw float32 and msgpack
+(packed buffer and float lists) are decoded by decode_embeddings, reporting the cost per 1k vectors and body sizes.
+
+Run from the plugin directory: python benchmarks/bench_embedding_decode.py [--vectors N] [--dimensions D]
+Requires numpy, and msgpack for the msgpack formats.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.embedding_codec import (  # noqa: E402
+    FLOAT32_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    MSGPACK_CONTENT_TYPE,
+    NPY_CONTENT_TYPE,
+    decode_embeddings,
+    msgpack,
+)
+
+
+def encode_bodies(embeddings: np.ndarray) -> list[tuple[str, str, bytes]]:
+    """
+    :return: (format, content type, body) of every response format an endpoint may send
+    """
+    npy = io.BytesIO()
+    np.save(npy, embeddings)
+    bodies = [
+        ("json", JSON_CONTENT_TYPE, json.dumps({"embeddings": embeddings.tolist()}).encode()),
+        ("npy", NPY_CONTENT_TYPE, npy.getvalue()),
+        ("float32", FLOAT32_CONTENT_TYPE, embeddings.astype("<f4").tobytes()),
+    ]
+    if msgpack is not None:
+        bodies.append((
+            "msgpack, packed",
+            MSGPACK_CONTENT_TYPE,
+            msgpack.packb({"embeddings": embeddings.tobytes(), "dtype": "<f4", "shape": list(embeddings.shape)}),
+        ))
+        bodies.append((
+            "msgpack, lists",
+            MSGPACK_CONTENT_TYPE,
+            msgpack.packb({"embeddings": embeddings.tolist()}, use_single_float=True),
+        ))
+    return bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=1000, help="embeddings per response")
+    parser.add_argument("--dimensions", type=int, default=1024, help="dimensions of the embeddings")
+    parser.add_argument("--repeat", type=int, default=5, help="decodes per format, the best is reported")
+    args = parser.parse_args()
+
+    embeddings = np.random.default_rng(0).standard_normal((args.vectors, args.dimensions)).astype("<f4")
+    if msgpack is None:
+        print("msgpack isn't installed, skipping the msgpack formats")
+
+    print(f"{args.vectors} vectors of {args.dimensions} dimensions")
+    for name, content_type, body in encode_bodies(embeddings):
+        decoded = decode_embeddings(body, content_type, args.vectors)
+        if not np.allclose(np.asarray(decoded, dtype="<f4"), embeddings):
+            raise AssertionError(f"{name} decoded different embeddings")
+
+        seconds = float("inf")
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            decode_embeddings(body, content_type, args.vectors)
+            seconds = min(seconds, time.perf_counter() - started_at)
+        print(
+            f"{name:>16}: {len(body) / 1024 / 1024:8.2f} MiB, "
+            f"{seconds * 1000 / args.vectors * 1000:9.2f} ms per 1k vectors"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Offline benchmark of the stream framer: a recorded (or synthetic) streamed endpoint response is re-chunked
+the way containers and proxies deliver it, one frame per chunk, fragmented into small chunks or packed into
+large ones, and parsed by the StreamFramer and by the former str buffer parsing of the LLM stream.
+A single large frame fragmented into small chunks shows whether the cost stays linear in the frame size.
+
+Run from the plugin directory: python benchmarks/bench_stream_framer.py [--stream FILE] [--frames N]
+FILE holds the raw bytes of a streamed response, SSE ('data: {...}' lines) or newline-delimited JSON.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.stream_framer import iter_stream_frames  # noqa: E402
+
+
+def synthetic_stream(frames: int) -> bytes:
+    """
+    An OpenAI-compatible chat completion stream with tokens of a few characters, like vLLM or SGLang send
+    """
+    lines = []
+    for i in range(frames):
+        chunk = {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "benchmark",
+            "choices": [{"index": 0, "delta": {"content": f" word{i}"}, "finish_reason": None}],
+        }
+        lines.append(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+    lines.append(b"data: [DONE]\n\n")
+    return b"".join(lines)
+
+
+def large_frame_stream(size: int) -> bytes:
+    """
+    A single frame of about `size` bytes, e.g. a long completion sent at once, full of closing braces
+    """
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": "}" * size}}]}).encode() + b"\n\n"
+
+
+def per_frame_chunks(stream: bytes) -> list[bytes]:
+    return [frame + b"\n\n" for frame in stream.split(b"\n\n") if frame]
+
+
+def sized_chunks(stream: bytes, size: int) -> list[bytes]:
+    return [stream[start:start + size] for start in range(0, len(stream), size)]
+
+
+def legacy_frames(chunks: list[bytes]) -> list:
+    """
+    Former parsing of the LLM stream: every chunk decoded to str and appended to a buffer until it parses
+    """
+    frames = []
+    buffer = ""
+    for chunk_bytes in chunks:
+        if not chunk_bytes:
+            continue
+        try:
+            chunk_json_str = chunk_bytes.decode("utf-8")
+        except (UnicodeDecodeError, AttributeError):
+            continue
+        if chunk_json_str.startswith("data: "):
+            chunk_json_str = chunk_json_str[len("data: "):]
+        buffer += chunk_json_str
+        try:
+            data = json.loads(buffer.strip())
+        except json.JSONDecodeError:
+            logging.getLogger(__name__).info("json parse exception, content: {}".format(buffer))
+            continue
+        buffer = ""
+        frames.append(data)
+    return frames
+
+
+def best_of(repeat: int, parse, chunks: list[bytes]) -> tuple[int, float]:
+    seconds = float("inf")
+    frames = 0
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        frames = len(parse(chunks))
+        seconds = min(seconds, time.perf_counter() - started_at)
+    return frames, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stream", help="file with the raw bytes of a streamed response")
+    parser.add_argument("--frames", type=int, default=20000, help="frames of the synthetic stream")
+    parser.add_argument("--large-frame", type=int, default=1600 * 1024, help="bytes of the single large frame")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, the best is reported")
+    parser.add_argument("--legacy", action="store_true", help="also run the former parsing, slow on fragments")
+    args = parser.parse_args()
+    # The former parsing logs every chunk that doesn't parse yet, keep the logging cost but not the output
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+
+    if args.stream:
+        with open(args.stream, "rb") as f:
+            stream = f.read()
+    else:
+        stream = synthetic_stream(args.frames)
+
+    chunkings = [
+        ("one frame per chunk", per_frame_chunks(stream)),
+        ("fragmented, 16 B", sized_chunks(stream, 16)),
+        ("fragmented, 128 B", sized_chunks(stream, 128)),
+        ("packed, 64 KiB", sized_chunks(stream, 64 * 1024)),
+    ]
+    large_frame = large_frame_stream(args.large_frame)
+    parsers = [("framer", lambda chunks: list(iter_stream_frames(chunks)))]
+    if args.legacy:
+        parsers.append(("legacy", legacy_frames))
+
+    print(f"{len(stream) / 1024 / 1024:.1f} MiB stream")
+    for chunking, chunks in chunkings:
+        for name, parse in parsers:
+            frames, seconds = best_of(args.repeat, parse, chunks)
+            print(
+                f"{chunking:>20} ({len(chunks):7d} chunks), {name:>6}: {frames:7d} frames, "
+                f"{frames / seconds:10.0f} frames/s, {len(stream) / seconds / 1024 / 1024:8.1f} MiB/s"
+            )
+
+    # Rescanning or re-decoding the buffer on every fragment would be quadratic in the frame size
+    chunks = sized_chunks(large_frame, 64)
+    print(f"{len(large_frame) / 1024 / 1024:.1f} MiB frame")
+    for name, parse in parsers:
+        frames, seconds = best_of(args.repeat, parse, chunks)
+        print(
+            f"{'fragmented, 64 B':>20} ({len(chunks):7d} chunks), {name:>6}: {frames:7d} frames, "
+            f"{seconds * 1000:10.1f} ms, {len(large_frame) / seconds / 1024 / 1024:8.1f} MiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from dify_plugin import Plugin, DifyPluginEnv
 
+from utils.metrics import start_metrics_exporters
+
 plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=120))
 
 if __name__ == '__main__':
+    start_metrics_exporters()
     plugin.run()
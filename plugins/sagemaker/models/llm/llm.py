@@ -1,7 +1,12 @@
+import functools
+import hashlib
 import json
+import os
+import threading
 import time
 import logging
 import re
+from collections import OrderedDict
 from collections.abc import Generator, Iterator
 from typing import Any, Optional, Union, cast
 
@@ -48,8 +53,130 @@ from dify_plugin.errors.model import (
 )
 from dify_plugin.interfaces.model.large_language_model import LargeLanguageModel
 
+from utils.stream_framer import iter_stream_frames
+from utils.stream_timing import StreamTimer
+
 logger = logging.getLogger(__name__)
 
+# Ask OpenAI-compatible endpoints (vLLM, SGLang, TGI) for the token usage at the end of streams.
+# Off by default: containers that don't know stream_options reject the request; can be enabled by
+# environment variables of the plugin process, usage is estimated locally otherwise
+STREAM_INCLUDE_USAGE = os.environ.get("SAGEMAKER_STREAM_INCLUDE_USAGE", "false").lower() == "true"
+# Streamed chunks joined per completion token count, when the endpoint doesn't report the usage
+_TOKEN_COUNT_CHUNKS = 256
+_TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("SAGEMAKER_TOKEN_COUNT_CACHE_SIZE", "16384"))
+
+_PREDICTOR_POOL_SIZE = int(os.environ.get("SAGEMAKER_PREDICTOR_POOL_SIZE", "32"))
+
+_token_counts: OrderedDict = OrderedDict()
+_token_counts_lock = threading.Lock()
+_predictors: OrderedDict = OrderedDict()
+_predictors_lock = threading.Lock()
+
+
+def _refresh_token(assume_role_arn: str, aws_region: Optional[str]) -> dict:
+    " Refresh tokens by calling assume_role again "
+    params = {
+        "RoleArn": assume_role_arn,
+        "DurationSeconds": 3600,
+        "RoleSessionName": f"gain-sagemaker-session-{int(time.time())}"
+    }
+
+    boto_session = boto3.Session(region_name=aws_region)
+    sts_client = boto_session.client("sts")
+
+    response = sts_client.assume_role(**params).get("Credentials")
+
+    credentials = {
+        "access_key": response.get("AccessKeyId"),
+        "secret_key": response.get("SecretAccessKey"),
+        "token": response.get("SessionToken"),
+        "expiry_time": response.get("Expiration").isoformat(),
+    }
+
+    return credentials
+
+
+def _predictor_cache_key(credentials: dict) -> tuple:
+    # Secrets only appear hashed in the key
+    secret_digest = hashlib.sha256(
+        f"{credentials.get('aws_access_key_id') or ''}\x00{credentials.get('aws_secret_access_key') or ''}".encode()
+    ).hexdigest()
+    return (
+        credentials.get("aws_region"),
+        secret_digest,
+        credentials.get("assume_role_arn"),
+        credentials.get("sagemaker_endpoint"),
+    )
+
+
+def _create_predictor(credentials: dict) -> Predictor:
+    access_key = credentials.get("aws_access_key_id")
+    secret_key = credentials.get("aws_secret_access_key")
+    aws_region = credentials.get("aws_region")
+    assume_role_arn = credentials.get("assume_role_arn")
+
+    if aws_region:
+        if access_key and secret_key:
+            boto_session = boto3.Session(
+                aws_access_key_id=access_key, aws_secret_access_key=secret_key, region_name=aws_region
+            )
+        else:
+            boto_session = boto3.Session(region_name=aws_region)
+    else:
+        boto_session = boto3.Session()
+
+    # If assume role arn is specified, assume the role
+    if assume_role_arn:
+
+        from botocore.credentials import RefreshableCredentials
+        from botocore.session import get_session
+
+        session_credentials = RefreshableCredentials.create_from_metadata(
+            metadata=_refresh_token(assume_role_arn, aws_region),
+            refresh_using=functools.partial(_refresh_token, assume_role_arn, aws_region),
+            method="sts-assume-role"
+        )
+
+        session = get_session()
+        session._credentials = session_credentials
+        session.set_config_variable("region", aws_region)
+
+        boto_session = boto3.Session(botocore_session=session)
+
+    sagemaker_client = boto_session.client("sagemaker")
+    sagemaker_session = Session(boto_session=boto_session, sagemaker_client=sagemaker_client)
+    return Predictor(
+        endpoint_name=credentials.get("sagemaker_endpoint"),
+        sagemaker_session=sagemaker_session,
+        serializer=serializers.JSONSerializer(),
+    )
+
+
+def get_predictor(credentials: dict) -> Predictor:
+    """
+    Get the predictor of an endpoint from the pool, keyed by credentials and endpoint.
+    Predictors are never swapped while in use, so concurrent requests with different credentials are safe.
+
+    :param credentials: model credentials
+    :return: predictor
+    """
+    cache_key = _predictor_cache_key(credentials)
+    with _predictors_lock:
+        predictor = _predictors.get(cache_key)
+        if predictor is not None:
+            _predictors.move_to_end(cache_key)
+            return predictor
+
+    predictor = _create_predictor(credentials)
+    with _predictors_lock:
+        # Another request may have created it meanwhile
+        predictor = _predictors.setdefault(cache_key, predictor)
+        _predictors.move_to_end(cache_key)
+        while len(_predictors) > _PREDICTOR_POOL_SIZE:
+            _predictors.popitem(last=False)
+    return predictor
+
 
 def inference(predictor, messages: list[dict[str, Any]], params: dict[str, Any], stop: list, model_id: str, stream=False):
     """
@@ -77,6 +204,8 @@ def inference(predictor, messages: list[dict[str, Any]], params: dict[str, Any],
         "top_p": params.get("top_p", 0.9),
         "stop": stop,
     }
+    if stream and STREAM_INCLUDE_USAGE:
+        payload["stream_options"] = {"include_usage": True}
 
     if not stream:
         response = predictor.predict(payload)
@@ -91,14 +220,6 @@ class SageMakerLargeLanguageModel(LargeLanguageModel):
     Model class for Cohere large language model.
     """
 
-    sagemaker_session: Any = None
-    predictor: Any = None
-    sagemaker_endpoint: str | None = None
-    access_key: str = None
-    secret_key : str = None
-    aws_region : str = None
-    assume_role_arn : str = None 
-
     def _handle_chat_generate_response(
         self,
         model: str,
@@ -118,8 +239,13 @@ class SageMakerLargeLanguageModel(LargeLanguageModel):
 
         assistant_prompt_message = AssistantPromptMessage(content=resp_str, tool_calls=[])
 
-        prompt_tokens = self._num_tokens_from_messages(messages=prompt_messages, tools=tools)
-        completion_tokens = self._num_tokens_from_messages(messages=[assistant_prompt_message], tools=tools)
+        endpoint_usage = resp_obj.get("usage") or {}
+        if endpoint_usage.get("prompt_tokens") is not None and endpoint_usage.get("completion_tokens") is not None:
+            prompt_tokens = endpoint_usage["prompt_tokens"]
+            completion_tokens = endpoint_usage["completion_tokens"]
+        else:
+            prompt_tokens = self._num_tokens_from_messages(messages=prompt_messages, tools=tools)
+            completion_tokens = self._num_tokens_from_messages(messages=[assistant_prompt_message], tools=tools)
 
         usage = self._calc_response_usage(
             model=model, credentials=credentials, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
@@ -142,77 +268,62 @@ class SageMakerLargeLanguageModel(LargeLanguageModel):
         prompt_messages: list[PromptMessage],
         tools: list[PromptMessageTool],
         resp: Iterator[bytes],
+        timer: Optional[StreamTimer] = None,
     ) -> Generator:
         """
         handle stream chat generate response
         """
-        full_response = ""
-        buffer = ""
-        for chunk_bytes in resp:
-            # Handle None or empty chunks from sporadic model output anomalies
-            if not chunk_bytes:
-                logger.warning("Received empty or None chunk from SageMaker stream, skipping...")
+        timer = timer or StreamTimer(model)
+        completion_tokens = 0
+        # Streamed text is counted in large pieces, tokenizing every few-character chunk costs more than the parsing
+        pending_completion = []
+        endpoint_usage = None
+        final_chunk = None
+        # Stream state is local to the request, the model instance is shared by concurrent streams
+        reasoning_header_added = False
+        for data in iter_stream_frames(resp):
+            if not isinstance(data, dict):
+                logger.info("unexpected chunk, content: {}".format(data))
                 continue
-
             try:
-                chunk_json_str = chunk_bytes.decode("utf-8")
-            except (UnicodeDecodeError, AttributeError) as e:
-                logger.warning(f"Failed to decode chunk: {e}, skipping...")
-                continue
-            if chunk_json_str.startswith("data: "):
-                chunk_json_str = chunk_json_str[len("data: "):]
+                # With stream_options.include_usage the endpoint sends the usage in a last chunk without choices
+                if data.get("usage"):
+                    endpoint_usage = data["usage"]
+                if not data.get("choices"):
+                    continue
 
-            buffer += chunk_json_str
-            try:
-                data = json.loads(buffer.strip())
                 chunk_content = ''
-                if not hasattr(self, '_reasoning_header_added'):
-                    self._reasoning_header_added = False
+                delta = data["choices"][0].get("delta") or {}
+                if "reasoning_content" in delta:
+                    reasoning_content = delta["reasoning_content"]
 
-                if "reasoning_content" in data["choices"][0]["delta"]:
-                    reasoning_content = data["choices"][0]["delta"]["reasoning_content"]
-
-                    if not self._reasoning_header_added:
+                    if not reasoning_header_added:
                         chunk_content = "<think>\n" + reasoning_content
                         # Record that the marker has been added
-                        self._reasoning_header_added = True
+                        reasoning_header_added = True
                     else:
                         chunk_content = reasoning_content
 
-                elif "content" in data["choices"][0]["delta"]:
-                    chunk_content = data["choices"][0]["delta"]["content"]
+                elif "content" in delta:
+                    chunk_content = delta["content"] or ""
 
-                    if hasattr(self, '_reasoning_header_added') and self._reasoning_header_added:
+                    if reasoning_header_added:
                         chunk_content = "\n</think>\n\n" + chunk_content
-                        delattr(self, '_reasoning_header_added')
-                else:
-                    continue  
+                        reasoning_header_added = False
+                elif data["choices"][0].get("finish_reason") is None:
+                    continue
 
-                assistant_prompt_message = AssistantPromptMessage(content=chunk_content, tool_calls=[])
-                if data["choices"][0]["finish_reason"] is not None:
-                    temp_assistant_prompt_message = AssistantPromptMessage(content=full_response, tool_calls=[])
-                    prompt_tokens = self._num_tokens_from_messages(messages=prompt_messages, tools=tools)
-                    completion_tokens = self._num_tokens_from_messages(
-                        messages=[temp_assistant_prompt_message], tools=[]
-                    )
-                    usage = self._calc_response_usage(
-                        model=model,
-                        credentials=credentials,
-                        prompt_tokens=prompt_tokens,
-                        completion_tokens=completion_tokens,
-                    )
+                if chunk_content:
+                    timer.mark_token()
+                    pending_completion.append(chunk_content)
+                    if len(pending_completion) >= _TOKEN_COUNT_CHUNKS:
+                        completion_tokens += self._get_num_tokens_by_gpt2("".join(pending_completion))
+                        pending_completion.clear()
 
-                    yield LLMResultChunk(
-                        model=model,
-                        prompt_messages=prompt_messages,
-                        system_fingerprint=None,
-                        delta=LLMResultChunkDelta(
-                            index=0,
-                            message=assistant_prompt_message,
-                            finish_reason=data["choices"][0]["finish_reason"],
-                            usage=usage,
-                        ),
-                    )
+                assistant_prompt_message = AssistantPromptMessage(content=chunk_content, tool_calls=[])
+                if data["choices"][0].get("finish_reason") is not None:
+                    # Held back until the end of the stream, the usage may follow the finish reason
+                    final_chunk = (assistant_prompt_message, data["choices"][0]["finish_reason"])
                 else:
                     yield LLMResultChunk(
                         model=model,
@@ -220,35 +331,41 @@ class SageMakerLargeLanguageModel(LargeLanguageModel):
                         system_fingerprint=None,
                         delta=LLMResultChunkDelta(index=0, message=assistant_prompt_message),
                     )
+            except (AttributeError, KeyError, IndexError, TypeError):
+                logger.info("unexpected chunk, content: {}".format(data))
 
-                    full_response += chunk_content
-
-                buffer = ""
-            except (json.JSONDecodeError, KeyError, IndexError) as e:
-                logger.info("json parse exception, content: {}".format(buffer))
-                pass
-
-    def _refresh_token(self):
-        " Refresh tokens by calling assume_role again "
-        params = {
-            "RoleArn": self.assume_role_arn,
-            "DurationSeconds": 3600,
-            "RoleSessionName": f"gain-sagemaker-session-{int(time.time())}"
-        }
+        if final_chunk is None:
+            return
 
-        boto_session = boto3.Session(region_name=self.aws_region)
-        sts_client = boto_session.client("sts")
-
-        response = sts_client.assume_role(**params).get("Credentials")
-
-        credentials = {
-            "access_key": response.get("AccessKeyId"),
-            "secret_key": response.get("SecretAccessKey"),
-            "token": response.get("SessionToken"),
-            "expiry_time": response.get("Expiration").isoformat(),
-        }
+        assistant_prompt_message, finish_reason = final_chunk
+        if endpoint_usage and endpoint_usage.get("prompt_tokens") is not None:
+            prompt_tokens = endpoint_usage["prompt_tokens"]
+        else:
+            prompt_tokens = self._num_tokens_from_messages(messages=prompt_messages, tools=tools)
+        if endpoint_usage and endpoint_usage.get("completion_tokens") is not None:
+            completion_tokens = endpoint_usage["completion_tokens"]
+        elif pending_completion:
+            completion_tokens += self._get_num_tokens_by_gpt2("".join(pending_completion))
+        usage = self._calc_response_usage(
+            model=model,
+            credentials=credentials,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
 
-        return credentials
+        yield timer.attach(
+            LLMResultChunk(
+                model=model,
+                prompt_messages=prompt_messages,
+                system_fingerprint=None,
+                delta=LLMResultChunkDelta(
+                    index=0,
+                    message=assistant_prompt_message,
+                    finish_reason=finish_reason,
+                    usage=usage,
+                ),
+            )
+        )
 
     def _invoke(
         self,
@@ -274,67 +391,22 @@ class SageMakerLargeLanguageModel(LargeLanguageModel):
         :param user: unique user id
         :return: full response or stream response chunk generator result
         """
-        if self.access_key != credentials.get("aws_access_key_id") or \
-            self.secret_key != credentials.get("aws_secret_access_key") or \
-            self.aws_region != credentials.get("aws_region") or \
-            self.assume_role_arn != credentials.get("assume_role_arn") or \
-            self.sagemaker_endpoint != credentials.get("sagemaker_endpoint"):
-
-            # All settings are not changed
-            self.access_key = credentials.get("aws_access_key_id")
-            self.secret_key = credentials.get("aws_secret_access_key")
-            self.aws_region = credentials.get("aws_region")
-            self.assume_role_arn = credentials.get("assume_role_arn")
-            self.sagemaker_endpoint = credentials.get("sagemaker_endpoint")
-
-            boto_session = None
-            if self.aws_region:
-                if self.access_key and self.secret_key:
-                    boto_session = boto3.Session(
-                        aws_access_key_id=self.access_key, aws_secret_access_key=self.secret_key, region_name=self.aws_region
-                    )
-                else:
-                    boto_session = boto3.Session(region_name=self.aws_region)
-            else:
-                boto_session = boto3.Session()
-
-            # If assume role arn is specified, assume the role
-            if self.assume_role_arn:
-
-                from botocore.credentials import RefreshableCredentials
-                from botocore.session import get_session
-
-                session_credentials = RefreshableCredentials.create_from_metadata(
-                    metadata=self._refresh_token(),
-                    refresh_using=self._refresh_token,
-                    method="sts-assume-role"
-                )
-
-                session = get_session()
-                session._credentials = session_credentials
-                session.set_config_variable("region", self.aws_region)
-
-                boto_session = boto3.Session(botocore_session=session)
-
-            sagemaker_client = boto_session.client("sagemaker")
-            self.sagemaker_session = Session(boto_session=boto_session, sagemaker_client=sagemaker_client)
-            self.predictor = Predictor(
-                endpoint_name=self.sagemaker_endpoint,
-                sagemaker_session=self.sagemaker_session,
-                serializer=serializers.JSONSerializer(),
-            )
+        predictor = get_predictor(credentials)
 
         messages: list[dict[str, Any]] = [self._convert_prompt_message_to_dict(p) for p in prompt_messages]
+        timer = StreamTimer(model)
         response = inference(
-            predictor=self.predictor, messages=messages, params=model_parameters, stop=stop, model_id=credentials.get("model_id", ""), stream=stream
+            predictor=predictor, messages=messages, params=model_parameters, stop=stop, model_id=credentials.get("model_id", ""), stream=stream
         )
+        timer.mark_first_byte()
 
         if stream:
             if tools and len(tools) > 0:
                 raise InvokeBadRequestError(f"{model}'s tool calls does not support stream mode")
 
             return self._handle_chat_stream_response(
-                model=model, credentials=credentials, prompt_messages=prompt_messages, tools=tools, resp=response
+                model=model, credentials=credentials, prompt_messages=prompt_messages, tools=tools, resp=response,
+                timer=timer,
             )
         return self._handle_chat_generate_response(
             model=model, credentials=credentials, prompt_messages=prompt_messages, tools=tools, resp=response
@@ -382,11 +454,30 @@ class SageMakerLargeLanguageModel(LargeLanguageModel):
 
         return message_dict
 
+    def _get_num_tokens_cached(self, text: str) -> int:
+        """
+        Count the tokens of a text with gpt2, memoized so that the prompt of a conversation isn't re-tokenized
+        on every turn
+        """
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with _token_counts_lock:
+            count = _token_counts.get(key)
+            if count is not None:
+                _token_counts.move_to_end(key)
+                return count
+
+        count = self._get_num_tokens_by_gpt2(text)
+        with _token_counts_lock:
+            _token_counts[key] = count
+            while len(_token_counts) > _TOKEN_COUNT_CACHE_SIZE:
+                _token_counts.popitem(last=False)
+        return count
+
     def _num_tokens_from_messages(
         self, messages: list[PromptMessage], tools: list[PromptMessageTool], is_completion_model: bool = False
     ) -> int:
         def tokens(text: str):
-            return self._get_num_tokens_by_gpt2(text)
+            return self._get_num_tokens_cached(text)
 
         if is_completion_model:
             return sum(tokens(str(message.content)) for message in messages)
@@ -1,9 +1,12 @@
+import hashlib
+import heapq
 import json
 import logging
-import operator
+import os
 from typing import Any, Optional
 
 import boto3  # type: ignore
+from botocore.exceptions import ClientError  # type: ignore
 
 from dify_plugin import RerankModel
 from dify_plugin.entities.model import AIModelEntity, FetchFrom, I18nObject, ModelType
@@ -17,10 +20,76 @@ from dify_plugin.errors.model import (
     InvokeRateLimitError,
     InvokeServerUnavailableError,
 )
+from utils.concurrency import run_ordered
+from utils.metrics import record_rerank_cache_lookups
+from utils.rerank_cache import get_rerank_cache
+
+# Batching and concurrency, can be overridden by environment variables of the plugin process.
+# Documents are sent in batches of at most this many documents and payload bytes, scored concurrently
+BATCH_MAX_DOCS = int(os.environ.get("SAGEMAKER_RERANK_BATCH_MAX_DOCS", "32"))
+# SageMaker real-time endpoints accept payloads up to 6 MB
+BATCH_MAX_BYTES = int(os.environ.get("SAGEMAKER_RERANK_BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+MAX_CONCURRENCY = int(os.environ.get("SAGEMAKER_RERANK_MAX_CONCURRENCY", "4"))
+# Send the query once ({"query": ..., "docs": [...]}) instead of once per document ({"inputs": [...], "docs": [...]}).
+# The endpoint has to support it, as the handlers of the deployment notebooks do
+SINGLE_QUERY = os.environ.get("SAGEMAKER_RERANK_SINGLE_QUERY", "false").lower() == "true"
+
+_THROTTLING_ERROR_CODES = frozenset({"ThrottlingException", "TooManyRequestsException", "ServiceUnavailable"})
 
 logger = logging.getLogger(__name__)
 
 
+def batch_ranges(
+    query: str,
+    docs: list[str],
+    max_docs: int = BATCH_MAX_DOCS,
+    max_bytes: int = BATCH_MAX_BYTES,
+    single_query: bool = SINGLE_QUERY,
+) -> list[tuple[int, int]]:
+    """
+    Split documents into consecutive batches within the document count and payload size budgets.
+    A document exceeding the size budget on its own gets a batch of its own.
+
+    :param query: search query
+    :param docs: docs for reranking
+    :return: (start, end) index ranges of the batches, in input order
+    """
+    # JSON encoded size, including quotes and separator
+    query_size = len(query.encode("utf-8")) + 4
+    batches = []
+    start = 0
+    batch_bytes = query_size if single_query else 0
+    for index, doc in enumerate(docs):
+        size = len(doc.encode("utf-8")) + 4 + (0 if single_query else query_size)
+        if index > start and (index - start >= max_docs or batch_bytes + size > max_bytes):
+            batches.append((start, index))
+            start = index
+            batch_bytes = query_size if single_query else 0
+        batch_bytes += size
+    if start < len(docs):
+        batches.append((start, len(docs)))
+    return batches
+
+
+def select_top(
+    scores: list[float], top_n: Optional[int] = None, score_threshold: Optional[float] = None
+) -> list[tuple[int, float]]:
+    """
+    Select the best scored documents, keeping the input order among equal scores
+
+    :param scores: score of every document
+    :param top_n: number of documents to keep, all if None
+    :param score_threshold: minimum score of the kept documents
+    :return: (index, score) of the kept documents, best first
+    """
+    candidates = enumerate(scores)
+    if score_threshold is not None:
+        candidates = [(index, score) for index, score in candidates if score >= score_threshold]
+    if top_n is not None:
+        return heapq.nlargest(top_n, candidates, key=lambda candidate: candidate[1])
+    return sorted(candidates, key=lambda candidate: candidate[1], reverse=True)
+
+
 class SageMakerRerankModel(RerankModel):
     """
     Model class for SageMaker rerank model.
@@ -29,16 +98,30 @@ class SageMakerRerankModel(RerankModel):
     sagemaker_client: Any = None
 
     def _sagemaker_rerank(self, query_input: str, docs: list[str], rerank_endpoint: str):
-        inputs = [query_input] * len(docs)
-        response_model = self.sagemaker_client.invoke_endpoint(
-            EndpointName=rerank_endpoint,
-            Body=json.dumps({"inputs": inputs, "docs": docs}),
-            ContentType="application/json",
-        )
+        if SINGLE_QUERY:
+            body = {"query": query_input, "docs": docs}
+        else:
+            body = {"inputs": [query_input] * len(docs), "docs": docs}
+        try:
+            response_model = self.sagemaker_client.invoke_endpoint(
+                EndpointName=rerank_endpoint,
+                Body=json.dumps(body),
+                ContentType="application/json",
+            )
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in _THROTTLING_ERROR_CODES:
+                # Retried with backoff by run_ordered
+                raise InvokeRateLimitError(str(ex))
+            raise
         json_str = response_model["Body"].read().decode("utf8")
         json_obj = json.loads(json_str)
         scores = json_obj["scores"]
-        return scores if isinstance(scores, list) else [scores]
+        scores = scores if isinstance(scores, list) else [scores]
+        if len(scores) != len(docs):
+            raise InvokeServerUnavailableError(
+                f"Endpoint {rerank_endpoint} returned {len(scores)} scores for {len(docs)} docs"
+            )
+        return scores
 
     def _invoke(
         self,
@@ -88,26 +171,42 @@ class SageMakerRerankModel(RerankModel):
             line = 2
 
             sagemaker_endpoint = credentials.get("sagemaker_endpoint")
-            candidate_docs = []
 
-            scores = self._sagemaker_rerank(query, docs, sagemaker_endpoint)
-            for idx in range(len(scores)):
-                candidate_docs.append({"content": docs[idx], "score": scores[idx]})
-
-            sorted(candidate_docs, key=operator.itemgetter("score"), reverse=True)
+            def score_documents(texts: list[str]) -> list[float]:
+                results = run_ordered(
+                    lambda batch: self._sagemaker_rerank(query, texts[batch[0]:batch[1]], sagemaker_endpoint),
+                    batch_ranges(query, texts),
+                    max_concurrency=MAX_CONCURRENCY,
+                )
+                scores = []
+                for batch_scores in results:
+                    scores.extend(batch_scores)
+                return scores
 
-            line = 3
-            rerank_documents = []
-            for idx, result in enumerate(candidate_docs):
-                rerank_document = RerankDocument(
-                    index=idx, text=result.get("content"), score=result.get("score", -100.0)
+            # Only the documents that were not scored against the query yet are sent to the endpoint
+            rerank_cache = get_rerank_cache()
+            if rerank_cache:
+                # Endpoint names are per account, scores of one account's endpoint don't apply to another's.
+                # Secrets only appear hashed in the namespace
+                access_key = credentials.get("aws_access_key_id") or ""
+                secret_key = credentials.get("aws_secret_access_key") or ""
+                credentials_digest = hashlib.sha256(f"{access_key}\x00{secret_key}".encode()).hexdigest()
+                cache_namespace = (sagemaker_endpoint, credentials.get("aws_region"), credentials_digest)
+                scores = rerank_cache.score(
+                    cache_namespace,
+                    query,
+                    docs,
+                    score_documents,
+                    on_lookup=lambda hits, misses: record_rerank_cache_lookups(sagemaker_endpoint, hits, misses),
                 )
+            else:
+                scores = score_documents(docs)
 
-                if score_threshold is not None:
-                    if rerank_document.score >= score_threshold:
-                        rerank_documents.append(rerank_document)
-                else:
-                    rerank_documents.append(rerank_document)
+            line = 3
+            rerank_documents = [
+                RerankDocument(index=index, text=docs[index], score=score)
+                for index, score in select_top(scores, top_n, score_threshold)
+            ]
 
             return RerankResult(model=model, docs=rerank_documents)
 
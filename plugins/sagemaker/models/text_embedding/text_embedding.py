@@ -1,10 +1,11 @@
-import itertools
 import json
 import logging
+import os
 import time
 from typing import Any, Optional
 
 import boto3  # type: ignore
+from botocore.exceptions import ClientError  # type: ignore
 from dify_plugin.entities.model import (
     AIModelEntity,
     EmbeddingInputType,
@@ -25,19 +26,73 @@ from dify_plugin.errors.model import (
     InvokeServerUnavailableError,
 )
 from dify_plugin.interfaces.model.text_embedding_model import TextEmbeddingModel
+from utils.concurrency import run_ordered
+from utils.embedding_codec import accept_header, decode_embeddings
+from utils.embedding_cache import get_embedding_cache
 
 BATCH_SIZE = 20
 CONTEXT_SIZE = 8192
 
+# Batching and concurrency, can be overridden by environment variables of the plugin process.
+# Batches are filled up to a token budget (estimated), a payload size and a number of texts, whichever comes first
+BATCH_MAX_TOKENS = int(os.environ.get("SAGEMAKER_EMBEDDING_BATCH_MAX_TOKENS", "16384"))
+# SageMaker real-time endpoints accept payloads up to 6 MB
+BATCH_MAX_BYTES = int(os.environ.get("SAGEMAKER_EMBEDDING_BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+BATCH_MAX_TEXTS = int(os.environ.get("SAGEMAKER_EMBEDDING_BATCH_MAX_TEXTS", "128"))
+# Batches sent to the endpoint at the same time
+MAX_CONCURRENCY = int(os.environ.get("SAGEMAKER_EMBEDDING_MAX_CONCURRENCY", "4"))
+
+# Errors of a batch the endpoint couldn't take as a whole, the batch is split in halves and retried
+_SPLITTABLE_ERROR_CODES = frozenset({"ModelError", "ValidationError"})
+_THROTTLING_ERROR_CODES = frozenset({"ThrottlingException", "TooManyRequestsException", "ServiceUnavailable"})
+
 logger = logging.getLogger(__name__)
 
 
-def batch_generator(generator, batch_size):
-    while True:
-        batch = list(itertools.islice(generator, batch_size))
-        if not batch:
-            break
-        yield batch
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def budget_batches(
+    texts: list[str],
+    max_tokens: int = BATCH_MAX_TOKENS,
+    max_bytes: int = BATCH_MAX_BYTES,
+    max_texts: int = BATCH_MAX_TEXTS,
+) -> list[list[str]]:
+    """
+    Group texts into consecutive batches within the token, payload size and count budgets.
+    A text exceeding a budget on its own gets a batch of its own.
+
+    :param texts: texts to embed
+    :return: batches, in input order
+    """
+    batches = []
+    batch: list[str] = []
+    batch_tokens = 0
+    batch_bytes = 0
+    for text in texts:
+        tokens = _estimate_tokens(text)
+        # Size in the request body, quoted and escaped like json.dumps sends it (non-ASCII as \uXXXX), with separator
+        size = len(json.dumps(text)) + 2
+        if batch and (
+            batch_tokens + tokens > max_tokens or batch_bytes + size > max_bytes or len(batch) >= max_texts
+        ):
+            batches.append(batch)
+            batch, batch_tokens, batch_bytes = [], 0, 0
+        batch.append(text)
+        batch_tokens += tokens
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _is_payload_rejected(ex: ClientError) -> bool:
+    if ex.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 413:
+        return True
+    if ex.response.get("OriginalStatusCode") == 413:
+        return True
+    return ex.response.get("Error", {}).get("Code") in _SPLITTABLE_ERROR_CODES
 
 
 class SageMakerEmbeddingModel(TextEmbeddingModel):
@@ -52,10 +107,39 @@ class SageMakerEmbeddingModel(TextEmbeddingModel):
             EndpointName=endpoint_name,
             Body=json.dumps({"inputs": content_list, "parameters": {}, "is_query": False, "instruction": ""}),
             ContentType="application/json",
+            Accept=accept_header(),
         )
-        json_str = response_model["Body"].read().decode("utf8")
-        json_obj = json.loads(json_str)
-        embeddings = json_obj["embeddings"]
+        return decode_embeddings(response_model["Body"].read(), response_model.get("ContentType"), len(content_list))
+
+    def _embed_batch(self, sm_client, endpoint_name, content_list: list[str]) -> list[list[float]]:
+        """
+        Embed a batch, splitting it in halves when the endpoint rejects it as too large or fails on it
+
+        :param sm_client: sagemaker-runtime client
+        :param endpoint_name: endpoint name
+        :param content_list: texts of the batch
+        :return: embeddings, in input order
+        """
+        try:
+            embeddings = self._sagemaker_embedding(sm_client, endpoint_name, content_list)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in _THROTTLING_ERROR_CODES:
+                # Retried with backoff by run_ordered
+                raise InvokeRateLimitError(str(ex))
+            if len(content_list) <= 1 or not _is_payload_rejected(ex):
+                raise
+            middle = len(content_list) // 2
+            logger.info(
+                f"Endpoint {endpoint_name} rejected a batch of {len(content_list)} texts, retrying as two batches"
+            )
+            return self._embed_batch(sm_client, endpoint_name, content_list[:middle]) + self._embed_batch(
+                sm_client, endpoint_name, content_list[middle:]
+            )
+
+        if len(embeddings) != len(content_list):
+            raise InvokeServerUnavailableError(
+                f"Endpoint {endpoint_name} returned {len(embeddings)} embeddings for {len(content_list)} texts"
+            )
         return embeddings
 
     def _invoke(
@@ -102,13 +186,26 @@ class SageMakerEmbeddingModel(TextEmbeddingModel):
             line = 3
             truncated_texts = [item[:CONTEXT_SIZE] for item in texts]
 
-            batches = batch_generator((text for text in truncated_texts), batch_size=BATCH_SIZE)
-            all_embeddings = []
+            def embed_texts(batch_texts: list[str]) -> tuple[list[list[float]], int]:
+                batches = budget_batches(batch_texts)
+                results = run_ordered(
+                    lambda batch: self._embed_batch(self.sagemaker_client, sagemaker_endpoint, batch),
+                    batches,
+                    max_concurrency=MAX_CONCURRENCY,
+                )
+                embeddings = []
+                for batch_embeddings in results:
+                    embeddings.extend(batch_embeddings)
+                return embeddings, 0
 
             line = 4
-            for batch in batches:
-                embeddings = self._sagemaker_embedding(self.sagemaker_client, sagemaker_endpoint, batch)
-                all_embeddings.extend(embeddings)
+            # Only the texts that are not cached yet are sent to the endpoint
+            embedding_cache = get_embedding_cache()
+            if embedding_cache:
+                cache_namespace = (credentials.get("aws_region"), sagemaker_endpoint, None, input_type)
+                all_embeddings, _ = embedding_cache.embed(cache_namespace, truncated_texts, embed_texts)
+            else:
+                all_embeddings, _ = embed_texts(truncated_texts)
 
             line = 5
             # calc usage
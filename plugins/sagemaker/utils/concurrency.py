@@ -0,0 +1,150 @@
+"""
+Bounded, order-preserving concurrent execution for SageMaker batch workloads
+"""
+import logging
+import random
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from dify_plugin.errors.model import InvokeRateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Retry settings for throttled calls
+_MAX_THROTTLE_RETRIES = 5
+_BASE_BACKOFF_SECONDS = 0.5
+_MAX_BACKOFF_SECONDS = 20.0
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of in-flight calls with additive-increase / multiplicative-decrease:
+    the limit is halved whenever a call is throttled and grows by one after a streak of
+    successful calls, never exceeding the configured maximum.
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        self._max_concurrency = max(1, max_concurrency)
+        self._min_concurrency = max(1, min(min_concurrency, self._max_concurrency))
+        self._limit = self._max_concurrency
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= self._limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._limit = max(self._min_concurrency, self._limit // 2)
+                self._successes = 0
+                logger.debug(f"Throttled, concurrency limit lowered to {self._limit}")
+            elif self._limit < self._max_concurrency:
+                self._successes += 1
+                if self._successes >= self._limit:
+                    self._limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class InFlightBytesBudget:
+    """
+    Caps the total payload size of in-flight calls. A single payload larger than the budget
+    is still admitted once nothing else is in flight, so oversized items can't deadlock.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._in_flight_bytes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        with self._condition:
+            while self._in_flight_bytes > 0 and self._in_flight_bytes + size > self._max_bytes:
+                self._condition.wait()
+            self._in_flight_bytes += size
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self._in_flight_bytes -= size
+            self._condition.notify_all()
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(_MAX_BACKOFF_SECONDS, _BASE_BACKOFF_SECONDS * (2 ** attempt)))
+
+
+def run_ordered(
+    func: Callable[[Any], Any],
+    items: Sequence[Any],
+    max_concurrency: int,
+    max_retries: int = _MAX_THROTTLE_RETRIES,
+    size_of: Optional[Callable[[Any], int]] = None,
+    max_in_flight_bytes: Optional[int] = None,
+) -> list:
+    """
+    Apply func to every item on a bounded thread pool and return the results in input order.
+    Calls failing with InvokeRateLimitError are retried with jittered exponential backoff and
+    lower the number of concurrent calls; any other error cancels the pending calls and is re-raised.
+
+    :param func: function called with a single item
+    :param items: items to process
+    :param max_concurrency: maximum number of concurrent calls
+    :param max_retries: maximum number of retries per item on throttling
+    :param size_of: function returning the payload size of an item, required by max_in_flight_bytes
+    :param max_in_flight_bytes: maximum total payload size of in-flight calls
+    :return: results, in the same order as items
+    """
+    if not items:
+        return []
+
+    limiter = AdaptiveConcurrencyLimiter(min(max_concurrency, len(items)))
+    bytes_budget = InFlightBytesBudget(max_in_flight_bytes) if size_of and max_in_flight_bytes else None
+
+    def call(item):
+        size = size_of(item) if bytes_budget else 0
+        attempt = 0
+        while True:
+            if bytes_budget:
+                bytes_budget.acquire(size)
+            limiter.acquire()
+            throttled = False
+            try:
+                return func(item)
+            except InvokeRateLimitError:
+                throttled = True
+                if attempt >= max_retries:
+                    raise
+            finally:
+                limiter.release(throttled=throttled)
+                if bytes_budget:
+                    bytes_budget.release(size)
+
+            delay = backoff_delay(attempt)
+            attempt += 1
+            logger.info(f"Throttled, retrying in {delay:.2f}s (attempt {attempt}/{max_retries})")
+            time.sleep(delay)
+
+    if len(items) == 1 or max_concurrency <= 1:
+        return [call(item) for item in items]
+
+    executor = ThreadPoolExecutor(max_workers=min(max_concurrency, len(items)))
+    try:
+        futures = [executor.submit(call, item) for item in items]
+        return [future.result() for future in futures]
+    finally:
+        # On failure, don't start the calls that are still queued
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,226 @@
+"""
+Content-addressed cache for text embeddings.
+Vectors are keyed by (model, dimension, input type, sha256(text)) and stored as arrays of doubles,
+identical to the vectors the model returned, in an in-memory LRU tier, optionally backed by an on-disk SQLite tier shared across workers.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, can be overridden by environment variables of the plugin process
+_CACHE_ENABLED = os.environ.get("SAGEMAKER_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+_CACHE_MAX_ENTRIES = int(os.environ.get("SAGEMAKER_EMBEDDING_CACHE_MAX_ENTRIES", "4096"))
+# Path of the SQLite file of the disk tier, the disk tier is disabled if empty
+_CACHE_PATH = os.environ.get("SAGEMAKER_EMBEDDING_CACHE_PATH", "")
+
+
+def make_cache_key(namespace: tuple, text: str) -> str:
+    """
+    Build the cache key of a text
+
+    :param namespace: (region, endpoint, dimension, input type)
+    :param text: text to embed
+    :return: sha256 hex digest
+    """
+    text_digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{namespace!r}:{text_digest}".encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """In-memory LRU tier"""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, array]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def put_many(self, items: dict[str, array]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """On-disk tier, a single SQLite file that can be shared by several worker processes"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._connection.commit()
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, array]:
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # Stay well below SQLite's limit on the number of query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("d")
+                    vector.frombytes(blob)
+                    found[key] = vector
+        return found
+
+    def put_many(self, items: dict[str, array]) -> None:
+        if not items:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in items.items()],
+            )
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache. Lookups go to the memory tier first, then to the disk tier
+    (disk hits are promoted to memory); new vectors are written to both tiers.
+    """
+
+    def __init__(self, memory: MemoryBackend, disk: Optional[SQLiteBackend] = None):
+        self._memory = memory
+        self._disk = disk
+        self._stats_lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            lookups = self._memory_hits + self._disk_hits + self._misses
+            hits = self._memory_hits + self._disk_hits
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self._disk:
+            self._disk.clear()
+
+    def _lookup(self, keys: list[str]) -> dict[str, array]:
+        found = self._memory.get_many(keys)
+        memory_hits = len(found)
+        disk_hits = 0
+        if self._disk and len(found) < len(keys):
+            try:
+                from_disk = self._disk.get_many([key for key in keys if key not in found])
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache lookup failed: {str(e)}")
+                from_disk = {}
+            if from_disk:
+                self._memory.put_many(from_disk)
+                found.update(from_disk)
+                disk_hits = len(from_disk)
+        with self._stats_lock:
+            self._memory_hits += memory_hits
+            self._disk_hits += disk_hits
+            self._misses += len(keys) - memory_hits - disk_hits
+        return found
+
+    def _store(self, items: dict[str, array]) -> None:
+        self._memory.put_many(items)
+        if self._disk:
+            try:
+                self._disk.put_many(items)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache write failed: {str(e)}")
+
+    def embed(
+        self,
+        namespace: tuple,
+        texts: list[str],
+        embed_texts: Callable[[list[str]], tuple[list[list[float]], int]],
+    ) -> tuple[list[list[float]], int]:
+        """
+        Embed texts, only sending the cache misses (deduplicated) to embed_texts
+
+        :param namespace: (region, endpoint, dimension, input type)
+        :param texts: texts to embed
+        :param embed_texts: function embedding a list of texts, returning (embeddings, token usage)
+        :return: embeddings in the same order as texts, token usage of the misses
+        """
+        keys = [make_cache_key(namespace, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        token_usage = 0
+        fresh: dict[str, list[float]] = {}
+        if missing:
+            embeddings, token_usage = embed_texts(list(missing.values()))
+            fresh = dict(zip(missing.keys(), embeddings))
+            self._store({key: array("d", vector) for key, vector in fresh.items()})
+
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits, stats: {self.stats()}")
+        return [fresh[key] if key in fresh else found[key].tolist() for key in keys], token_usage
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Get the process-wide embedding cache, None if caching is disabled
+    """
+    global _embedding_cache
+    if not _CACHE_ENABLED:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            disk = None
+            if _CACHE_PATH:
+                try:
+                    disk = SQLiteBackend(_CACHE_PATH)
+                except sqlite3.Error as e:
+                    logger.warning(f"Embedding disk cache disabled, failed to open {_CACHE_PATH}: {str(e)}")
+            _embedding_cache = EmbeddingCache(MemoryBackend(_CACHE_MAX_ENTRIES), disk)
+        return _embedding_cache
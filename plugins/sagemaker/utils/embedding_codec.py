@@ -0,0 +1,118 @@
+"""
+Decoding of embedding endpoint responses.
+Endpoints answer with JSON ({"embeddings": [[...], ...]}) unless a compact format is negotiated through the Accept
+header: a NumPy .npy array, raw little-endian float32 or msgpack. Compact responses are read in place with
+numpy.frombuffer instead of parsing every float from text; an endpoint that doesn't support them keeps
+answering JSON, which is always accepted.
+"""
+import io
+import json
+import logging
+import math
+import os
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+NPY_CONTENT_TYPE = "application/x-npy"
+FLOAT32_CONTENT_TYPE = "application/x-float32"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+RESPONSE_FORMATS = {
+    "json": JSON_CONTENT_TYPE,
+    "npy": NPY_CONTENT_TYPE,
+    "float32": FLOAT32_CONTENT_TYPE,
+    "msgpack": MSGPACK_CONTENT_TYPE,
+}
+
+# Preferred response format (json, npy, float32 or msgpack), can be overridden by an environment variable
+# of the plugin process. Off by default: endpoints built on other containers may reject an unknown Accept header
+_RESPONSE_FORMAT = os.environ.get("SAGEMAKER_EMBEDDING_RESPONSE_FORMAT", "json").lower()
+
+
+def accept_header(response_format: str = _RESPONSE_FORMAT) -> str:
+    """
+    Build the Accept header of an embedding request
+
+    :param response_format: preferred response format
+    :return: the preferred content type with JSON as fallback, JSON only if the format can't be decoded here
+    """
+    content_type = RESPONSE_FORMATS.get(response_format)
+    if content_type is None:
+        logger.warning(f"Unknown embedding response format {response_format}, using json")
+        return JSON_CONTENT_TYPE
+    if content_type == JSON_CONTENT_TYPE:
+        return JSON_CONTENT_TYPE
+    if np is None or (content_type == MSGPACK_CONTENT_TYPE and msgpack is None):
+        logger.warning(f"Embedding response format {response_format} needs numpy and msgpack installed, using json")
+        return JSON_CONTENT_TYPE
+    return f"{content_type}, {JSON_CONTENT_TYPE};q=0.5"
+
+
+def _to_rows(array, count: int) -> list[list[float]]:
+    if array.ndim == 1 and count:
+        # Raw values, one vector per text
+        if array.size % count:
+            raise ValueError(f"Got {array.size} values for {count} embeddings")
+        array = array.reshape(count, -1)
+    if array.ndim != 2:
+        raise ValueError(f"Expected a 2-D array of embeddings, got shape {array.shape}")
+    return array.tolist()
+
+
+def _decode_npy(body: bytes, count: int) -> list[list[float]]:
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    else:
+        return _to_rows(np.load(io.BytesIO(body), allow_pickle=False), count)
+    if dtype.hasobject:
+        raise ValueError("Object arrays are not accepted as embeddings")
+    array = np.frombuffer(body, dtype=dtype, count=math.prod(shape), offset=stream.tell())
+    return _to_rows(array.reshape(shape, order="F" if fortran_order else "C"), count)
+
+
+def _decode_msgpack(body: bytes, count: int) -> list[list[float]]:
+    obj = msgpack.unpackb(body)
+    embeddings = obj["embeddings"]
+    if isinstance(embeddings, (bytes, bytearray)):
+        # Packed buffer with its layout, e.g. {"embeddings": <bytes>, "dtype": "<f4", "shape": [n, d]}
+        array = np.frombuffer(embeddings, dtype=np.dtype(obj.get("dtype", "<f4")))
+        if obj.get("shape"):
+            array = array.reshape(obj["shape"])
+        return _to_rows(array, count)
+    return embeddings
+
+
+def decode_embeddings(body: bytes, content_type: Optional[str], count: int) -> list[list[float]]:
+    """
+    Decode the embeddings of a response according to its content type
+
+    :param body: response body
+    :param content_type: content type of the response, JSON when unknown
+    :param count: number of texts of the request
+    :return: embeddings
+    """
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if np is not None:
+        if media_type == NPY_CONTENT_TYPE:
+            return _decode_npy(body, count)
+        if media_type == FLOAT32_CONTENT_TYPE:
+            return _to_rows(np.frombuffer(body, dtype="<f4"), count)
+        if media_type == MSGPACK_CONTENT_TYPE and msgpack is not None:
+            return _decode_msgpack(body, count)
+    return json.loads(body)["embeddings"]
@@ -0,0 +1,283 @@
+"""
+In-process metrics of SageMaker endpoint calls: counters and histograms labelled by model.
+They can be scraped in Prometheus text format from a local HTTP endpoint and/or pushed to an
+OpenTelemetry collector over OTLP/HTTP (JSON), both off by default.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Metrics settings, can be overridden by environment variables of the plugin process
+_METRICS_ENABLED = os.environ.get("SAGEMAKER_METRICS_ENABLED", "true").lower() == "true"
+# Port of the Prometheus endpoint (/metrics), disabled when empty
+_PROMETHEUS_PORT = os.environ.get("SAGEMAKER_METRICS_PROMETHEUS_PORT", "")
+_PROMETHEUS_ADDRESS = os.environ.get("SAGEMAKER_METRICS_PROMETHEUS_ADDRESS", "127.0.0.1")
+# OTLP/HTTP metrics endpoint of a collector, e.g. http://localhost:4318/v1/metrics, disabled when empty
+_OTLP_ENDPOINT = os.environ.get("SAGEMAKER_METRICS_OTLP_ENDPOINT", "")
+_OTLP_INTERVAL = float(os.environ.get("SAGEMAKER_METRICS_OTLP_INTERVAL_SECONDS", "60"))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+GAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> list[tuple[dict, object]]:
+        with self._lock:
+            items = [(key, self._copy(value)) for key, value in self._values.items()]
+        return [(dict(zip(self.label_names, key)), value) for key, value in items]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels) -> None:
+        if not _METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram(_Metric):
+    """Histogram with fixed bucket upper bounds"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...], buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        if not _METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, the last one is +Inf; then count and sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += 1
+            state[2] += value
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class MetricsRegistry:
+    """Named metrics and their exporters"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._started_at_ns = time.time_ns()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, label_names: tuple[str, ...] = ("model",)) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: tuple[str, ...] = ("model",),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def metrics(self) -> list[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_prometheus(self) -> str:
+        """
+        Render every metric in Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.samples():
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+                    continue
+                bucket_counts, count, total = value
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric.name}_bucket{_format_labels(dict(labels, le=bound))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_otlp(self) -> dict:
+        """
+        Build an OTLP ExportMetricsServiceRequest (JSON encoding) of every metric, with cumulative temporality
+        """
+        now_ns = str(time.time_ns())
+        start_ns = str(self._started_at_ns)
+        otlp_metrics = []
+        for metric in self.metrics():
+            data_points = []
+            for labels, value in metric.samples():
+                point = {
+                    "attributes": [{"key": key, "value": {"stringValue": val}} for key, val in labels.items()],
+                    "startTimeUnixNano": start_ns,
+                    "timeUnixNano": now_ns,
+                }
+                if metric.kind == "counter":
+                    point["asDouble"] = float(value)
+                else:
+                    bucket_counts, count, total = value
+                    point.update(
+                        count=str(count),
+                        sum=total,
+                        bucketCounts=[str(bucket_count) for bucket_count in bucket_counts],
+                        explicitBounds=list(metric.buckets),
+                    )
+                data_points.append(point)
+
+            otlp_metric = {"name": metric.name, "description": metric.description}
+            if metric.kind == "counter":
+                otlp_metric["sum"] = {"dataPoints": data_points, "aggregationTemporality": 2, "isMonotonic": True}
+            else:
+                otlp_metric["histogram"] = {"dataPoints": data_points, "aggregationTemporality": 2}
+            otlp_metrics.append(otlp_metric)
+
+        return {
+            "resourceMetrics": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "dify-plugin-sagemaker"}}]},
+                "scopeMetrics": [{"scope": {"name": __name__}, "metrics": otlp_metrics}],
+            }]
+        }
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Get the process-wide metrics registry
+    """
+    return _registry
+
+
+# Metrics of the SageMaker endpoint calls
+TIME_TO_FIRST_BYTE = _registry.histogram("sagemaker_time_to_first_byte_seconds", "Time from request to response start")
+TIME_TO_FIRST_TOKEN = _registry.histogram("sagemaker_time_to_first_token_seconds", "Time from request to first content token")
+INTER_TOKEN_LATENCY = _registry.histogram(
+    "sagemaker_inter_token_latency_seconds", "Time between content chunks of a stream", buckets=GAP_BUCKETS
+)
+GENERATION_DURATION = _registry.histogram(
+    "sagemaker_generation_duration_seconds", "Time from first to last content token of a stream"
+)
+RERANK_CACHE_LOOKUPS = _registry.counter(
+    "sagemaker_rerank_cache_lookups_total", "Rerank score cache lookups by result (hit, miss)", ("model", "result")
+)
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def record_rerank_cache_lookups(model: str, hits: int, misses: int) -> None:
+    """
+    Count the lookups of the rerank score cache
+
+    :param model: model the scores belong to
+    :param hits: documents whose score was cached
+    :param misses: documents sent to the model
+    """
+    RERANK_CACHE_LOOKUPS.inc(hits, model=model, result="hit")
+    RERANK_CACHE_LOOKUPS.inc(misses, model=model, result="miss")
+
+
+def _push_otlp_forever(endpoint: str, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            request = urllib.request.Request(
+                endpoint,
+                data=json.dumps(_registry.to_otlp()).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except Exception as e:
+            logger.warning(f"Failed to export metrics to {endpoint}: {e}")
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_metrics_exporters(prometheus_port: Optional[str] = _PROMETHEUS_PORT, otlp_endpoint: Optional[str] = _OTLP_ENDPOINT) -> None:
+    """
+    Start the configured exporters in background threads, once per process
+
+    :param prometheus_port: port of the Prometheus endpoint, disabled when empty
+    :param otlp_endpoint: OTLP/HTTP metrics endpoint, disabled when empty
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started or not _METRICS_ENABLED:
+            return
+        _exporters_started = True
+
+    if prometheus_port:
+        server = ThreadingHTTPServer((_PROMETHEUS_ADDRESS, int(prometheus_port)), _PrometheusHandler)
+        threading.Thread(target=server.serve_forever, name="sagemaker-metrics-prometheus", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on {_PROMETHEUS_ADDRESS}:{prometheus_port}/metrics")
+    if otlp_endpoint:
+        threading.Thread(
+            target=_push_otlp_forever, args=(otlp_endpoint, _OTLP_INTERVAL), name="sagemaker-metrics-otlp", daemon=True
+        ).start()
+        logger.info(f"Exporting metrics to {otlp_endpoint} every {_OTLP_INTERVAL:.0f}s")
@@ -0,0 +1,132 @@
+"""
+Incremental framing of streamed endpoint responses.
+Handles Server-Sent Events ('data: {...}' lines) and newline-delimited JSON on raw bytes: chunks are appended
+to a byte buffer, only their new bytes are searched for line breaks, and every complete frame is JSON-decoded
+exactly once, however the frames are fragmented across chunks or packed into a single chunk.
+"""
+import json
+import logging
+from collections.abc import Iterable, Iterator
+from typing import Union
+
+logger = logging.getLogger(__name__)
+
+DONE_SENTINEL = b"[DONE]"
+# SSE fields other than data, and comments, carry no payload
+_IGNORED_PREFIXES = (b":", b"event:", b"id:", b"retry:")
+
+_json_decoder = json.JSONDecoder()
+
+
+def _decode_json(data: bytes):
+    # Streams are UTF-8, json.loads would detect the encoding of every frame
+    return _json_decoder.decode(data.decode("utf-8"))
+
+
+class StreamFramer:
+    """Splits a byte stream into decoded JSON frames"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # Bytes of the buffer already searched for a line break, only the bytes of new chunks are searched
+        self._scanned = 0
+        self.done = False
+
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> list:
+        """
+        Add a chunk of the stream
+
+        :param data: raw chunk
+        :return: frames completed by this chunk
+        """
+        if self.done or not data:
+            return []
+        carried_over = len(self._buffer)
+        buffer = self._buffer
+        buffer += data
+
+        frames = []
+        start = 0
+        end = buffer.find(b"\n", self._scanned)
+        if end >= 0:
+            with memoryview(buffer) as view:
+                while end >= 0 and not self.done:
+                    # Blank lines separate SSE events
+                    if end > start:
+                        self._decode_line(bytes(view[start:end]), frames)
+                    start = end + 1
+                    end = buffer.find(b"\n", start)
+            if self.done:
+                buffer.clear()
+                return frames
+            del buffer[:start]
+        self._scanned = len(buffer)
+
+        # Some containers send one JSON document per chunk without a line break. Only tried when the chunk holds
+        # the whole partial line, a document fragmented across chunks waits for its line break or the end
+        if buffer and (start or not carried_over) and buffer.rstrip().endswith(b"}"):
+            frame = self._try_decode(bytes(buffer))
+            if frame is not None:
+                frames.append(frame)
+                buffer.clear()
+                self._scanned = 0
+        return frames
+
+    def close(self) -> list:
+        """
+        Flush the frame left without a trailing line break at the end of the stream
+
+        :return: remaining frames
+        """
+        frames = []
+        if self._buffer and not self.done:
+            self._decode_line(bytes(self._buffer), frames)
+        self._buffer.clear()
+        self._scanned = 0
+        return frames
+
+    def _decode_line(self, line: bytes, frames: list) -> None:
+        if line.startswith(b"data:"):
+            line = line[5:].strip()
+        else:
+            line = line.strip()
+            if not line or line.startswith(_IGNORED_PREFIXES):
+                return
+            if line.startswith(b"data:"):
+                line = line[5:].lstrip()
+        if line == DONE_SENTINEL:
+            self.done = True
+            return
+        try:
+            frames.append(_decode_json(line))
+        except ValueError:
+            logger.warning(f"Skipping undecodable stream frame: {line[:200]!r}")
+
+    @staticmethod
+    def _try_decode(data: bytes):
+        data = data.strip()
+        if data.startswith(b"data:"):
+            data = data[5:].lstrip()
+        try:
+            return _decode_json(data)
+        except ValueError:
+            return None
+
+
+def iter_stream_frames(chunks: Iterable[bytes]) -> Iterator:
+    """
+    Decode the JSON frames of a streamed response, stopping at the [DONE] sentinel
+
+    :param chunks: raw chunks of the stream
+    :return: decoded frames
+    """
+    framer = StreamFramer()
+    for chunk in chunks:
+        # Handle None or empty chunks from sporadic model output anomalies
+        if not chunk:
+            logger.warning("Received empty or None chunk from SageMaker stream, skipping...")
+            continue
+        yield from framer.feed(chunk)
+        if framer.done:
+            return
+    yield from framer.close()
@@ -0,0 +1,108 @@
+"""
+Timing of streamed LLM invocations.
+The request send time, the first byte of the response, and the first and last content tokens are recorded,
+so that slow chats can be told apart: waiting for the response (client or service queueing), model think time
+before the first token, or slow generation. The timings are added to the usage of the final chunk
+and recorded as histograms.
+"""
+import time
+from typing import Optional
+
+from dify_plugin.entities.model.llm import LLMResultChunk, LLMResultChunkDelta, LLMUsage
+
+from utils.metrics import GENERATION_DURATION, INTER_TOKEN_LATENCY, TIME_TO_FIRST_BYTE, TIME_TO_FIRST_TOKEN
+
+
+class TimedLLMUsage(LLMUsage):
+    """LLM usage with the stream timings, in seconds"""
+
+    time_to_first_byte: Optional[float] = None
+    time_to_first_token: Optional[float] = None
+    time_to_generate: Optional[float] = None
+    inter_token_latency: Optional[float] = None
+    max_inter_token_latency: Optional[float] = None
+
+
+class TimedLLMResultChunkDelta(LLMResultChunkDelta):
+    usage: Optional[TimedLLMUsage] = None
+
+
+class TimedLLMResultChunk(LLMResultChunk):
+    """Final chunk of a stream, its usage is serialized with the timings"""
+
+    delta: TimedLLMResultChunkDelta
+
+
+class StreamTimer:
+    """Timestamps (time.perf_counter()) of a streamed invocation"""
+
+    def __init__(self, model: str, sent_at: Optional[float] = None):
+        """
+        :param model: model the histograms are labelled with
+        :param sent_at: when the request was sent, now if None
+        """
+        self._model = model
+        self.sent_at = sent_at if sent_at is not None else time.perf_counter()
+        self.first_byte_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self._gap_count = 0
+        self._gap_total = 0.0
+        self._gap_max = 0.0
+        self._timings: Optional[dict] = None
+
+    def mark_first_byte(self) -> None:
+        """Record that the response started, i.e. its headers were received"""
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+
+    def mark_token(self) -> None:
+        """Record a content chunk"""
+        now = time.perf_counter()
+        if self.first_byte_at is None:
+            self.first_byte_at = now
+        if self.first_token_at is None:
+            self.first_token_at = now
+            TIME_TO_FIRST_TOKEN.observe(now - self.sent_at, model=self._model)
+        else:
+            gap = now - self.last_token_at
+            self._gap_count += 1
+            self._gap_total += gap
+            self._gap_max = max(self._gap_max, gap)
+            INTER_TOKEN_LATENCY.observe(gap, model=self._model)
+        self.last_token_at = now
+
+    def finish(self) -> dict:
+        """
+        Close the timings of the stream, the histograms are only recorded on the first call
+
+        :return: the timings, None where the stream didn't get that far
+        """
+        if self._timings is not None:
+            return self._timings
+
+        self._timings = {
+            "time_to_first_byte": self.first_byte_at - self.sent_at if self.first_byte_at is not None else None,
+            "time_to_first_token": self.first_token_at - self.sent_at if self.first_token_at is not None else None,
+            "time_to_generate": self.last_token_at - self.first_token_at if self.first_token_at is not None else None,
+            "inter_token_latency": self._gap_total / self._gap_count if self._gap_count else None,
+            "max_inter_token_latency": self._gap_max if self._gap_count else None,
+        }
+        if self._timings["time_to_first_byte"] is not None:
+            TIME_TO_FIRST_BYTE.observe(self._timings["time_to_first_byte"], model=self._model)
+        if self._timings["time_to_generate"] is not None:
+            GENERATION_DURATION.observe(self._timings["time_to_generate"], model=self._model)
+        return self._timings
+
+    def attach(self, chunk: LLMResultChunk) -> LLMResultChunk:
+        """
+        Add the timings to the usage of the final chunk
+
+        :param chunk: final chunk of the stream
+        :return: the chunk with a TimedLLMUsage, unchanged if it has no usage
+        """
+        if chunk.delta.usage is None:
+            return chunk
+        usage = TimedLLMUsage(**dict(chunk.delta.usage), **self.finish())
+        delta = TimedLLMResultChunkDelta(**{**dict(chunk.delta), "usage": usage})
+        return TimedLLMResultChunk(**{**dict(chunk), "delta": delta})